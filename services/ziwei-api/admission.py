@@ -0,0 +1,207 @@
+"""计算路径的准入控制与截止时间
+
+只有真正需要调用计算引擎的请求（缓存未命中且是 single-flight 的领头者）才经过这里：
+- 同时进行的计算不超过 max_active，其余请求在有上限的队列中等待
+- 队列已满时立即拒绝（Overloaded，附带建议的 Retry-After 秒数），不再堆积 30 秒的等待
+- 每个请求带一个截止时间（Deadline），排队和计算共用这个时间；排队超时抛出 DeadlineExceeded
+
+同步（线程）与异步（asgi.py 的事件循环）两种调用方共用同一组名额。
+守护模式（ZIWEI_ENGINE=daemon）下名额由计算守护进程统一管理，web worker 经 worker_admit / worker_admit_async 调用时不再占用名额，
+否则同一次计算会在两处排队，Retry-After 也会按两倍的队列估算。
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+
+from engine_pool import _env_int
+
+
+class Overloaded(Exception):
+    """等待队列已满"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"计算队列已满，请 {retry_after} 秒后重试")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(TimeoutError):
+    """请求的截止时间已过"""
+
+
+class Deadline:
+    """请求的截止时间（单调时钟）"""
+
+    __slots__ = ('timeout', 'at')
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.at = time.monotonic() + timeout
+
+    def remaining(self):
+        return max(self.at - time.monotonic(), 0.0)
+
+    @property
+    def expired(self):
+        return time.monotonic() >= self.at
+
+
+class _Waiter:
+    __slots__ = ('wake', 'granted')
+
+    def __init__(self, wake):
+        self.wake = wake
+        self.granted = False
+
+
+class Admission:
+    def __init__(self, max_active=2, max_queued=32):
+        self.max_active = max(1, max_active)
+        self.max_queued = max(0, max_queued)
+        self.active = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+        # 单次计算占用名额的平均时间（指数滑动平均），用于估算 Retry-After
+        self._service_time = 1.0
+        self.stats = {"admitted": 0, "queued": 0, "rejected": 0, "expired": 0}
+
+    @classmethod
+    def from_env(cls, default_active=2):
+        return cls(
+            max_active=_env_int('ZIWEI_MAX_ACTIVE', default_active),
+            max_queued=_env_int('ZIWEI_MAX_QUEUE', 32),
+        )
+
+    def retry_after(self):
+        """按当前排队长度与平均计算时间估算多少秒后可以重试"""
+        waves = (len(self._waiters) + 1) / self.max_active
+        return max(1, math.ceil(waves * self._service_time))
+
+    def _enter(self, wake):
+        """拿到名额返回 None；需要排队时返回 _Waiter；队列已满抛出 Overloaded"""
+        with self._lock:
+            if self.active < self.max_active:
+                self.active += 1
+                self.stats["admitted"] += 1
+                return None
+            if len(self._waiters) >= self.max_queued:
+                self.stats["rejected"] += 1
+                raise Overloaded(self.retry_after())
+            waiter = _Waiter(wake)
+            self._waiters.append(waiter)
+            self.stats["queued"] += 1
+            return waiter
+
+    def _abandon(self, waiter):
+        """放弃排队；如果名额已经转交给这个等待者，返回 True（调用方需要归还名额）"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            self.stats["expired"] += 1
+            return False
+
+    def _leave(self, held):
+        with self._lock:
+            self._service_time = 0.8 * self._service_time + 0.2 * held
+            # 名额直接转交给队首的等待者，避免被新来的请求插队
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                self.stats["admitted"] += 1
+                waiter.wake()
+            else:
+                self.active -= 1
+
+    @contextmanager
+    def admit(self, deadline):
+        """在线程中等待名额，截止时间前拿不到名额时抛出 DeadlineExceeded"""
+        event = threading.Event()
+        waiter = self._enter(event.set)
+        if waiter is not None and not event.wait(deadline.remaining()) and not self._abandon(waiter):
+            raise DeadlineExceeded("排队等待超过截止时间")
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._leave(time.monotonic() - started)
+
+    @asynccontextmanager
+    async def admit_async(self, deadline):
+        """admit 的协程版本；被取消（客户端断开）时同样放弃排队"""
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        waiter = self._enter(wake)
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(granted), deadline.remaining())
+            except asyncio.TimeoutError:
+                if not self._abandon(waiter):
+                    raise DeadlineExceeded("排队等待超过截止时间")
+            except asyncio.CancelledError:
+                if self._abandon(waiter):
+                    self._leave(0.0)
+                raise
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._leave(time.monotonic() - started)
+
+    def snapshot(self):
+        info = dict(self.stats)
+        info.update({
+            "active": self.active,
+            "waiting": len(self._waiters),
+            "max_active": self.max_active,
+            "max_queued": self.max_queued,
+        })
+        return info
+
+
+def parse_timeout(value, limit):
+    """
+    解析请求自带的超时秒数（X-Request-Timeout 头或 timeout 参数），不超过 limit
+    未提供时返回 limit；格式错误抛出 ValueError
+    """
+    if value is None or value == '':
+        return limit
+    timeout = float(value)
+    if not math.isfinite(timeout) or timeout <= 0:
+        raise ValueError(f"timeout 必须是正数: {value!r}")
+    return min(timeout, limit)
+
+
+_admission = None
+_admission_lock = threading.Lock()
+
+
+def get_admission():
+    """进程内单例；默认同时计算数与进程池大小相同"""
+    global _admission
+    if _admission is None:
+        with _admission_lock:
+            if _admission is None:
+                _admission = Admission.from_env(default_active=_env_int('ZIWEI_POOL_SIZE', 2))
+    return _admission
+
+
+def _admits_locally():
+    return os.environ.get('ZIWEI_ENGINE') != 'daemon'
+
+
+def worker_admit(deadline):
+    """web worker 侧的准入控制（线程）；守护模式下直接放行，由守护进程排队"""
+    return get_admission().admit(deadline) if _admits_locally() else nullcontext()
+
+
+def worker_admit_async(deadline):
+    """worker_admit 的协程版本"""
+    return get_admission().admit_async(deadline) if _admits_locally() else nullcontext()
@@ -0,0 +1,496 @@
+"""列式命盘分析库
+
+把预计算命盘库（chart_store.py）中一段日期范围的命盘展开成按列存放的 NumPy 数组，
+每行是一张命盘（日期 × 时辰 × 性别，is_leap=false），用于在整个人群上做向量化的筛选与分组计数，
+例如「1990–1995 年出生者紫微在命宫的比例（按性别）」「五行局按月份的分布」。
+
+列（每列一个 .npy 文件，按 mmap 加载，多个 worker 共享同一份页缓存）：
+    date / year / month / hour / gender                 出生日期（yyyymmdd）、年、月、时辰索引、性别
+    five_elements_class / soul / body / zodiac / sign   字典编码（meta.json 中的 dictionaries）
+    soul_palace / body_palace                           命宫、身宫地支，字典编码
+    palace_name / palace_branch / palace_stem           [行, 12]，星曜词表编码
+    major_star / major_brightness / major_mutagen       [行, 12, 3]
+    minor_star / minor_mutagen                          [行, 12, 8]
+星曜、宫位、亮度、四化共用命盘库的小词表（vocab，uint8），与命盘库记录中的编码一致，构建时无需重新编码。
+
+用法：
+    python analytics.py build --store charts.bin --output analytics --start 1900-01-01 --end 1999-12-31
+    python analytics.py info analytics
+    python analytics.py query analytics '{"filter": {"start": "1990-01-01", "end": "1995-12-31"},
+                                          "match": {"stars": [{"star": "紫微", "palace": "命宫"}]},
+                                          "group_by": ["gender"]}'
+
+查询加上 "scores": true 时各分组附带五大主题的平均分（与 /calculate 返回的 topics 分数一致）。
+每行的分数按 topics.py 的规则在构建时算好（topic_scores.npy，[行, 5]）；
+旧的分析库或计分规则版本不一致时，第一次查询分数时在内存中重新计算一次。
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+from chart_store import BASIC_FIELDS, GENDERS, PALACE_COUNT, SLOTS_PER_DAY, SUMMARY_FIELDS, ChartStore
+from topics import SCORING_VERSION, TOPICS, score_codes, vocab_tables
+
+FORMAT_VERSION = 1
+
+# 字典编码的文本列：列名 -> (所在部分, 字段)
+TEXT_COLUMNS = {
+    "five_elements_class": ("basic_info", "five_elements_class"),
+    "soul": ("basic_info", "soul"),
+    "body": ("basic_info", "body"),
+    "zodiac": ("basic_info", "zodiac"),
+    "sign": ("basic_info", "sign"),
+    "soul_palace": ("summary", "soul_palace"),
+    "body_palace": ("summary", "body_palace"),
+}
+ROW_COLUMNS = ("date", "year", "month", "hour", "gender")
+PALACE_COLUMNS = ("palace_name", "palace_branch", "palace_stem")
+STAR_COLUMNS = ("major_star", "major_brightness", "major_mutagen", "minor_star", "minor_mutagen")
+COLUMNS = ROW_COLUMNS + tuple(TEXT_COLUMNS) + PALACE_COLUMNS + STAR_COLUMNS
+
+# 可用于分组的列；另有 palace_of:<星曜>（该星所在宫位）
+GROUP_COLUMNS = ("year", "month", "hour", "gender") + tuple(TEXT_COLUMNS)
+NONE_CODE = 255
+# 分组格子数上限（各分组列基数之积）
+MAX_GROUP_CELLS = 1 << 22
+# 构建时每次处理的天数
+BUILD_CHUNK_DAYS = 366
+# 主题计分时每次处理的行数（控制临时数组的大小）
+SCORE_CHUNK_ROWS = 1 << 16
+
+logger = logging.getLogger(__name__)
+
+
+class QueryError(ValueError):
+    """查询参数错误"""
+
+
+def record_dtype(max_major, max_minor):
+    """命盘库定长记录（chart_store.record_struct）对应的 NumPy 结构类型，紧凑排列"""
+    palace = np.dtype([
+        ('name', 'u1'), ('branch', 'u1'), ('stem', 'u1'), ('n_major', 'u1'), ('n_minor', 'u1'),
+        ('adjective', '<u2'), ('major', 'u1', (max_major, 3)), ('minor', 'u1', (max_minor, 2)),
+    ])
+    return np.dtype([
+        ('texts', '<u4', (len(BASIC_FIELDS) + len(SUMMARY_FIELDS),)),
+        ('palaces', palace, (PALACE_COUNT,)),
+    ])
+
+
+def _text_index(column):
+    section, field = TEXT_COLUMNS[column]
+    if section == "basic_info":
+        return BASIC_FIELDS.index(field)
+    return len(BASIC_FIELDS) + SUMMARY_FIELDS.index(field)
+
+
+def build(store, output, start=None, end=None, progress=True):
+    """把命盘库 [start, end] 范围（默认整个命盘库）展开为列式分析库，返回行数"""
+    start = max(start or store.start, store.start)
+    end = min(end or store.end, store.end)
+    days = (end - start).days + 1
+    if days <= 0:
+        raise ValueError(f"日期范围不在命盘库内: {store.start} ~ {store.end}")
+    rows_per_day = 12 * len(GENDERS)
+    rows = days * rows_per_day
+    first_day = (start - store.start).days
+
+    buf = store._buf
+    dtype = record_dtype(store._max_major, store._max_minor)
+    if dtype.itemsize != store._record.size:
+        raise ValueError("记录长度与命盘库不一致")
+    records = np.frombuffer(buf, dtype=dtype, count=store.record_count, offset=store._records_offset)
+    index = np.frombuffer(buf, dtype='<u4', count=store.days * SLOTS_PER_DAY, offset=store._index_offset)
+
+    os.makedirs(output, exist_ok=True)
+    shapes = {
+        "date": ((), 'u4'), "year": ((), 'u2'), "month": ((), 'u1'), "hour": ((), 'u1'), "gender": ((), 'u1'),
+        **{name: ((), 'u1') for name in TEXT_COLUMNS},
+        **{name: ((PALACE_COUNT,), 'u1') for name in PALACE_COLUMNS},
+        "major_star": ((PALACE_COUNT, store._max_major), 'u1'),
+        "major_brightness": ((PALACE_COUNT, store._max_major), 'u1'),
+        "major_mutagen": ((PALACE_COUNT, store._max_major), 'u1'),
+        "minor_star": ((PALACE_COUNT, store._max_minor), 'u1'),
+        "minor_mutagen": ((PALACE_COUNT, store._max_minor), 'u1'),
+    }
+    columns = {
+        name: np.lib.format.open_memmap(os.path.join(output, f"{name}.npy"), mode='w+',
+                                        dtype=dtype_, shape=(rows,) + shape)
+        for name, (shape, dtype_) in shapes.items()
+    }
+
+    # 文本编号（命盘库 texts 表） -> 字典编码
+    codes = {name: np.full(len(store._texts), -1, dtype=np.int32) for name in TEXT_COLUMNS}
+    dictionaries = {name: [] for name in TEXT_COLUMNS}
+    hours = np.tile(np.repeat(np.arange(12, dtype='u1'), len(GENDERS)), BUILD_CHUNK_DAYS)
+    genders = np.tile(np.arange(len(GENDERS), dtype='u1'), 12 * BUILD_CHUNK_DAYS)
+    started = time.monotonic()
+
+    for offset in range(0, days, BUILD_CHUNK_DAYS):
+        n_days = min(BUILD_CHUNK_DAYS, days - offset)
+        lo, hi = offset * rows_per_day, (offset + n_days) * rows_per_day
+        day0 = first_day + offset
+        # 每天 48 个槽位 = 12 时辰 × 2 性别 × is_leap，只取 is_leap=0
+        slots = index[day0 * SLOTS_PER_DAY:(day0 + n_days) * SLOTS_PER_DAY].reshape(-1, 2)[:, 0]
+        if (slots == 0xFFFFFFFF).any():
+            raise ValueError(f"命盘库在 {store.start + timedelta(days=day0)} 之后有缺失的记录")
+        chunk = records[slots]
+
+        day_list = [store.start + timedelta(days=day0 + i) for i in range(n_days)]
+        columns["date"][lo:hi] = np.repeat([d.year * 10000 + d.month * 100 + d.day for d in day_list], rows_per_day)
+        columns["year"][lo:hi] = np.repeat([d.year for d in day_list], rows_per_day)
+        columns["month"][lo:hi] = np.repeat([d.month for d in day_list], rows_per_day)
+        columns["hour"][lo:hi] = hours[:hi - lo]
+        columns["gender"][lo:hi] = genders[:hi - lo]
+
+        for name in TEXT_COLUMNS:
+            ids = chunk['texts'][:, _text_index(name)]
+            table = codes[name]
+            for text_id in np.unique(ids):
+                if table[text_id] < 0:
+                    if len(dictionaries[name]) >= NONE_CODE:
+                        raise ValueError(f"{name} 的取值超过 {NONE_CODE} 种")
+                    table[text_id] = len(dictionaries[name])
+                    dictionaries[name].append(store._texts[text_id])
+            columns[name][lo:hi] = table[ids]
+
+        palaces = chunk['palaces']
+        columns["palace_name"][lo:hi] = palaces['name']
+        columns["palace_branch"][lo:hi] = palaces['branch']
+        columns["palace_stem"][lo:hi] = palaces['stem']
+        columns["major_star"][lo:hi] = palaces['major'][..., 0]
+        columns["major_brightness"][lo:hi] = palaces['major'][..., 1]
+        columns["major_mutagen"][lo:hi] = palaces['major'][..., 2]
+        columns["minor_star"][lo:hi] = palaces['minor'][..., 0]
+        columns["minor_mutagen"][lo:hi] = palaces['minor'][..., 1]
+
+        if progress:
+            print(f"  {offset + n_days}/{days} 天, {time.monotonic() - started:.1f}s", file=sys.stderr)
+
+    for column in columns.values():
+        column.flush()
+    vocab = list(store._vocab)
+    scores = np.lib.format.open_memmap(os.path.join(output, "topic_scores.npy"), mode='w+',
+                                       dtype=np.int8, shape=(rows, len(TOPICS)))
+    compute_topic_scores(columns, vocab_tables(vocab), scores)
+    scores.flush()
+    # 星曜名分主星 / 辅星两组，查询时只扫描可能包含该星的数组
+    major_names = np.unique(columns["major_star"][:]).tolist()
+    minor_names = np.unique(columns["minor_star"][:]).tolist()
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "rows": rows,
+        "genders": list(GENDERS),
+        "vocab": vocab,
+        "major_stars": [vocab[i] for i in major_names if vocab[i]],
+        "minor_stars": [vocab[i] for i in minor_names if vocab[i]],
+        "dictionaries": dictionaries,
+        "scoring_version": SCORING_VERSION,
+    }
+    with open(os.path.join(output, "meta.json"), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return rows
+
+
+def compute_topic_scores(columns, tables, out):
+    """按连续的行块计算五大主题分数，写入 out [行, 主题数]"""
+    names = ("palace_name",) + STAR_COLUMNS
+    for lo in range(0, len(out), SCORE_CHUNK_ROWS):
+        hi = min(lo + SCORE_CHUNK_ROWS, len(out))
+        out[lo:hi] = score_codes(tables, *(np.asarray(columns[name][lo:hi]) for name in names))
+    return out
+
+
+def _any_last(hits):
+    """沿最后一维做 OR；最后一维很短（宫位 12、星位 3/8），逐片 OR 比 ndarray.any(axis=-1) 快一个数量级"""
+    result = hits[..., 0].copy()
+    for i in range(1, hits.shape[-1]):
+        result |= hits[..., i]
+    return result
+
+
+def _as_list(value):
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+class AnalyticsStore:
+    """只读列式分析库"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"不支持的分析库版本: {path}")
+        self.meta = meta
+        self.rows = meta["rows"]
+        self.start = date.fromisoformat(meta["start"])
+        self.end = date.fromisoformat(meta["end"])
+        self.vocab = meta["vocab"]
+        self.vocab_ids = {name: code for code, name in enumerate(self.vocab)}
+        self.genders = meta["genders"]
+        self.major_stars = set(meta["major_stars"])
+        self.minor_stars = set(meta["minor_stars"])
+        self.dictionaries = meta["dictionaries"]
+        self.columns = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r') for name in COLUMNS}
+        self._scores = None
+        self._scores_lock = threading.Lock()
+
+    def info(self):
+        return {
+            "path": self.path,
+            "start": self.start.isoformat(),
+            "end": self.end.isoformat(),
+            "rows": self.rows,
+            "group_by": list(GROUP_COLUMNS) + ["palace_of:<星曜>"],
+            "topics": list(TOPICS),
+            "dictionaries": self.dictionaries,
+        }
+
+    # ---- 编码 ----
+
+    def _vocab_code(self, value):
+        """词表编码；不存在的名字返回 -1（与任何编码都不相等）"""
+        return self.vocab_ids.get(value, -1)
+
+    def _gender_code(self, value):
+        value = {"male": "男", "female": "女", "M": "男", "F": "女"}.get(value, value)
+        if value not in self.genders:
+            raise QueryError(f"无效的性别: {value}")
+        return self.genders.index(value)
+
+    def _column_codes(self, column, values):
+        values = _as_list(values)
+        if column == "gender":
+            return [self._gender_code(v) for v in values]
+        if column in ("year", "month", "hour"):
+            try:
+                return [int(v) for v in values]
+            except (TypeError, ValueError):
+                raise QueryError(f"{column} 必须是整数")
+        dictionary = self.dictionaries[column]
+        for v in values:
+            # 拼错的取值不能悄悄忽略，否则会返回未过滤或空的统计结果
+            if v not in dictionary:
+                raise QueryError(f"{column} 没有取值 {v}")
+        return [dictionary.index(v) for v in values]
+
+    # ---- 条件 ----
+
+    def _star_hits(self, star):
+        """[行, 12] 布尔数组：该宫位是否有这颗星；同时返回所在数组的前缀（major / minor）"""
+        code = self._vocab_code(star)
+        if star in self.major_stars:
+            return (np.asarray(self.columns["major_star"]) == code), "major"
+        if star in self.minor_stars:
+            return (np.asarray(self.columns["minor_star"]) == code), "minor"
+        raise QueryError(f"分析库中没有这颗星: {star}")
+
+    def _star_mask(self, condition):
+        if not isinstance(condition, dict) or not condition.get("star"):
+            raise QueryError("星曜条件需要 star 字段")
+        hits, kind = self._star_hits(condition["star"])
+        if condition.get("mutagen") is not None:
+            hits &= np.asarray(self.columns[f"{kind}_mutagen"]) == self._vocab_code(condition["mutagen"])
+        if condition.get("brightness") is not None:
+            if kind != "major":
+                raise QueryError("只有主星有亮度")
+            hits &= np.asarray(self.columns["major_brightness"]) == self._vocab_code(condition["brightness"])
+        in_palace = _any_last(hits)
+        if condition.get("palace") is not None:
+            in_palace &= np.asarray(self.columns["palace_name"]) == self._vocab_code(condition["palace"])
+        return _any_last(in_palace)
+
+    def mask(self, condition):
+        """条件 -> 行布尔数组；条件之间为 AND，列表值为 IN"""
+        condition = condition or {}
+        if not isinstance(condition, dict):
+            raise QueryError("条件必须是JSON对象")
+        mask = np.ones(self.rows, dtype=bool)
+        dates = np.asarray(self.columns["date"])
+        for bound, op in (("start", np.greater_equal), ("end", np.less_equal)):
+            if condition.get(bound):
+                try:
+                    day = date.fromisoformat(str(condition[bound]))
+                except ValueError:
+                    raise QueryError(f"{bound} 必须是 YYYY-MM-DD")
+                mask &= op(dates, day.year * 10000 + day.month * 100 + day.day)
+        for column in GROUP_COLUMNS:
+            if condition.get(column) is not None:
+                mask &= np.isin(np.asarray(self.columns[column]), self._column_codes(column, condition[column]))
+        for star_condition in _as_list(condition.get("stars") or []):
+            mask &= self._star_mask(star_condition)
+        unknown = set(condition) - {"start", "end", "stars"} - set(GROUP_COLUMNS)
+        if unknown:
+            raise QueryError(f"未知的条件字段: {', '.join(sorted(unknown))}")
+        return mask
+
+    # ---- 主题分数 ----
+
+    def topic_scores(self):
+        """每行的五大主题分数 [行, 主题数]；构建时未写入或版本不一致时在内存中计算一次"""
+        if self._scores is None:
+            with self._scores_lock:
+                if self._scores is None:
+                    path = os.path.join(self.path, "topic_scores.npy")
+                    if self.meta.get("scoring_version") == SCORING_VERSION and os.path.exists(path):
+                        self._scores = np.load(path, mmap_mode='r')
+                    else:
+                        started = time.perf_counter()
+                        scores = np.empty((self.rows, len(TOPICS)), dtype=np.int8)
+                        self._scores = compute_topic_scores(self.columns, vocab_tables(self.vocab), scores)
+                        logger.info(f"分析库主题分数计算完成: {self.rows} 行, {time.perf_counter() - started:.1f}s")
+        return self._scores
+
+    def _score_sums(self, key, population, cells):
+        """人群中每个分组格子的各主题分数之和 [格子数, 主题数]"""
+        scores = np.asarray(self.topic_scores())[population]
+        selected = key[population]
+        return np.stack([np.bincount(selected, weights=scores[:, topic], minlength=cells)
+                         for topic in range(len(TOPICS))], axis=1)
+
+    # ---- 分组 ----
+
+    def _group_codes(self, column):
+        """返回 (编码数组, 基数, 解码函数)"""
+        if column.startswith("palace_of:"):
+            hits, _ = self._star_hits(column.split(":", 1)[1])
+            hits = _any_last(hits)
+            names = np.asarray(self.columns["palace_name"])
+            codes = np.full(self.rows, NONE_CODE, dtype=np.uint8)
+            for palace in range(PALACE_COUNT):
+                codes[hits[:, palace]] = names[hits[:, palace], palace]
+            return codes, NONE_CODE + 1, lambda c: None if c == NONE_CODE else self.vocab[c]
+        if column == "year":
+            first = self.start.year
+            return (np.asarray(self.columns["year"]).astype(np.int64) - first,
+                    self.end.year - first + 1, lambda c: first + c)
+        if column == "month":
+            return np.asarray(self.columns["month"]).astype(np.int64) - 1, 12, lambda c: c + 1
+        if column == "hour":
+            return np.asarray(self.columns["hour"]), 12, int
+        if column == "gender":
+            return np.asarray(self.columns["gender"]), len(self.genders), lambda c: self.genders[c]
+        if column in TEXT_COLUMNS:
+            dictionary = self.dictionaries[column]
+            return np.asarray(self.columns[column]), len(dictionary), lambda c: dictionary[c]
+        raise QueryError(f"不能按 {column} 分组")
+
+    def aggregate(self, query):
+        """
+        query:
+            filter    人群条件
+            match     在人群中统计的条件（可选），结果附带 matched 与 rate
+            group_by  分组列（可选）
+            scores    为 true 时各分组附带五大主题的平均分
+        返回 {"rows", "matched", "groups": [{"key", "count", "matched", "rate", "scores"}], "elapsed_ms"}
+        """
+        started = time.perf_counter()
+        if not isinstance(query, dict):
+            raise QueryError("查询必须是JSON对象")
+        population = self.mask(query.get("filter"))
+        matched = self.mask(query["match"]) & population if query.get("match") else None
+
+        group_by = _as_list(query.get("group_by") or [])
+        key = np.zeros(self.rows, dtype=np.int64)
+        cells, decoders = 1, []
+        for column in group_by:
+            codes, cardinality, decode = self._group_codes(str(column))
+            cells *= cardinality
+            if cells > MAX_GROUP_CELLS:
+                raise QueryError("分组组合过多，请减少分组列")
+            key = key * cardinality + codes
+            decoders.append((column, cardinality, decode))
+
+        selected = key[population]
+        counts = np.bincount(selected, minlength=cells)
+        hits = np.bincount(key[matched], minlength=cells) if matched is not None else None
+        score_sums = self._score_sums(key, population, cells) if query.get("scores") else None
+
+        groups = []
+        for cell in np.flatnonzero(counts):
+            labels, rest = {}, int(cell)
+            for column, cardinality, decode in reversed(decoders):
+                rest, code = divmod(rest, cardinality)
+                labels[column] = decode(code)
+            group = {"key": dict(reversed(list(labels.items()))), "count": int(counts[cell])}
+            if hits is not None:
+                group["matched"] = int(hits[cell])
+                group["rate"] = round(int(hits[cell]) / int(counts[cell]), 6)
+            if score_sums is not None:
+                group["scores"] = {topic: round(float(score_sums[cell, i]) / int(counts[cell]), 2)
+                                   for i, topic in enumerate(TOPICS)}
+            groups.append(group)
+
+        result = {"rows": int(population.sum()), "groups": groups}
+        if matched is not None:
+            result["matched"] = int(matched.sum())
+        result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return result
+
+
+_analytics = None
+_analytics_loaded = False
+_analytics_lock = threading.Lock()
+
+
+def get_analytics():
+    """按 ZIWEI_ANALYTICS_STORE 加载分析库；未配置或加载失败时返回 None"""
+    global _analytics, _analytics_loaded
+    if not _analytics_loaded:
+        with _analytics_lock:
+            if not _analytics_loaded:
+                path = os.environ.get('ZIWEI_ANALYTICS_STORE')
+                if path and os.path.exists(os.path.join(path, "meta.json")):
+                    try:
+                        _analytics = AnalyticsStore(path)
+                    except (OSError, ValueError) as e:
+                        logger.error(f"分析库加载失败: {e}")
+                _analytics_loaded = True
+    return _analytics
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="紫微斗数列式分析库")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_build = sub.add_parser('build', help="由预计算命盘库构建分析库")
+    p_build.add_argument('--store', default=os.environ.get('ZIWEI_CHART_STORE', 'charts.bin'))
+    p_build.add_argument('--output', default='analytics')
+    p_build.add_argument('--start')
+    p_build.add_argument('--end')
+
+    p_info = sub.add_parser('info', help="查看分析库信息")
+    p_info.add_argument('path')
+
+    p_query = sub.add_parser('query', help="执行一次聚合查询")
+    p_query.add_argument('path')
+    p_query.add_argument('query', help="JSON 查询")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        store = ChartStore(args.store)
+        start = date.fromisoformat(args.start) if args.start else None
+        end = date.fromisoformat(args.end) if args.end else None
+        rows = build(store, args.output, start, end)
+        print(json.dumps(AnalyticsStore(args.output).info(), ensure_ascii=False, indent=2))
+        print(f"共写入 {rows} 行", file=sys.stderr)
+    elif args.command == 'info':
+        print(json.dumps(AnalyticsStore(args.path).info(), ensure_ascii=False, indent=2))
+    else:
+        result = AnalyticsStore(args.path).aggregate(json.loads(args.query))
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
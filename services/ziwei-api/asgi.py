@@ -0,0 +1,242 @@
+"""ASGI 入口（异步服务模式）
+
+    gunicorn -k uvicorn.workers.UvicornWorker -b 0.0.0.0:8080 asgi:app
+
+所有路由仍由 index.py 的 Flask 视图处理，视图在有上限的线程池中执行；
+/calculate 遇到缓存未命中时不在线程里等待 Node，而是抛出 ComputeDeferred 立即让出线程，
+由事件循环通过 asyncio 子进程计算（同键的并发请求只计算一次），完成后带着结果重新执行视图。
+因此大量慢请求只占用协程，不占用线程或进程；同时进行的计算数受进程池大小限制。
+
+其他视图中的引擎调用（批量接口、/health、/test）通过 ThreadsafeEngine 与异步请求共用同一组 Node 进程。
+"""
+import asyncio
+import contextvars
+import logging
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import engine_pool
+from admission import DeadlineExceeded, Overloaded, worker_admit_async
+from async_engine import ThreadsafeEngine, create_async_pool
+from engine_pool import EngineError, _env_int
+from singleflight import AsyncSingleFlight
+from index import DEFER_COMPUTE, DEFERRED, ENGINE_OUTCOMES, ENGINE_SECONDS, app as flask_app, get_monitor
+
+logger = logging.getLogger(__name__)
+
+# 执行 Flask 视图的线程数上限
+THREADS = _env_int('ZIWEI_ASGI_THREADS', 16)
+# 请求体超过此大小时落盘
+SPOOL_SIZE = 1024 * 1024
+
+# 只有 /calculate 与分享令牌生成的引擎调用交给事件循环；其余路由在线程中同步执行
+# （合盘接口的命盘与批量接口一样一次 calculate_many 取得，不需要重新执行视图）
+DEFERRABLE_PATHS = {'/calculate', '/charts'}
+
+_END = object()
+
+
+class AsyncRuntime:
+    """单个事件循环内的状态：异步引擎、视图线程池与 in-flight 计算"""
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.engine = create_async_pool()
+        self.executor = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix='ziwei-view')
+        self.flights = AsyncSingleFlight()
+        engine_pool.install_pool(ThreadsafeEngine(self.engine, self.loop))
+
+    async def run(self, context, fn, *args):
+        # 同一请求的各步骤可能落在不同线程，统一在该请求的 context 中执行，
+        # 流式响应生成器里的 Flask 请求上下文（contextvars）才能跨线程保持
+        return await self.loop.run_in_executor(self.executor, context.run, fn, *args)
+
+    async def compute(self, key, params, deadline):
+        """
+        同键的并发请求共用一次计算；返回结果或异常（作为结果交回视图处理）
+        每个请求只等到自己的截止时间；所有等待者都离开（超时或断开）后取消计算并结束计算进程
+        """
+        try:
+            return await self.flights.do(key, lambda: self._compute(params, deadline), deadline.remaining())
+        except asyncio.TimeoutError:
+            return DeadlineExceeded("等待计算结果超过截止时间")
+
+    async def _compute(self, params, deadline):
+        try:
+            async with worker_admit_async(deadline):
+                if deadline.expired:
+                    raise DeadlineExceeded("排队等待超过截止时间")
+                return await self.engine.call('calculate', params, timeout=deadline.remaining())
+        except (EngineError, Overloaded, DeadlineExceeded) as e:
+            return e
+
+    async def close(self):
+        await self.engine.close()
+        self.executor.shutdown(wait=False)
+
+
+_runtime = None
+
+
+async def get_runtime():
+    global _runtime
+    if _runtime is None or _runtime.loop is not asyncio.get_running_loop():
+        _runtime = AsyncRuntime()
+    return _runtime
+
+
+def build_environ(scope, body):
+    """按 PEP 3333 由 ASGI scope 构造 WSGI environ"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client')
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0] if client else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        # 请求体已完整读入，分块传输的请求也可以读到结尾
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f'HTTP_{name}'
+        value = value.decode('latin-1')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def call_wsgi(environ):
+    """在线程中执行 Flask，返回 (状态, 响应头, 已产生的正文块, 剩余正文迭代器, 原始正文)"""
+    started = {}
+    written = []
+
+    def start_response(status, headers, exc_info=None):
+        if exc_info and started.get('sent'):
+            raise exc_info[1].with_traceback(exc_info[2])
+        started['status'] = status
+        started['headers'] = headers
+        return written.append
+
+    body = flask_app(environ, start_response)
+    iterator = iter(body)
+    # PEP 3333 允许推迟到第一个正文块产生时才调用 start_response
+    first = next(iterator, _END)
+    chunks = written + ([] if first is _END else [first])
+    return started['status'], started['headers'], chunks, iterator, body
+
+
+async def read_body(receive):
+    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            body.close()
+            return None
+        body.write(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return body
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def handle_http(scope, receive, send):
+    runtime = await get_runtime()
+    body = await read_body(receive)
+    if body is None:
+        return
+
+    context = contextvars.copy_context()
+    outcomes = {}
+    engine_seconds = {}
+    try:
+        while True:
+            body.seek(0)
+            environ = build_environ(scope, body)
+            if scope['path'] in DEFERRABLE_PATHS:
+                environ[DEFER_COMPUTE] = True
+                environ[ENGINE_OUTCOMES] = outcomes
+                environ[ENGINE_SECONDS] = engine_seconds
+            status, headers, chunks, iterator, response_body = await runtime.run(context, call_wsgi, environ)
+
+            deferred = environ.get(DEFERRED)
+            if deferred is None:
+                break
+            if hasattr(response_body, 'close'):
+                await runtime.run(context, response_body.close)
+            started = runtime.loop.time()
+            waiting = asyncio.ensure_future(runtime.compute(deferred.key, deferred.params, deferred.deadline))
+            disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+            await asyncio.wait({waiting, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            disconnected.cancel()
+            if not waiting.done():
+                # 客户端已断开，不再等待；没有其他等待者时计算随之取消
+                waiting.cancel()
+                logger.info("客户端已断开，放弃计算 - %s", deferred.key)
+                return
+            outcomes[deferred.key] = waiting.result()
+            engine_seconds[deferred.key] = runtime.loop.time() - started
+    finally:
+        body.close()
+
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        })
+        for chunk in chunks:
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        # 流式响应（批量接口）逐块在线程中生成
+        while True:
+            chunk = await runtime.run(context, next, iterator, _END)
+            if chunk is _END:
+                break
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    finally:
+        if hasattr(response_body, 'close'):
+            await runtime.run(context, response_body.close)
+
+
+async def handle_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            runtime = await get_runtime()
+            try:
+                await runtime.engine.warm_up()
+            except EngineError as e:
+                logger.error(f"预热计算进程失败: {e}")
+            # 启动后立即开始预载与健康检查，不必等第一个请求
+            get_monitor()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _runtime is not None:
+                await _runtime.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'http':
+        await handle_http(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        await handle_lifespan(receive, send)
@@ -0,0 +1,362 @@
+"""asyncio 版计算引擎（ASGI 模式使用，见 asgi.py）
+
+与 engine_pool.py 的接口和行为一致：常驻 Node.js 进程池（或 ZIWEI_ENGINE=spawn 时的一次性进程），
+请求帧经 stdin 发送，响应帧从专用 pipe 读取。所有等待都是协程，
+等待计算结果的请求不占用线程；同时进行的计算数量受进程池大小限制。
+"""
+import asyncio
+import itertools
+import logging
+import os
+import time
+
+import events
+import metrics
+from engine_pool import (
+    BASE_DIR, CALCULATE_SCRIPT, WORKER_SCRIPT, EngineError, EngineTimeout, _env_float, _env_int,
+    kill_process_group, record_engine_timing,
+)
+from wire import MAX_FRAME_SIZE, FrameError, decode_body, decode_frame, encode_frame, read_frame_async
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncNodeWorker:
+    """单个常驻 Node.js 进程（asyncio 子进程）"""
+
+    def __init__(self, script=WORKER_SCRIPT, cwd=BASE_DIR):
+        self.script = script
+        self.cwd = cwd
+        self.proc = None
+        self.calls = 0
+        self.rss = 0
+        self._frames = None
+        self._transport = None
+        self._diagnostics = None
+        self._ids = itertools.count(1)
+
+    @property
+    def alive(self):
+        return self.proc is not None and self.proc.returncode is None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        frame_read, frame_write = os.pipe()
+        try:
+            self.proc = await asyncio.create_subprocess_exec(
+                'node', self.script,
+                cwd=self.cwd,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                pass_fds=(frame_write,),
+                env={**os.environ, 'ZIWEI_FRAME_FD': str(frame_write)},
+                start_new_session=True,
+            )
+        except OSError as e:
+            os.close(frame_read)
+            raise EngineError(f"无法启动Node.js: {e}")
+        finally:
+            os.close(frame_write)
+
+        self._frames = asyncio.StreamReader(limit=MAX_FRAME_SIZE)
+        self._transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(self._frames), os.fdopen(frame_read, 'rb', 0)
+        )
+        self.calls = 0
+        self.rss = 0
+        # 事件循环只持有任务的弱引用，这里保留引用，进程停止时取消
+        self._diagnostics = asyncio.ensure_future(self._read_diagnostics(self.proc))
+        logger.info(f"Node worker 已启动 - pid: {self.proc.pid}")
+
+    @staticmethod
+    async def _read_diagnostics(proc):
+        async for line in proc.stdout:
+            # 计算输出默认不写 stderr（见 wire.js），这里只剩意外的错误与 Node 自身的警告
+            logger.warning("Node worker[%d]: %s", proc.pid, line.decode('utf-8', 'replace').rstrip())
+
+    def _close_streams(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        if self._diagnostics is not None:
+            self._diagnostics.cancel()
+            self._diagnostics = None
+
+    async def stop(self):
+        proc, self.proc = self.proc, None
+        if proc is None:
+            return
+        try:
+            proc.stdin.close()
+            await asyncio.wait_for(proc.wait(), 1)
+        except (OSError, asyncio.TimeoutError):
+            if proc.returncode is None:
+                kill_process_group(proc)
+            await proc.wait()
+        finally:
+            self._close_streams()
+
+    async def kill(self):
+        proc, self.proc = self.proc, None
+        self._close_streams()
+        if proc is not None and proc.returncode is None:
+            kill_process_group(proc)
+            await proc.wait()
+
+    async def request(self, op, params, timeout):
+        """发送一个请求并等待对应响应，超时或进程退出时抛出异常"""
+        sent = time.perf_counter()
+        if not self.alive:
+            await self.start()
+
+        request_id = next(self._ids)
+        try:
+            self.proc.stdin.write(encode_frame({"id": request_id, "op": op, "params": params}))
+            await self.proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError, OSError) as e:
+            await self.kill()
+            raise EngineError(f"Node worker 写入失败: {e}")
+
+        try:
+            message = await asyncio.wait_for(self._read_response(request_id, sent), timeout)
+        except asyncio.TimeoutError:
+            await self.kill()
+            raise EngineTimeout(f"计算超时（{timeout:g}秒）")
+        except asyncio.CancelledError:
+            # 调用方放弃等待时响应帧可能只读了一半，这个进程不能再复用
+            await self.kill()
+            raise
+
+        events.engine_diagnostics(op, message, self.proc.pid)
+        self.calls += 1
+        self.rss = message.get('rss', 0)
+        if not message.get('ok'):
+            raise EngineError(message.get('error', '未知错误'))
+        return message.get('result')
+
+    async def _read_response(self, request_id, sent):
+        while True:
+            try:
+                raw = await read_frame_async(self._frames)
+            except (FrameError, OSError) as e:
+                await self.kill()
+                raise EngineError(f"Node worker 帧读取失败: {e}")
+            if raw is None:
+                returncode = self.proc.returncode if self.proc else None
+                await self.kill()
+                raise EngineError(f"Node worker 意外退出，返回码: {returncode}")
+            received = time.perf_counter()
+            try:
+                with metrics.timed('decode'):
+                    message = decode_body(raw)
+            except ValueError as e:
+                await self.kill()
+                raise EngineError(f"响应解析失败: {e}")
+            # 上一个超时请求的迟到响应直接丢弃
+            if message.get('id') == request_id:
+                record_engine_timing(received - sent, message)
+                return message
+
+
+class AsyncNodeWorkerPool:
+    """固定大小的异步 Node.js 进程池，参数与 NodeWorkerPool 相同"""
+
+    def __init__(self, size=2, max_calls=1000, max_rss_mb=256, call_timeout=30.0,
+                 script=WORKER_SCRIPT, cwd=BASE_DIR):
+        self.size = max(1, size)
+        self.max_calls = max_calls
+        self.max_rss = max_rss_mb * 1024 * 1024
+        self.call_timeout = call_timeout
+        self._idle = asyncio.LifoQueue()
+        for _ in range(self.size):
+            self._idle.put_nowait(AsyncNodeWorker(script, cwd))
+        self.stats = {"calls": 0, "timeouts": 0, "crashes": 0, "recycled": 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            size=_env_int('ZIWEI_POOL_SIZE', 2),
+            max_calls=_env_int('ZIWEI_POOL_MAX_CALLS', 1000),
+            max_rss_mb=_env_int('ZIWEI_POOL_MAX_RSS_MB', 256),
+            call_timeout=_env_float('ZIWEI_CALL_TIMEOUT', 30),
+        )
+
+    async def call(self, op, params=None, timeout=None):
+        """在空闲 worker 上执行一次请求；等待空闲 worker 的时间也计入截止时间"""
+        timeout = self.call_timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        try:
+            with metrics.timed('queue'):
+                worker = await asyncio.wait_for(self._idle.get(), timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise EngineTimeout(f"等待空闲计算进程超时（{timeout:g}秒）")
+
+        try:
+            self.stats["calls"] += 1
+            return await worker.request(op, params or {}, max(deadline - loop.time(), 0.001))
+        except EngineTimeout:
+            self.stats["timeouts"] += 1
+            raise
+        except EngineError:
+            if not worker.alive:
+                self.stats["crashes"] += 1
+            raise
+        finally:
+            if worker.alive and (worker.calls >= self.max_calls or worker.rss > self.max_rss):
+                logger.info(f"回收 Node worker - 调用次数: {worker.calls}, RSS: {worker.rss}")
+                self.stats["recycled"] += 1
+                await worker.stop()
+            self._idle.put_nowait(worker)
+
+    async def warm_up(self):
+        workers = [await self._idle.get() for _ in range(self.size)]
+        try:
+            for worker in workers:
+                if not worker.alive:
+                    await worker.start()
+        finally:
+            for worker in workers:
+                self._idle.put_nowait(worker)
+
+    async def close(self):
+        for _ in range(self.size):
+            await (await self._idle.get()).stop()
+
+
+class AsyncSpawnEngine:
+    """每次调用启动一个一次性 node 进程（ZIWEI_ENGINE=spawn），同时运行的进程数不超过 size"""
+
+    def __init__(self, size=2, call_timeout=30.0, script=CALCULATE_SCRIPT, cwd=BASE_DIR):
+        self.size = max(1, size)
+        self.max_calls = 1
+        self.call_timeout = call_timeout
+        self.script = script
+        self.cwd = cwd
+        self._slots = asyncio.Semaphore(self.size)
+        self.stats = {"calls": 0, "timeouts": 0, "crashes": 0, "recycled": 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            size=_env_int('ZIWEI_POOL_SIZE', 2),
+            call_timeout=_env_float('ZIWEI_CALL_TIMEOUT', 30),
+        )
+
+    async def call(self, op, params=None, timeout=None):
+        timeout = self.call_timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        try:
+            with metrics.timed('queue'):
+                await asyncio.wait_for(self._slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise EngineTimeout(f"等待空闲计算进程超时（{timeout:g}秒）")
+
+        try:
+            self.stats["calls"] += 1
+            started = time.perf_counter()
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    'node', self.script,
+                    cwd=self.cwd,
+                    stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    start_new_session=True,
+                )
+            except OSError as e:
+                raise EngineError(f"无法启动Node.js: {e}")
+
+            try:
+                stdout, stderr = await asyncio.wait_for(
+                    proc.communicate(encode_frame({"op": op, "params": params or {}})),
+                    max(deadline - loop.time(), 0.001),
+                )
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if proc.returncode is None:
+                    kill_process_group(proc)
+                await proc.wait()
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                self.stats["timeouts"] += 1
+                raise EngineTimeout(f"计算超时（{timeout:g}秒）")
+        finally:
+            self._slots.release()
+        finished = time.perf_counter()
+
+        if stderr and proc.returncode == 0:
+            logger.warning("Node.js stderr: %s", stderr.decode('utf-8', 'replace').rstrip())
+        if proc.returncode != 0:
+            self.stats["crashes"] += 1
+            raise EngineError(f"返回码 {proc.returncode}: {stderr.decode('utf-8', 'replace')[-500:]}")
+
+        try:
+            with metrics.timed('decode'):
+                message = decode_frame(stdout)
+        except (FrameError, ValueError) as e:
+            raise EngineError(f"响应解析失败: {e}")
+        record_engine_timing(finished - started, message)
+        events.engine_diagnostics(op, message, proc.pid)
+        if not message.get('ok'):
+            raise EngineError(message.get('error', '未知错误'))
+        return message.get('result')
+
+    async def warm_up(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+def create_async_pool(engine=None):
+    """
+    在当前事件循环中创建引擎；engine 默认取 ZIWEI_ENGINE：spawn 时改用一次性进程，
+    daemon 时转发给计算守护进程（守护进程自己传入 'pool'，固定使用进程池）
+    """
+    engine = engine or os.environ.get('ZIWEI_ENGINE', 'pool')
+    if engine == 'daemon':
+        from daemon_client import AsyncDaemonEngine
+        return AsyncDaemonEngine.from_env()
+    if engine == 'spawn':
+        return AsyncSpawnEngine.from_env()
+    return AsyncNodeWorkerPool.from_env()
+
+
+class ThreadsafeEngine:
+    """
+    把事件循环中的异步引擎包装成 engine_pool 的同步接口，
+    让在线程中执行的 Flask 视图（批量接口、/health 等）与异步请求共用同一组 Node 进程
+    """
+
+    def __init__(self, engine, loop):
+        self.engine = engine
+        self.loop = loop
+
+    @property
+    def size(self):
+        return self.engine.size
+
+    @property
+    def max_calls(self):
+        return self.engine.max_calls
+
+    @property
+    def call_timeout(self):
+        return self.engine.call_timeout
+
+    @property
+    def stats(self):
+        return self.engine.stats
+
+    def call(self, op, params=None, timeout=None):
+        return asyncio.run_coroutine_threadsafe(self.engine.call(op, params, timeout), self.loop).result()
+
+    def warm_up(self):
+        asyncio.run_coroutine_threadsafe(self.engine.warm_up(), self.loop).result()
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.engine.close(), self.loop).result()
@@ -0,0 +1,77 @@
+"""冷启动基准：对比一次性 node 调用在有无编译缓存时的延迟
+
+    python bench/cold_start.py --runs 20
+
+每一轮都启动一个全新的 node 进程执行一次完整排盘，分别测量：
+- node_baseline  : 空的 node 进程（启动下限）
+- no_cache       : ZIWEI_COMPILE_CACHE=0，每次重新解析、编译 iztro（等同改造前）
+- cache_warm     : 编译缓存已生成后的冷启动
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(BASE_DIR, 'iztro_calculate.js')
+REQUEST = json.dumps({
+    "op": "calculate",
+    "params": {"date": "2000-8-16", "hour": 7, "gender": "男", "fix_leap": False},
+}, ensure_ascii=False).encode('utf-8')
+
+
+def run_once(argv, env, payload=None):
+    started = time.perf_counter()
+    result = subprocess.run(argv, cwd=BASE_DIR, env=env, input=payload, capture_output=True)
+    elapsed = (time.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode('utf-8', 'replace'))
+    return elapsed
+
+
+def measure(name, argv, env, runs, payload=None):
+    samples = sorted(run_once(argv, env, payload) for _ in range(runs))
+    return {
+        "case": name,
+        "runs": runs,
+        "mean_ms": round(statistics.mean(samples), 1),
+        "p50_ms": round(samples[len(samples) // 2], 1),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 1),
+        "min_ms": round(samples[0], 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--json', action='store_true', help="以 JSON 输出")
+    args = parser.parse_args(argv)
+
+    cache_dir = tempfile.mkdtemp(prefix='ziwei-compile-cache-')
+    base_env = dict(os.environ, ZIWEI_COMPILE_CACHE_DIR=cache_dir)
+    no_cache_env = dict(base_env, ZIWEI_COMPILE_CACHE='0')
+
+    rows = [measure('node_baseline', ['node', '-e', ''], base_env, args.runs)]
+    rows.append(measure('no_cache', ['node', SCRIPT], no_cache_env, args.runs, REQUEST))
+    # 第一次调用生成缓存
+    first = run_once(['node', SCRIPT], base_env, REQUEST)
+    rows.append(measure('cache_warm', ['node', SCRIPT], base_env, args.runs, REQUEST))
+
+    if args.json:
+        print(json.dumps({"cache_first_run_ms": round(first, 1), "results": rows}, indent=2))
+        return
+
+    print(f"{'case':<15}{'mean':>9}{'p50':>9}{'p95':>9}{'min':>9}  (ms, {args.runs} runs)")
+    for row in rows:
+        print(f"{row['case']:<15}{row['mean_ms']:>9}{row['p50_ms']:>9}{row['p95_ms']:>9}{row['min_ms']:>9}")
+    print(f"首次生成缓存: {first:.1f} ms")
+    no_cache, warm = rows[1]['p50_ms'], rows[2]['p50_ms']
+    print(f"编译缓存节省: {no_cache - warm:.1f} ms / 次 (p50, {100 * (no_cache - warm) / no_cache:.0f}%)")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,483 @@
+"""负载测试：按几种真实流量模式重放 /calculate，输出吞吐、延迟分位数、RSS 与子进程数
+
+    python bench/load_test.py                                       # 替身引擎，pool/daemon × wsgi/asgi × 全部流量模式
+    python bench/load_test.py --iztro real --engines pool,spawn,daemon
+    python bench/load_test.py --save bench/baselines/stub.json      # 保存基线
+    python bench/load_test.py --compare bench/baselines/stub.json   # 与基线对比，有退化时返回码为 1
+
+完全离线运行：默认以 bench/stub_iztro 代替 iztro（输出结构相同，耗时按 iztro 的延迟分布模拟，见该目录的 index.js），
+--iztro real 时改用 node_modules 中的真实 iztro。请求在进程内经 WSGI（Flask test client，多线程）
+或 ASGI（asgi.app，协程）完整走一遍 calculate()，不经过网络，结果只反映服务本身。
+
+流量模式：
+- popular : 热门出生日期按 Zipf 分布重复出现，以缓存命中为主
+- cold    : 依次扫过不同的日期、时辰与性别，每个请求都是新的规范键，缓存全部未命中
+- viral   : 分享链接爆红：每轮同一张新命盘被同时请求 --concurrency 次（同一时辰内的不同分钟）
+- mixed   : 热门分布上 GET 与 POST、birth_datetime 与 birth_date + birth_time 各半
+
+每个 (引擎, 服务模式, 流量模式) 在独立的子进程中运行，命盘缓存从空开始；
+RSS（本进程 + 所有子孙进程）与子进程数在运行期间按 /proc 采样取峰值（非 Linux 时不采样）。
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import queue
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+from urllib.parse import urlencode
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUB_IZTRO = os.path.join(BASE_DIR, 'bench', 'stub_iztro')
+
+ENGINES = ('pool', 'spawn', 'daemon')
+MODES = ('wsgi', 'asgi')
+WORKLOADS = ('popular', 'cold', 'viral', 'mixed')
+# 每种流量模式的默认请求数（乘以 --scale）
+DEFAULT_REQUESTS = {'popular': 2000, 'cold': 400, 'viral': 640, 'mixed': 2000}
+# 热门日期的个数与 Zipf 指数
+POPULAR_DISTINCT = 500
+ZIPF_EXPONENT = 1.1
+
+# 对比基线时的指标：(名称, 越大越好)
+METRICS = (
+    ('throughput_rps', True),
+    ('p50_ms', False),
+    ('p95_ms', False),
+    ('p99_ms', False),
+    ('rss_mb', False),
+    ('children', False),
+)
+
+
+# ---------- 流量 ----------
+
+def birth_input(rng, day, chen, gender):
+    """(日期序数, 时辰索引, 性别) -> (出生日期, 时间)，时间在该时辰内随机取分钟"""
+    # 子时横跨 23:00–00:59，两段都落在同一日期的时辰 0
+    hour = (2 * chen - 1 + rng.randint(0, 1)) % 24
+    return date.fromordinal(day).isoformat(), f"{hour:02d}:{rng.randint(0, 59):02d}", gender
+
+
+def as_request(birth, method='GET', combined=False):
+    birth_date, birth_time, gender = birth
+    fields = {"gender": gender}
+    if combined:
+        fields["birth_datetime"] = f"{birth_date} {birth_time}"
+    else:
+        fields.update(birth_date=birth_date, birth_time=birth_time)
+    return {"method": method, "fields": fields}
+
+
+def popular_keys(rng):
+    start = date(1970, 1, 1).toordinal()
+    return [(start + rng.randrange(40 * 365), rng.randrange(12), rng.choice(('male', 'female')))
+            for _ in range(POPULAR_DISTINCT)]
+
+
+def zipf_choices(rng, keys, count):
+    weights = [1 / rank ** ZIPF_EXPONENT for rank in range(1, len(keys) + 1)]
+    return rng.choices(keys, weights=weights, k=count)
+
+
+def build_workload(name, count, concurrency, seed):
+    rng = random.Random(f"{name}:{seed}")
+    if name == 'popular':
+        return [as_request(birth_input(rng, *key)) for key in zipf_choices(rng, popular_keys(rng), count)]
+    if name == 'cold':
+        start = date(1950, 1, 1).toordinal()
+        return [as_request(birth_input(rng, start + i // 24, i // 2 % 12, ('male', 'female')[i % 2]))
+                for i in range(count)]
+    if name == 'viral':
+        start = date(1990, 1, 1).toordinal()
+        requests = []
+        for burst in range(max(1, count // concurrency)):
+            key = (start + burst * 37, burst % 12, 'female')
+            requests += [as_request(birth_input(rng, *key)) for _ in range(concurrency)]
+        return requests
+    if name == 'mixed':
+        return [as_request(birth_input(rng, *key), method=rng.choice(('GET', 'POST')), combined=rng.random() < 0.5)
+                for key in zipf_choices(rng, popular_keys(rng), count)]
+    raise ValueError(f"未知的流量模式: {name}")
+
+
+# ---------- 进程采样 ----------
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def _children_map():
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'rb') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # comm 可能包含空格与括号，从最后一个 ')' 之后解析
+        ppid = int(stat[stat.rindex(b')') + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+    return children
+
+
+def _rss(pid):
+    try:
+        with open(f'/proc/{pid}/statm', 'rb') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def descendants(pid):
+    children = _children_map()
+    found, pending = [], list(children.get(pid, ()))
+    while pending:
+        child = pending.pop()
+        found.append(child)
+        pending.extend(children.get(child, ()))
+    return found
+
+
+class ProcessSampler:
+    """后台线程定期采样本进程与子孙进程的 RSS 和子进程数，保留峰值"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.available = os.path.isdir('/proc')
+        self.peak = {"rss": 0, "python_rss": 0, "children": 0}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def sample(self):
+        if not self.available:
+            return
+        pid = os.getpid()
+        children = descendants(pid)
+        python_rss = _rss(pid)
+        total = python_rss + sum(_rss(child) for child in children)
+        self.peak["rss"] = max(self.peak["rss"], total)
+        self.peak["python_rss"] = max(self.peak["python_rss"], python_rss)
+        self.peak["children"] = max(self.peak["children"], len(children))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+# ---------- 驱动 ----------
+
+def run_wsgi(app, requests, concurrency):
+    """多线程经 Flask test client 发送请求，返回 [(耗时秒, 状态码)]"""
+    pending = queue.SimpleQueue()
+    for index, spec in enumerate(requests):
+        pending.put((index, spec))
+    results = [None] * len(requests)
+
+    def worker():
+        client = app.test_client()
+        while True:
+            try:
+                index, spec = pending.get_nowait()
+            except queue.Empty:
+                return
+            started = time.perf_counter()
+            if spec["method"] == 'GET':
+                response = client.get('/calculate', query_string=spec["fields"])
+            else:
+                response = client.post('/calculate', json=spec["fields"])
+            response.get_data()
+            results[index] = (time.perf_counter() - started, response.status_code)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+async def asgi_request(app, spec):
+    if spec["method"] == 'GET':
+        query, body, headers = urlencode(spec["fields"]).encode('latin-1'), b'', []
+    else:
+        query, body = b'', json.dumps(spec["fields"]).encode('utf-8')
+        headers = [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+    scope = {
+        'type': 'http', 'http_version': '1.1', 'method': spec["method"], 'scheme': 'http',
+        'path': '/calculate', 'root_path': '', 'query_string': query, 'headers': headers,
+        'server': ('bench', 80), 'client': ('127.0.0.1', 0),
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    status = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        # 客户端不断开
+        await asyncio.get_running_loop().create_future()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await app(scope, receive, send)
+    return status[0] if status else 0
+
+
+async def start_lifespan(app):
+    """发送 lifespan.startup 并等待完成；返回 (lifespan 协程, 事件队列, 回复队列)，之后由调用方发送 shutdown"""
+    events, replies = asyncio.Queue(), asyncio.Queue()
+    await events.put({'type': 'lifespan.startup'})
+    task = asyncio.ensure_future(app({'type': 'lifespan'}, events.get, replies.put))
+    await replies.get()
+    return task, events, replies
+
+
+async def run_asgi_async(app, requests, concurrency, warm):
+    task, events, replies = await start_lifespan(app)
+    await asyncio.get_running_loop().run_in_executor(None, warm)
+    results = [None] * len(requests)
+    cursor = iter(range(len(requests)))
+
+    async def worker():
+        for index in cursor:
+            started = time.perf_counter()
+            status = await asgi_request(app, requests[index])
+            results[index] = (time.perf_counter() - started, status)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    await events.put({'type': 'lifespan.shutdown'})
+    await replies.get()
+    await task
+    return results, elapsed
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def start_daemon(env, socket_path, timeout=60):
+    proc = subprocess.Popen([sys.executable, os.path.join(BASE_DIR, 'compute_daemon.py'), '--socket', socket_path],
+                            cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(socket_path):
+        if proc.poll() is not None or time.monotonic() > deadline:
+            proc.kill()
+            raise RuntimeError("计算守护进程启动失败")
+        time.sleep(0.05)
+    return proc
+
+
+def run_case(case):
+    """在当前（已按 case_env 设置好环境的）进程中运行一个用例，返回结果字典"""
+    import logging
+    logging.disable(logging.INFO)
+    sys.path.insert(0, BASE_DIR)
+
+    daemon = None
+    if case["engine"] == 'daemon':
+        daemon = start_daemon(os.environ.copy(), os.environ['ZIWEI_DAEMON_SOCKET'])
+    try:
+        requests = build_workload(case["workload"], case["requests"], case["concurrency"], case["seed"])
+        import index
+        from engine_pool import get_pool
+
+        def warm():
+            # 与正式部署相同：预热计算进程并完成第一次健康检查后再开始计时
+            monitor = index.get_monitor()
+            deadline = time.monotonic() + 120
+            while not monitor.ready and time.monotonic() < deadline:
+                time.sleep(0.05)
+
+        with ProcessSampler() as sampler:
+            if case["mode"] == 'wsgi':
+                warm()
+                calls = get_pool().stats["calls"]
+                started = time.perf_counter()
+                results = run_wsgi(index.app, requests, case["concurrency"])
+                elapsed = time.perf_counter() - started
+            else:
+                import asgi
+                calls = None
+
+                def warm_and_mark():
+                    nonlocal calls
+                    warm()
+                    calls = get_pool().stats["calls"]
+
+                results, elapsed = asyncio.run(run_asgi_async(asgi.app, requests, case["concurrency"], warm_and_mark))
+        engine_calls = get_pool().stats["calls"] - calls
+    finally:
+        if daemon is not None:
+            daemon.terminate()
+            daemon.wait()
+
+    latencies = sorted(seconds * 1000 for seconds, _ in results)
+    statuses = {}
+    for _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        **case,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(results) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+        "max_ms": round(latencies[-1], 2),
+        "statuses": statuses,
+        "engine_calls": engine_calls,
+        "rss_mb": round(sampler.peak["rss"] / 2 ** 20, 1) if sampler.available else None,
+        "python_rss_mb": round(sampler.peak["python_rss"] / 2 ** 20, 1) if sampler.available else None,
+        "children": sampler.peak["children"] if sampler.available else None,
+    }
+
+
+def case_env(case, workdir, iztro):
+    env = dict(os.environ, ZIWEI_ENGINE=case["engine"],
+               ZIWEI_CACHE_DB=os.path.join(workdir, 'cache.sqlite3'),
+               ZIWEI_DAEMON_SOCKET=os.path.join(workdir, 'compute.sock'),
+               ZIWEI_HEALTH_INTERVAL='3600')
+    # 不使用预计算命盘库与分析库，每个用例的缓存都从空开始
+    for name in ('ZIWEI_CHART_STORE', 'ZIWEI_ANALYTICS_STORE'):
+        env.pop(name, None)
+    if iztro == 'stub':
+        env.update(ZIWEI_IZTRO_MODULE=STUB_IZTRO, ZIWEI_IZTRO_VERSION='0.0.0-stub')
+    return env
+
+
+def case_name(case):
+    return f"{case['engine']}/{case['mode']}/{case['workload']}"
+
+
+def spawn_case(case, iztro):
+    with tempfile.TemporaryDirectory(prefix='ziwei-bench-') as workdir:
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-case', json.dumps(case)],
+                              cwd=BASE_DIR, env=case_env(case, workdir, iztro), capture_output=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"{case_name(case)} 失败:\n{proc.stderr.decode('utf-8', 'replace')[-2000:]}")
+    return json.loads(proc.stdout.decode('utf-8').strip().splitlines()[-1])
+
+
+# ---------- 报告 ----------
+
+def print_results(results):
+    print(f"{'case':<22}{'req':>6}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'engine':>8}{'rss MB':>9}{'child':>7}  status")
+    for name, row in results.items():
+        statuses = ' '.join(f"{code}×{n}" for code, n in sorted(row["statuses"].items()))
+        print(f"{name:<22}{row['requests']:>6}{row['throughput_rps']:>9}{row['p50_ms']:>9}{row['p95_ms']:>9}"
+              f"{row['p99_ms']:>9}{row['engine_calls']:>8}{str(row['rss_mb']):>9}{str(row['children']):>7}  {statuses}")
+
+
+def compare(results, baseline, tolerance):
+    """与基线逐项对比，返回退化的 (用例, 指标, 基线值, 当前值) 列表；子进程数只要增加即算退化"""
+    regressions = []
+    print(f"\n对比基线（容差 {tolerance:.0%}）")
+    for name, row in results.items():
+        base = baseline.get("cases", {}).get(name)
+        if base is None:
+            print(f"{name:<22}基线中没有此用例")
+            continue
+        cells = []
+        for metric, higher_is_better in METRICS:
+            old, new = base.get(metric), row.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else 0.0
+            if metric == 'children':
+                regressed = new > old
+            else:
+                regressed = (-change if higher_is_better else change) > tolerance
+            flag = ''
+            if regressed:
+                regressions.append((name, metric, old, new))
+                flag = ' !'
+            cells.append(f"{metric} {old}→{new} ({change:+.0%}){flag}")
+        print(f"{name:<22}" + ', '.join(cells))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iztro', choices=('stub', 'real'), default='stub', help="计算引擎使用替身还是真实 iztro")
+    parser.add_argument('--engines', default='pool,daemon', help=f"逗号分隔，可选 {','.join(ENGINES)}")
+    parser.add_argument('--modes', default=','.join(MODES), help=f"逗号分隔，可选 {','.join(MODES)}")
+    parser.add_argument('--workloads', default=','.join(WORKLOADS), help=f"逗号分隔，可选 {','.join(WORKLOADS)}")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--scale', type=float, default=1.0, help="按比例缩放各流量模式的默认请求数")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', metavar='PATH', help="把结果保存为基线（JSON）")
+    parser.add_argument('--compare', metavar='PATH', help="与已保存的基线对比")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="对比时允许的相对变化，默认 0.2")
+    parser.add_argument('--json', action='store_true', help="以 JSON 输出")
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_case:
+        print(json.dumps(run_case(json.loads(args.run_case)), ensure_ascii=False))
+        return 0
+
+    cases = []
+    for engine in args.engines.split(','):
+        for mode in args.modes.split(','):
+            for workload in args.workloads.split(','):
+                if engine not in ENGINES or mode not in MODES or workload not in WORKLOADS:
+                    parser.error(f"未知的用例: {engine}/{mode}/{workload}")
+                cases.append({"engine": engine, "mode": mode, "workload": workload, "iztro": args.iztro,
+                              "requests": max(1, int(DEFAULT_REQUESTS[workload] * args.scale)),
+                              "concurrency": args.concurrency, "seed": args.seed})
+
+    results = {}
+    for case in cases:
+        if not args.json:
+            print(f"运行 {case_name(case)} ...", file=sys.stderr)
+        results[case_name(case)] = spawn_case(case, args.iztro)
+
+    report = {
+        "environment": {"python": platform.python_version(), "platform": platform.platform(terse=True),
+                        "cpus": os.cpu_count(), "iztro": args.iztro},
+        "cases": results,
+    }
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_results(results)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"基线已保存到 {args.save}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} 项退化", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
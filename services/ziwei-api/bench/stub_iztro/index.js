@@ -0,0 +1,163 @@
+// iztro 替身：离线基准测试用（ZIWEI_IZTRO_MODULE 指向本目录）
+// 只实现 iztro_chart.js 用到的 astro.bySolar 与 astrolabe.horoscope，输出结构与 iztro 相同、内容由输入确定，
+// 耗时按 iztro 的延迟分布用忙等模拟（计算是 CPU 密集的，忙等才能反映进程池与 GIL 之外的真实争用）：
+//   ZIWEI_STUB_LOAD_MS       载入模块的耗时（对应 iztro 的解析与编译），默认 300
+//   ZIWEI_STUB_COMPUTE_MS    单次排盘耗时的中位数，默认 5
+//   ZIWEI_STUB_JITTER        排盘耗时的对数正态 sigma，默认 0.4（p99 约为中位数的 2.5 倍）
+//   ZIWEI_STUB_HOROSCOPE_MS  单个运限时段的耗时，默认 1
+//   ZIWEI_STUB_HEAP_MB       常驻内存（对应 iztro 的数据表与 V8 堆），默认 40
+// 同一输入的耗时固定（由输入的哈希决定），重复运行可以复现。
+
+function envNumber(name, fallback) {
+    const value = Number(process.env[name]);
+    return Number.isFinite(value) && process.env[name] !== '' ? value : fallback;
+}
+
+const LOAD_MS = envNumber('ZIWEI_STUB_LOAD_MS', 300);
+const COMPUTE_MS = envNumber('ZIWEI_STUB_COMPUTE_MS', 5);
+const JITTER = envNumber('ZIWEI_STUB_JITTER', 0.4);
+const HOROSCOPE_MS = envNumber('ZIWEI_STUB_HOROSCOPE_MS', 1);
+const HEAP_MB = envNumber('ZIWEI_STUB_HEAP_MB', 40);
+
+function busyWait(ms) {
+    const until = process.hrtime.bigint() + BigInt(Math.round(ms * 1e6));
+    while (process.hrtime.bigint() < until) {
+        // 忙等
+    }
+}
+
+function hash(text) {
+    let h = 2166136261;
+    for (let i = 0; i < text.length; i++) {
+        h = Math.imul(h ^ text.charCodeAt(i), 16777619) >>> 0;
+    }
+    return h;
+}
+
+// 由哈希得到的 (0, 1) 均匀分布与标准正态分布（Box-Muller）
+function uniform(seed) {
+    return ((Math.imul(seed ^ (seed >>> 15), 2246822519) >>> 0) + 1) / 4294967297;
+}
+
+function latency(median, seed) {
+    const z = Math.sqrt(-2 * Math.log(uniform(seed))) * Math.cos(2 * Math.PI * uniform(seed ^ 0x9e3779b9));
+    return median * Math.exp(JITTER * z);
+}
+
+busyWait(LOAD_MS);
+const resident = Buffer.alloc(Math.max(0, HEAP_MB) * 1024 * 1024, 1);
+
+const STEMS = ['甲', '乙', '丙', '丁', '戊', '己', '庚', '辛', '壬', '癸'];
+const BRANCHES = ['寅', '卯', '辰', '巳', '午', '未', '申', '酉', '戌', '亥', '子', '丑'];
+const HOUR_BRANCHES = ['子', '丑', '寅', '卯', '辰', '巳', '午', '未', '申', '酉', '戌', '亥', '子'];
+const PALACES = ['命宫', '兄弟', '夫妻', '子女', '财帛', '疾厄', '迁移', '仆役', '官禄', '田宅', '福德', '父母'];
+const MAJOR = ['紫微', '天机', '太阳', '武曲', '天同', '廉贞', '天府', '太阴', '贪狼', '巨门', '天相', '天梁', '七杀', '破军'];
+const MINOR = ['左辅', '右弼', '文昌', '文曲', '天魁', '天钺', '禄存', '天马', '擎羊', '陀罗', '火星', '铃星', '地空', '地劫'];
+const BRIGHTNESS = ['庙', '旺', '得', '利', '平', '不', '陷'];
+const MUTAGENS = ['禄', '权', '科', '忌'];
+const CLASSES = [['水二局', 2], ['木三局', 3], ['金四局', 4], ['土五局', 5], ['火六局', 6]];
+const ZODIAC = ['鼠', '牛', '虎', '兔', '龙', '蛇', '马', '羊', '猴', '鸡', '狗', '猪'];
+
+function parseDate(date) {
+    const [year, month, day] = String(date).split('-').map(Number);
+    if (!year || !(month >= 1 && month <= 12) || !(day >= 1 && day <= 31)) {
+        throw new Error(`wrong date ${date}`);
+    }
+    return [year, month, day];
+}
+
+function horoscopeItem(seed, index, scope) {
+    const start = (seed + index) % 12;
+    return {
+        index: start,
+        name: scope,
+        heavenlyStem: STEMS[(seed + index) % 10],
+        earthlyBranch: BRANCHES[start],
+        palaceNames: PALACES.slice(12 - start).concat(PALACES.slice(0, 12 - start)),
+        mutagen: [0, 1, 2, 3].map(k => MAJOR[(seed + index * 3 + k * 5) % 14]),
+        stars: BRANCHES.map((_, i) => ((seed >>> i) & 1 ? [{ name: `流${MINOR[(i + index) % 14]}` }] : []))
+    };
+}
+
+function bySolar(date, hour, gender, fixLeap) {
+    const [year, month, day] = parseDate(date);
+    if (!(hour >= 0 && hour <= 12)) {
+        throw new Error(`wrong hour ${hour}`);
+    }
+    const seed = hash(`${year}-${month}-${day}|${hour}|${gender}|${fixLeap ? 1 : 0}`);
+    busyWait(latency(COMPUTE_MS, seed));
+
+    const soul = (month + 12 - hour) % 12;
+    const [className, classNumber] = CLASSES[seed % 5];
+    const yearStem = (year + 6) % 10;
+    const forward = (gender === '男') === (yearStem % 2 === 0);
+    const ziwei = (seed >>> 3) % 12;
+    const palaces = PALACES.map((name, i) => {
+        const branch = (soul + 12 - i) % 12;
+        const order = forward ? (branch - soul + 12) % 12 : (soul - branch + 12) % 12;
+        const majorStars = MAJOR
+            .map((star, k) => ({ star, k }))
+            .filter(({ k }) => (ziwei + k * (k < 6 ? 11 : 7) + (k < 6 ? 0 : 4)) % 12 === branch)
+            .map(({ star, k }) => ({
+                name: star,
+                type: 'major',
+                brightness: BRIGHTNESS[(seed + k + branch) % 7],
+                mutagen: (yearStem + k) % 7 < 4 && (seed + k) % 3 === 0 ? MUTAGENS[(yearStem + k) % 7] : ''
+            }));
+        const minorStars = MINOR
+            .filter((_, k) => (seed + k * 5 + hour) % 12 === branch)
+            .map((star, k) => ({ name: star, type: 'soft', brightness: '', mutagen: k === 0 && star.startsWith('文') ? '科' : '' }));
+        const adjectiveStars = new Array(2 + (seed + branch) % 5).fill(null).map((_, k) => ({ name: `杂曜${k}`, type: 'adjective' }));
+        return {
+            index: i,
+            name,
+            isBodyPalace: (soul + hour) % 12 === branch,
+            heavenlyStem: STEMS[(yearStem * 2 + branch + 2) % 10],
+            earthlyBranch: BRANCHES[branch],
+            majorStars,
+            minorStars,
+            adjectiveStars,
+            decadal: { range: [classNumber + order * 10, classNumber + order * 10 + 9] }
+        };
+    });
+
+    return {
+        gender,
+        solarDate: `${year}-${month}-${day}`,
+        lunarDate: `农历${year}年${month}月${day}日`,
+        time: `${HOUR_BRANCHES[hour]}时`,
+        timeRange: `${String((hour * 2 + 23) % 24).padStart(2, '0')}:00~${String(hour * 2 + 1).padStart(2, '0')}:00`,
+        sign: '狮子座',
+        zodiac: ZODIAC[(year + 8) % 12],
+        fiveElementsClass: className,
+        soul: MAJOR[seed % 14],
+        body: MAJOR[(seed >>> 5) % 14],
+        earthlyBranchOfSoulPalace: BRANCHES[soul],
+        earthlyBranchOfBodyPalace: BRANCHES[(soul + hour) % 12],
+        palaces,
+        horoscope(targetDate, targetHour) {
+            const target = hash(`${seed}|${targetDate}|${targetHour}`);
+            busyWait(latency(HOROSCOPE_MS, target));
+            const [targetYear] = parseDate(targetDate);
+            return {
+                solarDate: String(targetDate),
+                lunarDate: `农历${targetYear}年`,
+                age: { index: (targetYear - year) % 12, nominalAge: targetYear - year + 1 },
+                decadal: horoscopeItem(target, 1, 'decadal'),
+                yearly: horoscopeItem(target, 2, 'yearly'),
+                monthly: horoscopeItem(target, 3, 'monthly'),
+                daily: horoscopeItem(target, 4, 'daily'),
+                hourly: horoscopeItem(target, 5, 'hourly')
+            };
+        }
+    };
+}
+
+module.exports = {
+    astro: {
+        bySolar,
+        byLunar: (date, hour, gender, isLeapMonth, fixLeap) => bySolar(date, hour, gender, fixLeap)
+    },
+    // 让常驻内存不被回收
+    _resident: resident
+};
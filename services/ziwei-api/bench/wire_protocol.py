@@ -0,0 +1,113 @@
+"""线协议微基准：对比旧的 stdout 标记扫描与帧协议
+
+    python bench/wire_protocol.py            # 使用内置的样例命盘
+    python bench/wire_protocol.py --live     # 先用真实 iztro 算一张命盘作为样本
+
+输出每张命盘在线上的字节数，以及 Python 侧的解码耗时。
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wire import decode_frame, encode_frame  # noqa: E402
+
+PALACES = ['命宫', '兄弟', '夫妻', '子女', '财帛', '疾厄', '迁移', '仆役', '官禄', '田宅', '福德', '父母']
+BRANCHES = ['寅', '卯', '辰', '巳', '午', '未', '申', '酉', '戌', '亥', '子', '丑']
+STEMS = ['戊', '己', '庚', '辛', '壬', '癸', '甲', '乙', '丙', '丁', '戊', '己']
+MAJOR = ['紫微', '天机', '太阳', '武曲', '天同', '廉贞', '天府', '太阴', '贪狼', '巨门', '天相', '天梁', '七杀', '破军']
+MINOR = ['左辅', '右弼', '文昌', '文曲', '天魁', '天钺', '禄存', '天马', '擎羊', '陀罗', '火星', '铃星', '地空', '地劫']
+
+# 旧实现在结果前后打印的调试横幅
+LEGACY_BANNER = """=== 紫微斗数计算开始 ===
+Node.js版本: v18.20.4
+当前工作目录: /app
+✅ 直接加载iztro成功
+✅ iztro.astro 对象存在
+计算参数:
+- 日期: 2000-8-16
+- 时辰索引: 7 (0-11)
+- 性别: 男
+- 修正闰年: false
+开始调用iztro.astro.bySolar...
+✅ 紫微斗数计算成功！
+"""
+
+
+def sample_chart():
+    palaces = []
+    for i, name in enumerate(PALACES):
+        palaces.append({
+            "name": name,
+            "earthly_branch": BRANCHES[i],
+            "heavenly_stem": STEMS[i],
+            "major_stars": [
+                {"name": MAJOR[(i + k) % 14], "brightness": "庙", "mutagen": "禄" if i == k == 0 else ""}
+                for k in range(i % 3)
+            ],
+            "minor_stars": [{"name": MINOR[(i * 3 + k) % 14], "mutagen": ""} for k in range(i % 4)],
+            "adjective_stars_count": 3 + i % 4,
+        })
+    return {
+        "success": True,
+        "data": {
+            "basic_info": {
+                "birth_date": "2000-08-16", "birth_time": "14:30", "gender": "male",
+                "solar_date": "2000-8-16", "lunar_date": "二〇〇〇年七月十七", "time_chen": "未时",
+                "time_range": "13:00~15:00", "sign": "狮子座", "zodiac": "龙", "five_elements_class": "金四局",
+                "soul": "贪狼", "body": "天同",
+            },
+            "palaces": palaces,
+            "summary": {
+                "description": "2000-8-16出生，农历二〇〇〇年七月十七", "time_info": "未时 (13:00~15:00)",
+                "soul_palace": "申", "body_palace": "子", "calculation_time": "2000-01-01T00:00:00.000Z",
+            },
+        },
+    }
+
+
+def live_chart():
+    from engine_pool import SpawnEngine
+    return SpawnEngine().call('calculate', {"date": "2000-8-16", "hour": 7, "gender": "男", "fix_leap": False})
+
+
+def legacy_encode(result):
+    return (LEGACY_BANNER + "CALCULATION_SUCCESS\n" + json.dumps(result, ensure_ascii=False, indent=2)
+            + "\nCALCULATION_END\n=== 紫微斗数计算结束 ===\n").encode('utf-8')
+
+
+def legacy_decode(raw):
+    # 复刻旧实现：整体转成文本，多次 in/find 扫描后切片再 json.loads
+    stdout = raw.decode('utf-8')
+    if 'CALCULATION_SUCCESS' in stdout and 'CALCULATION_END' in stdout:
+        start = stdout.find('CALCULATION_SUCCESS') + len('CALCULATION_SUCCESS')
+        end = stdout.find('CALCULATION_END', start)
+        return json.loads(stdout[start:end].strip())
+    raise ValueError("markers not found")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--live', action='store_true', help="使用真实 iztro 计算样本命盘")
+    parser.add_argument('--number', type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    chart = live_chart() if args.live else sample_chart()
+    legacy = legacy_encode(chart)
+    framed = encode_frame(chart)
+    assert legacy_decode(legacy) == decode_frame(framed) == chart
+
+    legacy_us = min(timeit.repeat(lambda: legacy_decode(legacy), number=args.number, repeat=3)) / args.number * 1e6
+    framed_us = min(timeit.repeat(lambda: decode_frame(framed), number=args.number, repeat=3)) / args.number * 1e6
+
+    print(f"{'protocol':<22}{'bytes/chart':>12}{'decode us':>12}")
+    print(f"{'legacy markers+indent':<22}{len(legacy):>12}{legacy_us:>12.1f}")
+    print(f"{'length-prefixed json':<22}{len(framed):>12}{framed_us:>12.1f}")
+    print(f"字节减少 {100 * (1 - len(framed) / len(legacy)):.0f}%，解码耗时减少 {100 * (1 - framed_us / legacy_us):.0f}%")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,418 @@
+"""命盘结果缓存
+
+同一天同一时辰（两小时）内的出生时间得到的命盘完全相同，因此以
+(formatted_date, time_chen_index, iztro_gender, is_leap) 作为缓存键。
+
+缓存分两层：
+- 进程内 LRU（有容量上限）
+- SQLite 磁盘层（所有 gunicorn worker 共享，重启后仍然有效）
+
+守护模式（ZIWEI_ENGINE=daemon）下两层都由计算守护进程持有，web worker 只保留一个小的热点 LRU。
+
+缓存中只保存命盘核心数据；birth_time、calculation_time 等回显字段在命中后重新填入，
+因此同一键的核心数据在每次命中时都是同一份字节。内存层保存预编码的 EncodedChart，
+命中时只需把字节拼接进响应，不必重新序列化整张命盘。
+
+五大主题评分（topics.py）在编码时附加到核心数据中，随命盘一起缓存，命中时不再重新计分。
+"""
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import fastjson
+from singleflight import lease_owner
+from topics import with_topics
+
+logger = logging.getLogger(__name__)
+
+# 命盘结构变化时递增，旧的磁盘缓存自动失效
+SCHEMA_VERSION = 1
+
+# 回显字段：随请求变化，不进入缓存
+ECHO_FIELDS = {
+    "basic_info": ("birth_date", "birth_time", "gender"),
+    "summary": ("calculation_time",),
+}
+
+
+def make_key(formatted_date, time_chen_index, iztro_gender, is_leap):
+    """规范化缓存键"""
+    return f"v{SCHEMA_VERSION}|{formatted_date}|{time_chen_index}|{iztro_gender}|{int(bool(is_leap))}"
+
+
+def make_period_key(chart_key, scope, period):
+    """运限结果的缓存键：本命盘规范键 + 运限类型 + 时段"""
+    return f"{chart_key}|{scope}|{period}"
+
+
+def make_pair_key(key_a, key_b, version):
+    """合盘结果的缓存键：两张命盘的规范键排序后拼接，与请求中两方的先后无关"""
+    first, second = sorted((key_a, key_b))
+    return f"{first}&{second}|pair|{version}"
+
+
+def is_period_key(key):
+    # 运限与合盘结果（键比命盘键多出若干段）都放在 periods 层
+    return key.count('|') > 4
+
+
+def split_chart(data):
+    """把命盘拆成 (核心数据, 回显字段)"""
+    core = dict(data)
+    echo = {}
+    for section, fields in ECHO_FIELDS.items():
+        if section not in core:
+            continue
+        part = dict(core[section])
+        echo[section] = {field: part.pop(field) for field in fields if field in part}
+        core[section] = part
+    return core, echo
+
+
+def _merge_section(section, part, values):
+    # basic_info 的回显字段在最前面，summary 的在最后面，与 iztro_chart.js 的输出顺序一致
+    return {**values, **part} if section == "basic_info" else {**part, **values}
+
+
+def merge_chart(core, echo):
+    """把回显字段放回核心数据，保持原有字段顺序"""
+    data = dict(core)
+    for section, values in echo.items():
+        if section in data:
+            data[section] = _merge_section(section, data[section], values)
+    return data
+
+
+def encode_core(core):
+    return fastjson.dumps(core)
+
+
+def decode_core(raw):
+    return fastjson.loads(raw)
+
+
+class EncodedChart:
+    """
+    预编码的命盘核心数据
+    除回显字段所在的小对象外，其余部分（主要是十二宫位）只编码一次，
+    render() 按请求拼接出完整命盘的 JSON 字节
+    缺少（或版本过旧的）主题评分在这里补上，命盘库与旧的磁盘缓存条目同样带有评分
+    derived 保存由命盘推导、不进入响应的数据（例如合盘用的地支数组），随内存层一起淘汰
+    """
+
+    __slots__ = ('sections', 'derived')
+
+    def __init__(self, core):
+        core = with_topics(core)
+        self.sections = [
+            (key, dict(value) if key in ECHO_FIELDS else fastjson.dumps(value))
+            for key, value in core.items()
+        ]
+        self.derived = {}
+
+    def section(self, name):
+        """只解码一个部分，例如 palaces"""
+        for key, value in self.sections:
+            if key == name:
+                return dict(value) if key in ECHO_FIELDS else fastjson.loads(value)
+        return None
+
+    def core(self):
+        return {
+            key: dict(value) if key in ECHO_FIELDS else fastjson.loads(value)
+            for key, value in self.sections
+        }
+
+    def to_data(self, echo):
+        return merge_chart(self.core(), echo)
+
+    def render(self, echo):
+        parts = []
+        for key, value in self.sections:
+            if key in ECHO_FIELDS:
+                value = fastjson.dumps(_merge_section(key, value, echo.get(key, {})))
+            parts.append(fastjson.dumps(key) + b':' + value)
+        return b'{' + b','.join(parts) + b'}'
+
+
+class LRUTier:
+    """线程安全的进程内 LRU"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteTier:
+    """多进程共享的 SQLite 磁盘层，每个线程使用独立连接"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS charts (key TEXT PRIMARY KEY, core BLOB NOT NULL)")
+        # 跨进程请求合并的计算租约，见 singleflight.py
+        conn.execute("CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        # fork 之后不能复用父进程的连接
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute("SELECT core FROM charts WHERE key = ?", (key,)).fetchone()
+        return bytes(row[0]) if row else None
+
+    def put(self, key, value):
+        self._connect().execute("INSERT OR REPLACE INTO charts (key, core) VALUES (?, ?)", (key, value))
+
+    def count(self):
+        return self._connect().execute("SELECT COUNT(*) FROM charts").fetchone()[0]
+
+    def recent(self, limit):
+        """最近写入的 limit 条 (key, core)，最新的在前（INSERT OR REPLACE 会分配新的 rowid）"""
+        rows = self._connect().execute("SELECT key, core FROM charts ORDER BY rowid DESC LIMIT ?", (limit,))
+        return [(key, bytes(core)) for key, core in rows]
+
+    def acquire(self, key, ttl):
+        """
+        尝试获取计算租约；已被其他进程持有且未过期时返回 False
+        数据库出错时返回 True，退化为各进程各自计算
+        """
+        conn = self._connect()
+        now = time.time()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.Error as e:
+            logger.error(f"获取计算租约失败: {e}")
+            return True
+        try:
+            row = conn.execute("SELECT expires FROM leases WHERE key = ?", (key,)).fetchone()
+            if row and row[0] > now:
+                return False
+            conn.execute("INSERT OR REPLACE INTO leases (key, owner, expires) VALUES (?, ?, ?)",
+                         (key, lease_owner(), now + ttl))
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"获取计算租约失败: {e}")
+            return True
+        finally:
+            conn.execute("COMMIT")
+
+    def release(self, key):
+        try:
+            self._connect().execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, lease_owner()))
+        except sqlite3.Error as e:
+            # 租约带过期时间，删除失败最多让其他进程多等到过期
+            logger.error(f"释放计算租约失败: {e}")
+
+    def held(self, key):
+        try:
+            row = self._connect().execute("SELECT expires FROM leases WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error:
+            return False
+        return bool(row) and row[0] > time.time()
+
+
+class ChartCache:
+    """两层命盘缓存，带命中/未命中/淘汰计数"""
+
+    def __init__(self, memory_size=4096, db_path=None, period_memory_size=16384):
+        self.memory = LRUTier(memory_size)
+        # 运限结果（已编码的 JSON 字节），与命盘共用磁盘层
+        self.periods = LRUTier(period_memory_size)
+        self.disk = None
+        if db_path:
+            try:
+                self.disk = SQLiteTier(db_path)
+            except sqlite3.Error as e:
+                logger.error(f"磁盘缓存不可用，仅使用内存缓存: {e}")
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "disk_errors": 0}
+
+    @classmethod
+    def from_env(cls):
+        default_db = os.path.join(tempfile.gettempdir(), 'ziwei_chart_cache.sqlite3')
+        return cls(
+            memory_size=int(os.environ.get('ZIWEI_CACHE_SIZE', 4096)),
+            db_path=os.environ.get('ZIWEI_CACHE_DB', default_db),
+            period_memory_size=int(os.environ.get('ZIWEI_PERIOD_CACHE_SIZE', 16384)),
+        )
+
+    def get_memory(self, key):
+        chart = self.memory.get(key)
+        if chart is not None:
+            self.stats["memory_hits"] += 1
+        return chart
+
+    def get(self, key):
+        """返回 EncodedChart，未命中返回 None"""
+        chart = self.get_memory(key)
+        if chart is not None:
+            return chart
+
+        if self.disk is not None:
+            try:
+                raw = self.disk.get(key)
+            except sqlite3.Error as e:
+                self.stats["disk_errors"] += 1
+                logger.error(f"读取磁盘缓存失败: {e}")
+                raw = None
+            if raw is not None:
+                self.stats["disk_hits"] += 1
+                chart = EncodedChart(decode_core(raw))
+                self.memory.put(key, chart)
+                return chart
+
+        self.stats["misses"] += 1
+        return None
+
+    def lookup(self, key, canonical, store=None):
+        """
+        按 内存 → 预计算命盘库 → 磁盘 的顺序查找，未命中返回 None
+        命盘库的结果只放入内存层，不写磁盘
+        """
+        chart = self.get_memory(key)
+        if chart is not None:
+            return chart
+        if store is not None:
+            core = store.lookup(*canonical)
+            if core is not None:
+                chart = EncodedChart(core)
+                self.put_memory(key, chart)
+                return chart
+        return self.get(key)
+
+    def preload(self, limit):
+        """
+        把磁盘层最近写入的 limit 条载入内存，返回载入条数
+        运限结果与命盘共用磁盘表，按键的段数分别放入对应的内存层
+        """
+        if self.disk is None or limit <= 0:
+            return 0
+        try:
+            rows = self.disk.recent(limit)
+        except sqlite3.Error as e:
+            self.stats["disk_errors"] += 1
+            logger.error(f"预载磁盘缓存失败: {e}")
+            return 0
+        # 从旧到新放入，最新的条目留在 LRU 的最近端
+        for key, raw in reversed(rows):
+            if is_period_key(key):
+                self.periods.put(key, raw)
+            else:
+                self.memory.put(key, EncodedChart(decode_core(raw)))
+        return len(rows)
+
+    def put_memory(self, key, chart):
+        """只放入内存层（例如来自预计算命盘库的结果，无需再写磁盘）"""
+        self.memory.put(key, chart)
+
+    def put(self, key, chart, raw):
+        self.memory.put(key, chart)
+        if self.disk is not None:
+            try:
+                self.disk.put(key, raw)
+            except sqlite3.Error as e:
+                self.stats["disk_errors"] += 1
+                logger.error(f"写入磁盘缓存失败: {e}")
+
+    def get_period(self, key):
+        """返回运限（或合盘）结果的 JSON 字节，未命中返回 None"""
+        raw = self.periods.get(key)
+        if raw is not None or self.disk is None:
+            return raw
+        try:
+            raw = self.disk.get(key)
+        except sqlite3.Error as e:
+            self.stats["disk_errors"] += 1
+            logger.error(f"读取磁盘缓存失败: {e}")
+            return None
+        if raw is not None:
+            self.periods.put(key, raw)
+        return raw
+
+    def put_period(self, key, raw):
+        self.periods.put(key, raw)
+        if self.disk is not None:
+            try:
+                self.disk.put(key, raw)
+            except sqlite3.Error as e:
+                self.stats["disk_errors"] += 1
+                logger.error(f"写入磁盘缓存失败: {e}")
+
+    def remember(self, key, result):
+        """只缓存成功的计算结果，返回对应的 EncodedChart"""
+        if result.get('success') and 'data' in result:
+            core, _ = split_chart(result['data'])
+            core = with_topics(core)
+            chart = EncodedChart(core)
+            self.put(key, chart, encode_core(core))
+            return chart
+        return None
+
+    def snapshot(self):
+        """缓存状态，供 /health 使用"""
+        info = dict(self.stats)
+        info.update({
+            "memory_entries": len(self.memory),
+            "memory_capacity": self.memory.maxsize,
+            "evictions": self.memory.evictions,
+            "period_entries": len(self.periods),
+            "disk_enabled": self.disk is not None,
+        })
+        return info
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                if os.environ.get('ZIWEI_ENGINE') == 'daemon':
+                    # 磁盘层与大容量内存层归计算守护进程所有
+                    _cache = ChartCache(
+                        memory_size=int(os.environ.get('ZIWEI_FRONT_CACHE_SIZE', 256)),
+                        period_memory_size=int(os.environ.get('ZIWEI_PERIOD_CACHE_SIZE', 16384)),
+                    )
+                else:
+                    _cache = ChartCache.from_env()
+    return _cache
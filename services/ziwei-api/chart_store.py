@@ -0,0 +1,361 @@
+"""离线预计算命盘库
+
+输入空间是有限的：1900–2100 年约 7.3 万天 × 12 时辰 × 2 性别 × is_leap。
+`build` 命令一次性用 iztro 算完整个范围，把每张命盘编码成定长二进制记录，
+API 通过 mmap 直接查表，范围内的请求完全不需要 Node.js。
+
+文件布局（小端）：
+    header   : HEADER 结构
+    index    : 每个 (天, 时辰, 性别, is_leap) 槽位一个 uint32 记录号
+    records  : 定长记录
+    vocab    : 宫位/星曜/亮度/四化等小词表（记录中以 uint8 引用）
+    texts    : 日期、描述等长文本表（记录中以 uint32 引用）
+
+用法：
+    python chart_store.py build --start 1900-01-01 --end 2100-12-31 --output charts.bin
+    python chart_store.py info charts.bin
+    python chart_store.py lookup charts.bin 2000-8-16 7 男
+"""
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+MAGIC = b'ZWCS'
+FORMAT_VERSION = 1
+
+# magic, version, max_major, max_minor, start_ordinal, days, record_size, record_count,
+# index_offset, records_offset, vocab_offset, texts_offset
+HEADER = struct.Struct('<4sHBBIIII4Q')
+
+MAX_MAJOR = 3
+MAX_MINOR = 8
+PALACE_COUNT = 12
+
+BASIC_FIELDS = ('solar_date', 'lunar_date', 'time_chen', 'time_range', 'sign', 'zodiac',
+                'five_elements_class', 'soul', 'body')
+SUMMARY_FIELDS = ('description', 'time_info', 'soul_palace', 'body_palace')
+
+GENDERS = ('男', '女')
+SLOTS_PER_DAY = 12 * len(GENDERS) * 2
+NO_RECORD = 0xFFFFFFFF
+
+logger = logging.getLogger(__name__)
+
+
+def record_struct(max_major=MAX_MAJOR, max_minor=MAX_MINOR):
+    # 每个宫位: name, earthly_branch, heavenly_stem, 主星数, 辅星数, 杂曜数(uint16)
+    #          + 主星 (name, brightness, mutagen) × max_major + 辅星 (name, mutagen) × max_minor
+    palace = 'BBBBBH' + 'BBB' * max_major + 'BB' * max_minor
+    return struct.Struct('<' + 'I' * (len(BASIC_FIELDS) + len(SUMMARY_FIELDS)) + palace * PALACE_COUNT)
+
+
+def slot_of(day_offset, time_chen_index, iztro_gender, is_leap):
+    return ((day_offset * 12 + time_chen_index) * 2 + GENDERS.index(iztro_gender)) * 2 + int(bool(is_leap))
+
+
+def _parse_date(formatted_date):
+    year, month, day = formatted_date.split('-')
+    return date(int(year), int(month), int(day))
+
+
+class StringTable:
+    """构建期的字符串驻留表"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.ids = {}
+        self.strings = []
+
+    def intern(self, value):
+        value = '' if value is None else str(value)
+        sid = self.ids.get(value)
+        if sid is None:
+            sid = len(self.strings)
+            if sid >= self.limit:
+                raise ValueError(f"字符串表超出上限 {self.limit}: {value!r}")
+            self.ids[value] = sid
+            self.strings.append(value)
+        return sid
+
+    def encode(self):
+        blobs = [s.encode('utf-8') for s in self.strings]
+        offsets = [0]
+        for blob in blobs:
+            offsets.append(offsets[-1] + len(blob))
+        return struct.pack('<I', len(blobs)) + struct.pack(f'<{len(offsets)}I', *offsets) + b''.join(blobs)
+
+
+def _decode_strings(buf, offset):
+    count, = struct.unpack_from('<I', buf, offset)
+    offsets = struct.unpack_from(f'<{count + 1}I', buf, offset + 4)
+    base = offset + 4 + 4 * (count + 1)
+    raw = bytes(buf[base:base + offsets[-1]])
+    return [raw[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(count)]
+
+
+class RecordEncoder:
+    def __init__(self):
+        self.vocab = StringTable(256)
+        self.texts = StringTable(NO_RECORD)
+        self.record = record_struct()
+
+    def encode(self, core):
+        basic = core.get('basic_info', {})
+        summary = core.get('summary', {})
+        values = [self.texts.intern(basic.get(f)) for f in BASIC_FIELDS]
+        values += [self.texts.intern(summary.get(f)) for f in SUMMARY_FIELDS]
+
+        palaces = core.get('palaces', [])
+        if len(palaces) != PALACE_COUNT:
+            raise ValueError(f"宫位数量异常: {len(palaces)}")
+        v = self.vocab.intern
+        for palace in palaces:
+            majors = palace.get('major_stars', [])
+            minors = palace.get('minor_stars', [])
+            if len(majors) > MAX_MAJOR or len(minors) > MAX_MINOR:
+                raise ValueError(f"星曜数量超出记录容量: 主星 {len(majors)}, 辅星 {len(minors)}")
+            values += [v(palace.get('name')), v(palace.get('earthly_branch')), v(palace.get('heavenly_stem')),
+                       len(majors), len(minors), palace.get('adjective_stars_count', 0)]
+            for i in range(MAX_MAJOR):
+                star = majors[i] if i < len(majors) else {}
+                values += [v(star.get('name')), v(star.get('brightness')), v(star.get('mutagen'))]
+            for i in range(MAX_MINOR):
+                star = minors[i] if i < len(minors) else {}
+                values += [v(star.get('name')), v(star.get('mutagen'))]
+        return self.record.pack(*values)
+
+
+class ChartStore:
+    """mmap 只读命盘库"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, max_major, max_minor, start_ordinal, self.days, record_size, self.record_count,
+         self._index_offset, self._records_offset, vocab_offset, texts_offset) = HEADER.unpack_from(self._buf, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"不支持的命盘库文件: {path}")
+        self.start = date.fromordinal(start_ordinal)
+        self.end = self.start + timedelta(days=self.days - 1)
+        self._max_major = max_major
+        self._max_minor = max_minor
+        self._record = record_struct(max_major, max_minor)
+        if self._record.size != record_size:
+            raise ValueError("记录长度与文件头不一致")
+        self._vocab = _decode_strings(self._buf, vocab_offset)
+        self._texts = _decode_strings(self._buf, texts_offset)
+
+    def covers(self, formatted_date):
+        try:
+            return self.start <= _parse_date(formatted_date) <= self.end
+        except ValueError:
+            return False
+
+    def lookup(self, formatted_date, time_chen_index, iztro_gender, is_leap):
+        """返回命盘核心数据（不含回显字段），不在范围内返回 None"""
+        try:
+            day = _parse_date(formatted_date)
+        except ValueError:
+            return None
+        offset = day.toordinal() - self.start.toordinal()
+        if not 0 <= offset < self.days or iztro_gender not in GENDERS:
+            return None
+        slot = slot_of(offset, time_chen_index, iztro_gender, is_leap)
+        record_id, = struct.unpack_from('<I', self._buf, self._index_offset + slot * 4)
+        if record_id == NO_RECORD:
+            return None
+        return self._decode(self._record.unpack_from(self._buf, self._records_offset + record_id * self._record.size))
+
+    def _decode(self, values):
+        texts, vocab = self._texts, self._vocab
+        n_basic, n_summary = len(BASIC_FIELDS), len(SUMMARY_FIELDS)
+        basic_info = {f: texts[values[i]] for i, f in enumerate(BASIC_FIELDS)}
+        summary = {f: texts[values[n_basic + i]] for i, f in enumerate(SUMMARY_FIELDS)}
+
+        palaces = []
+        pos = n_basic + n_summary
+        palace_width = 6 + 3 * self._max_major + 2 * self._max_minor
+        for _ in range(PALACE_COUNT):
+            name, branch, stem, n_major, n_minor, adjective = values[pos:pos + 6]
+            major_base = pos + 6
+            minor_base = major_base + 3 * self._max_major
+            palaces.append({
+                "name": vocab[name],
+                "earthly_branch": vocab[branch],
+                "heavenly_stem": vocab[stem],
+                "major_stars": [
+                    {"name": vocab[values[major_base + 3 * i]],
+                     "brightness": vocab[values[major_base + 3 * i + 1]],
+                     "mutagen": vocab[values[major_base + 3 * i + 2]]}
+                    for i in range(n_major)
+                ],
+                "minor_stars": [
+                    {"name": vocab[values[minor_base + 2 * i]],
+                     "mutagen": vocab[values[minor_base + 2 * i + 1]]}
+                    for i in range(n_minor)
+                ],
+                "adjective_stars_count": adjective,
+            })
+            pos += palace_width
+
+        return {"basic_info": basic_info, "palaces": palaces, "summary": summary}
+
+    def info(self):
+        return {
+            "path": self.path,
+            "start": self.start.isoformat(),
+            "end": self.end.isoformat(),
+            "records": self.record_count,
+            "record_size": self._record.size,
+            "file_size": len(self._buf),
+        }
+
+    def close(self):
+        self._buf.close()
+        self._file.close()
+
+
+def build(start, end, output, pool, days_per_call=4, progress=True):
+    """用 iztro 跑完 [start, end] 范围的全部命盘并写入 output"""
+    from chart_cache import split_chart
+
+    days = (end - start).days + 1
+    encoder = RecordEncoder()
+    index = bytearray(b'\xff' * (days * SLOTS_PER_DAY * 4))
+    tmp_records = output + '.records.tmp'
+    record_count = 0
+    started = time.monotonic()
+    done_days = 0
+
+    def items_for(day):
+        formatted = f"{day.year}-{day.month}-{day.day}"
+        return [
+            {"date": formatted, "hour": hour, "gender": gender, "fix_leap": bool(leap)}
+            for hour in range(12) for gender in GENDERS for leap in (0, 1)
+        ]
+
+    def compute(first_offset):
+        batch = [start + timedelta(days=first_offset + i)
+                 for i in range(min(days_per_call, days - first_offset))]
+        items = [item for day in batch for item in items_for(day)]
+        return first_offset, pool.call('calculate_many', {"items": items}, timeout=pool.call_timeout * 4)
+
+    with open(tmp_records, 'wb') as records, ThreadPoolExecutor(max_workers=pool.size) as executor:
+        for first_offset, results in executor.map(compute, range(0, days, days_per_call)):
+            previous_blob = None
+            for i, result in enumerate(results):
+                if not result.get('success'):
+                    raise RuntimeError(f"计算失败 (day+{first_offset}, #{i}): {result.get('error')}")
+                blob = encoder.encode(split_chart(result['data'])[0])
+                slot = first_offset * SLOTS_PER_DAY + i
+                # is_leap=1 与 is_leap=0 结果相同时（非闰月日期）复用同一条记录
+                if slot % 2 == 1 and blob == previous_blob:
+                    record_id = record_count - 1
+                else:
+                    records.write(blob)
+                    record_id = record_count
+                    record_count += 1
+                previous_blob = blob
+                struct.pack_into('<I', index, slot * 4, record_id)
+            done_days += len(results) // SLOTS_PER_DAY
+            if progress and done_days % 365 < days_per_call:
+                elapsed = time.monotonic() - started
+                print(f"  {done_days}/{days} 天, {record_count} 条记录, {elapsed:.0f}s", file=sys.stderr)
+
+    vocab = encoder.vocab.encode()
+    texts = encoder.texts.encode()
+    index_offset = HEADER.size
+    records_offset = index_offset + len(index)
+    vocab_offset = records_offset + record_count * encoder.record.size
+    texts_offset = vocab_offset + len(vocab)
+
+    tmp_output = output + '.tmp'
+    with open(tmp_output, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, MAX_MAJOR, MAX_MINOR, start.toordinal(), days,
+                            encoder.record.size, record_count,
+                            index_offset, records_offset, vocab_offset, texts_offset))
+        f.write(index)
+        with open(tmp_records, 'rb') as records:
+            while True:
+                chunk = records.read(1 << 20)
+                if not chunk:
+                    break
+                f.write(chunk)
+        f.write(vocab)
+        f.write(texts)
+    os.replace(tmp_output, output)
+    os.remove(tmp_records)
+    return record_count
+
+
+_store = None
+_store_loaded = False
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """按 ZIWEI_CHART_STORE 加载命盘库；未配置或加载失败时返回 None"""
+    global _store, _store_loaded
+    if not _store_loaded:
+        with _store_lock:
+            if not _store_loaded:
+                path = os.environ.get('ZIWEI_CHART_STORE')
+                if path and os.path.exists(path):
+                    try:
+                        _store = ChartStore(path)
+                    except (OSError, ValueError, struct.error) as e:
+                        logger.error(f"命盘库加载失败: {e}")
+                _store_loaded = True
+    return _store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="紫微斗数预计算命盘库")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_build = sub.add_parser('build', help="用 iztro 预计算日期范围内的全部命盘")
+    p_build.add_argument('--start', default='1900-01-01')
+    p_build.add_argument('--end', default='2100-12-31')
+    p_build.add_argument('--output', default='charts.bin')
+    p_build.add_argument('--days-per-call', type=int, default=4)
+
+    p_info = sub.add_parser('info', help="查看命盘库信息")
+    p_info.add_argument('path')
+
+    p_lookup = sub.add_parser('lookup', help="查询单张命盘")
+    p_lookup.add_argument('path')
+    p_lookup.add_argument('date', help="iztro 日期格式，如 2000-8-16")
+    p_lookup.add_argument('hour', type=int, help="时辰索引 0-11")
+    p_lookup.add_argument('gender', choices=GENDERS)
+    p_lookup.add_argument('--leap', action='store_true')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        from engine_pool import NodeWorkerPool
+        pool = NodeWorkerPool.from_env()
+        try:
+            start, end = date.fromisoformat(args.start), date.fromisoformat(args.end)
+            count = build(start, end, args.output, pool, days_per_call=args.days_per_call)
+        finally:
+            pool.close()
+        print(json.dumps(ChartStore(args.output).info(), ensure_ascii=False, indent=2))
+        print(f"共写入 {count} 条记录", file=sys.stderr)
+    elif args.command == 'info':
+        print(json.dumps(ChartStore(args.path).info(), ensure_ascii=False, indent=2))
+    else:
+        chart = ChartStore(args.path).lookup(args.date, args.hour, args.gender, args.leap)
+        print(json.dumps(chart, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
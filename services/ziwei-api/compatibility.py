@@ -0,0 +1,187 @@
+"""合盘（两张命盘的配对分析）
+
+把对方命盘按地支叠到自己的命盘上：同一地支的宫位重合，对方该宫的星曜「落入」自己的对应宫位。
+- 叠盘得分：自己的关系宫位（夫妻为主，命、福德次之，迁移、子女再次）承接对方同一地支宫位的星曜得分，
+  星曜得分沿用 topics.py 的吉凶、亮度、四化计分
+- 四化互动：对方的化禄/化权/化科/化忌落入自己的哪个宫位
+- 命宫连结：一方的命宫与另一方的夫妻宫同一地支时加分
+
+每张命盘先编码为按地支排列的数组（关系宫位权重、宫位得分、命宫与夫妻宫的地支），
+一对多时一次性对所有候选命盘做向量化运算，不逐对计算。
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from topics import SCORING_VERSION, is_malefic_star, normalize_name, palace_key, palace_values, to_score
+
+# 合盘规则变化时递增；连同主题计分的版本一起进入合盘缓存键
+COMPATIBILITY_VERSION = 1
+
+BRANCHES = '子丑寅卯辰巳午未申酉戌亥'
+# 合盘时看重的宫位（宫位比较键 -> 权重）
+RELATION_WEIGHTS = {'夫妻': 3, '命': 2, '福德': 2, '遷移': 1, '子女': 1}
+# 命宫与对方夫妻宫同一地支时的加分（星曜分值单位）
+LINK_BONUS = 4
+
+ChartVectors = namedtuple('ChartVectors', 'weights scores soul spouse')
+
+
+def version_tag():
+    return f"c{COMPATIBILITY_VERSION}s{SCORING_VERSION}"
+
+
+def vectorize(cores):
+    """
+    把命盘编码为按地支排列的数组：
+    weights [N, 12] 关系宫位权重，scores [N, 12] 宫位得分，soul / spouse [N] 命宫、夫妻宫的地支（-1 为缺失）
+    """
+    n = len(cores)
+    _, palace_score = palace_values(cores)
+    weights = np.zeros((n, 12), dtype=np.int32)
+    scores = np.zeros((n, 12), dtype=np.int32)
+    soul = np.full(n, -1, dtype=np.int32)
+    spouse = np.full(n, -1, dtype=np.int32)
+    for row, core in enumerate(cores):
+        for i, palace in enumerate(core.get('palaces', [])[:12]):
+            branch = BRANCHES.find(palace.get('earthly_branch') or '-')
+            if branch < 0:
+                continue
+            key = palace_key(palace.get('name'))
+            weights[row, branch] = RELATION_WEIGHTS.get(key, 0)
+            scores[row, branch] = palace_score[row, i]
+            if key == '命':
+                soul[row] = branch
+            elif key == '夫妻':
+                spouse[row] = branch
+    return ChartVectors(weights, scores, soul, spouse)
+
+
+def chart_vectors(charts):
+    """
+    EncodedChart 列表的地支数组；每张命盘的数组在第一次用到时算出并保存在 chart.derived 中，
+    一对多时常用的候选命盘不必再解码十二宫位
+    """
+    tag = version_tag()
+    missing = [chart for chart in charts if chart.derived.get('compatibility', (None,))[0] != tag]
+    if missing:
+        vectors = vectorize([{"palaces": chart.section('palaces') or []} for chart in missing])
+        for row, chart in enumerate(missing):
+            chart.derived['compatibility'] = (tag, tuple(field[row] for field in vectors))
+    rows = [chart.derived['compatibility'][1] for chart in charts]
+    return ChartVectors(*(np.stack([row[i] for row in rows]) for i in range(len(ChartVectors._fields))))
+
+
+def _overlay(host_weights, guest_scores):
+    """宿主的关系宫位承接对方同一地支宫位的得分，按宿主的宫位权重平均"""
+    return (host_weights * guest_scores).sum(axis=-1) / np.maximum(host_weights.sum(axis=-1), 1)
+
+
+def _linked(soul, spouse):
+    return (soul >= 0) & (soul == spouse)
+
+
+def score_vectors(a, b):
+    """
+    a 与 b 的每一行配对（a 可以只有一行，按广播与 b 的所有行配对）
+    返回 (总分, a 落入 b 的得分, b 落入 a 的得分, a 命宫入 b 夫妻宫, b 命宫入 a 夫妻宫)
+    """
+    a_in_b = _overlay(b.weights, a.scores)
+    b_in_a = _overlay(a.weights, b.scores)
+    a_link = _linked(a.soul, b.spouse)
+    b_link = _linked(b.soul, a.spouse)
+    total = to_score((a_in_b + b_in_a) / 2 + LINK_BONUS * (a_link.astype(np.int32) + b_link))
+    return total, to_score(a_in_b), to_score(b_in_a), a_link, b_link
+
+
+def _by_branch(core):
+    return {palace.get('earthly_branch'): palace for palace in core.get('palaces', [])}
+
+
+def _stars(palace):
+    return (palace.get('major_stars') or []) + (palace.get('minor_stars') or [])
+
+
+def _overlays(host, guest):
+    """宿主的关系宫位中落入了对方哪些星曜"""
+    guest_palaces = _by_branch(guest)
+    overlays = []
+    for palace in host.get('palaces', []):
+        if not RELATION_WEIGHTS.get(palace_key(palace.get('name'))):
+            continue
+        other = guest_palaces.get(palace.get('earthly_branch')) or {}
+        overlays.append({
+            "palace": palace.get('name'),
+            "earthly_branch": palace.get('earthly_branch'),
+            "guest_palace": other.get('name'),
+            "stars": [
+                {"name": star.get('name'), "type": '凶' if is_malefic_star(star.get('name')) else '吉',
+                 "mutagen": star.get('mutagen') or None}
+                for star in _stars(other)
+            ],
+        })
+    return overlays
+
+
+def _mutagens(host, guest):
+    """对方的四化星落入宿主的哪个宫位"""
+    host_palaces = _by_branch(host)
+    mutagens = []
+    for palace in guest.get('palaces', []):
+        landed = host_palaces.get(palace.get('earthly_branch')) or {}
+        for star in _stars(palace):
+            if not star.get('mutagen'):
+                continue
+            mutagens.append({
+                "star": star.get('name'),
+                "mutagen": star['mutagen'],
+                "type": '凶' if normalize_name(star['mutagen']).endswith('忌') else '吉',
+                "palace": landed.get('name'),
+                "relation": bool(RELATION_WEIGHTS.get(palace_key(landed.get('name')))),
+            })
+    return mutagens
+
+
+def _links(a_link, b_link):
+    links = []
+    if a_link:
+        links.append({"from": "a", "to": "b", "type": "命宫入夫妻宫"})
+    if b_link:
+        links.append({"from": "b", "to": "a", "type": "命宫入夫妻宫"})
+    return links
+
+
+def compare(core_a, core_b):
+    """两张命盘的完整合盘结果"""
+    total, a_in_b, b_in_a, a_link, b_link = score_vectors(vectorize([core_a]), vectorize([core_b]))
+    return {
+        "version": version_tag(),
+        "score": int(total[0]),
+        # a_to_b：a 的星曜落入 b 的宫位（b 感受到的 a）
+        "a_to_b": {"score": int(a_in_b[0]), "overlays": _overlays(core_b, core_a), "mutagens": _mutagens(core_b, core_a)},
+        "b_to_a": {"score": int(b_in_a[0]), "overlays": _overlays(core_a, core_b), "mutagens": _mutagens(core_a, core_b)},
+        "links": _links(bool(a_link[0]), bool(b_link[0])),
+    }
+
+
+def flip(result):
+    """交换两方（合盘结果按规范键顺序缓存，请求顺序相反时翻转后返回）"""
+    swap = {"a": "b", "b": "a"}
+    return {
+        **result,
+        "a_to_b": result["b_to_a"],
+        "b_to_a": result["a_to_b"],
+        "links": [{**link, "from": swap[link["from"]], "to": swap[link["to"]]} for link in result["links"]],
+    }
+
+
+def compare_many(chart, charts):
+    """一对多：chart 与 charts（EncodedChart）中的每一张配对，返回每对的摘要（不含叠盘明细）"""
+    if not charts:
+        return []
+    total, a_in_b, b_in_a, a_link, b_link = score_vectors(chart_vectors([chart]), chart_vectors(charts))
+    return [
+        {"score": int(total[i]), "a_to_b": int(a_in_b[i]), "b_to_a": int(b_in_a[i]),
+         "links": _links(bool(a_link[i]), bool(b_link[i]))}
+        for i in range(len(charts))
+    ]
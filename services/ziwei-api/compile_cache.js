@@ -0,0 +1,103 @@
+// 模块编译缓存：让冷启动的 node 进程跳过 iztro 及其依赖的模块解析和 JS 编译
+// - Node >= 22.1 直接使用内置的 module.enableCompileCache()
+// - 更早的版本（Dockerfile 中的 Node 18）改写 Module.prototype._compile，
+//   用 vm.Script 的 cachedData 把 V8 字节码缓存到磁盘，并缓存 require 路径解析结果
+// 设置 ZIWEI_COMPILE_CACHE=0 可关闭（用于基准对比）
+const Module = require('module');
+const crypto = require('crypto');
+const fs = require('fs');
+const path = require('path');
+const vm = require('vm');
+
+const CACHE_DIR = process.env.ZIWEI_COMPILE_CACHE_DIR || path.join(__dirname, '.compile-cache');
+const RESOLVE_FILE = path.join(CACHE_DIR, 'resolve.json');
+
+function install() {
+    if (process.env.ZIWEI_COMPILE_CACHE === '0') return 'disabled';
+
+    try {
+        fs.mkdirSync(CACHE_DIR, { recursive: true });
+    } catch (e) {
+        return 'unavailable';
+    }
+
+    if (typeof Module.enableCompileCache === 'function') {
+        Module.enableCompileCache(CACHE_DIR);
+        return 'builtin';
+    }
+
+    installResolveCache();
+    installBytecodeCache();
+    return 'bytecode';
+}
+
+function installResolveCache() {
+    let resolved = {};
+    try {
+        resolved = JSON.parse(fs.readFileSync(RESOLVE_FILE, 'utf8'));
+    } catch (e) {
+        // 首次运行没有缓存文件
+    }
+    let dirty = false;
+
+    const originalResolve = Module._resolveFilename;
+    Module._resolveFilename = function (request, parent, isMain, options) {
+        if (options || !parent || !parent.filename || Module.isBuiltin?.(request)) {
+            return originalResolve.call(this, request, parent, isMain, options);
+        }
+        const key = `${path.dirname(parent.filename)}\0${request}`;
+        const hit = resolved[key];
+        if (hit && fs.existsSync(hit)) return hit;
+        const filename = originalResolve.call(this, request, parent, isMain, options);
+        resolved[key] = filename;
+        dirty = true;
+        return filename;
+    };
+
+    process.once('exit', () => {
+        if (!dirty) return;
+        try {
+            const tmp = `${RESOLVE_FILE}.${process.pid}`;
+            fs.writeFileSync(tmp, JSON.stringify(resolved));
+            fs.renameSync(tmp, RESOLVE_FILE);
+        } catch (e) {
+            // 缓存写入失败不影响计算
+        }
+    });
+}
+
+function installBytecodeCache() {
+    Module.prototype._compile = function (content, filename) {
+        const wrapper = Module.wrap(content);
+        const digest = crypto.createHash('sha1').update(process.version).update(filename).update(content).digest('hex');
+        const cacheFile = path.join(CACHE_DIR, `${digest}.bin`);
+
+        let cachedData;
+        try {
+            cachedData = fs.readFileSync(cacheFile);
+        } catch (e) {
+            cachedData = undefined;
+        }
+
+        const script = new vm.Script(wrapper, { filename, cachedData });
+        if (!cachedData || script.cachedDataRejected) {
+            try {
+                fs.writeFileSync(cacheFile, script.createCachedData());
+            } catch (e) {
+                // 缓存写入失败不影响计算
+            }
+        }
+
+        const mod = this;
+        const require = (id) => mod.require(id);
+        require.resolve = (request, options) => Module._resolveFilename(request, mod, false, options);
+        require.main = process.mainModule;
+        require.extensions = Module._extensions;
+        require.cache = Module._cache;
+
+        const fn = script.runInThisContext({ displayErrors: true });
+        return fn.call(mod.exports, mod.exports, require, mod, filename, path.dirname(filename));
+    };
+}
+
+module.exports = { mode: install(), CACHE_DIR };
@@ -0,0 +1,274 @@
+"""计算守护进程（ZIWEI_ENGINE=daemon）
+
+    python compute_daemon.py [--socket /tmp/ziwei-compute.sock]
+    python compute_daemon.py --wait 120      # 等到守护进程开始接受连接（容器启动脚本在启动 gunicorn 前使用）
+
+默认每个 gunicorn worker 各自持有一组 Node.js 进程和一份内存缓存，总内存随 worker 数线性增长。
+守护模式下整台机器只有这个进程持有 iztro 引擎和命盘缓存（内存层 + SQLite 磁盘层），
+web worker 经 Unix socket 把引擎调用转发过来（daemon_client.py），自身只保留一个小的热点 LRU，
+worker 数增加时只多出连接，不多出 Node.js 进程。
+
+- calculate 先查命盘缓存与预计算命盘库（ZIWEI_CHART_STORE），未命中时同一规范键在所有 worker 之间只计算一次，
+  命中时直接返回预编码字节
+- calculate_batch（批量接口）逐条查命盘缓存与命盘库，未命中的去重后一次 calculate_many 计算并写入缓存
+- calculate / calculate_many / horoscope 经过准入控制；队列已满、超时分别以 OVERLOADED、TIMEOUT 状态返回
+- 同一连接上的请求并发处理；连接断开或收到 cancel 时取消对应请求，没有其他等待者的计算随之取消
+- version、health 由守护进程直接回答，不调用 Node.js
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+from admission import Deadline, DeadlineExceeded, Overloaded, get_admission
+from async_engine import create_async_pool
+from chart_cache import ChartCache, make_key
+from chart_store import get_store
+from engine_pool import EngineError, EngineTimeout, _env_int
+import events
+from fastjson import dumps as dumps_json, splice_object
+from singleflight import AsyncSingleFlight
+from wire import (
+    DAEMON_OPS, MAX_FRAME_SIZE, STATUS_ERROR, STATUS_OK, STATUS_OVERLOADED, STATUS_TIMEOUT, FrameError,
+    encode_response, read_request_async,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = '/tmp/ziwei-compute.sock'
+
+# 经过准入控制的操作（与 index.py 中的同步路径一致）
+ADMITTED_OPS = {'calculate', 'calculate_many', 'horoscope'}
+
+
+class ComputeDaemon:
+    def __init__(self, engine=None, cache=None, store=None):
+        # 守护进程本身也以 ZIWEI_ENGINE=daemon 启动，这里不能再转发给自己
+        self.engine = engine or create_async_pool('pool')
+        self.cache = cache or ChartCache.from_env()
+        self.store = store or get_store()
+        self.flights = AsyncSingleFlight()
+        self.admission = get_admission()
+        self.version = None
+        self.started = time.time()
+        self.connections = 0
+        self.stats = {"requests": 0, "cancelled": 0, "errors": 0}
+        self.server = None
+
+    async def start(self, path):
+        try:
+            await self.engine.warm_up()
+            self.version = await self.engine.call('version', timeout=10)
+        except EngineError as e:
+            logger.error(f"预热计算进程失败: {e}")
+        preloaded = await asyncio.to_thread(self.cache.preload, _env_int('ZIWEI_CACHE_PRELOAD', 1024))
+        logger.info(f"预载缓存 {preloaded} 条")
+        if os.path.exists(path):
+            os.unlink(path)
+        self.server = await asyncio.start_unix_server(self.handle_connection, path=path, limit=MAX_FRAME_SIZE)
+        os.chmod(path, 0o660)
+        logger.info(f"计算守护进程已启动 - socket: {path}, pid: {os.getpid()}")
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        await self.engine.close()
+
+    async def handle_connection(self, reader, writer):
+        self.connections += 1
+        tasks = {}
+        try:
+            while True:
+                try:
+                    request = await read_request_async(reader)
+                except (FrameError, ValueError, ConnectionError) as e:
+                    logger.warning(f"无效的请求帧，关闭连接: {e}")
+                    break
+                if request is None:
+                    break
+                request_id, op, timeout, params = request
+                if op == 'cancel':
+                    task = tasks.get(params.get('id')) if isinstance(params, dict) else None
+                    if task is not None:
+                        self.stats["cancelled"] += 1
+                        task.cancel()
+                    continue
+                task = asyncio.ensure_future(self.respond(writer, request_id, op, params, Deadline(timeout)))
+                tasks[request_id] = task
+                task.add_done_callback(lambda _, request_id=request_id: tasks.pop(request_id, None))
+        finally:
+            self.connections -= 1
+            # web worker 已断开（超时或退出），不再为它计算
+            for task in list(tasks.values()):
+                task.cancel()
+            writer.close()
+
+    async def respond(self, writer, request_id, op, params, deadline):
+        status, body = await self.dispatch(op, params, deadline)
+        if writer.is_closing():
+            return
+        # 整帧一次写入，同一连接上并发的响应不会交错
+        writer.write(encode_response(request_id, status, body))
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def dispatch(self, op, params, deadline):
+        """返回 (状态, 正文)"""
+        self.stats["requests"] += 1
+        try:
+            if op == 'calculate':
+                body = await self.calculate(params, deadline)
+            elif op == 'calculate_batch':
+                body = await self.calculate_batch(params, deadline)
+            elif op == 'health':
+                body = dumps_json(self.health())
+            elif op == 'version' and self.version is not None:
+                body = dumps_json(self.version)
+            elif op in DAEMON_OPS:
+                body = dumps_json(await self.engine_call(op, params, deadline))
+            else:
+                raise EngineError(f"未知操作: {op}")
+            return STATUS_OK, body
+        except Overloaded as e:
+            return STATUS_OVERLOADED, dumps_json({"error": str(e), "retry_after": e.retry_after})
+        except (DeadlineExceeded, EngineTimeout) as e:
+            return STATUS_TIMEOUT, dumps_json({"error": str(e)})
+        except EngineError as e:
+            self.stats["errors"] += 1
+            return STATUS_ERROR, dumps_json({"error": str(e)})
+
+    async def engine_call(self, op, params, deadline):
+        if op not in ADMITTED_OPS:
+            return await self.engine.call(op, params, timeout=deadline.remaining())
+        async with self.admission.admit_async(deadline):
+            if deadline.expired:
+                raise DeadlineExceeded("排队等待超过截止时间")
+            return await self.engine.call(op, params, timeout=deadline.remaining())
+
+    async def calculate(self, params, deadline):
+        """命中缓存时直接拼接预编码字节；失败结果（确定性错误）原样返回"""
+        canonical = (params['date'], params['hour'], params['gender'], params['fix_leap'])
+        key = make_key(*canonical)
+        chart = self.cache.get_memory(key)
+        if chart is None:
+            # 命盘库（mmap）与 SQLite 的读取放到线程中，不阻塞事件循环
+            chart = await asyncio.to_thread(self.cache.lookup, key, canonical, self.store)
+        if chart is None:
+            try:
+                chart = await self.flights.do(key, lambda: self._compute(key, params, deadline), deadline.remaining())
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded("等待计算结果超过截止时间")
+            if isinstance(chart, dict):
+                return dumps_json(chart)
+        return splice_object({"success": True}, "data", chart.render({}))
+
+    async def calculate_batch(self, params, deadline):
+        """calculate_many 的缓存版本：返回同样顺序、同样格式的结果数组"""
+        items = params['items']
+        flags = {name: value for name, value in params.items() if name != 'items'}
+        canonicals = [(item['date'], item['hour'], item['gender'], item['fix_leap']) for item in items]
+        keys = [make_key(*canonical) for canonical in canonicals]
+        canonicals = dict(zip(keys, canonicals))
+        charts = {key: self.cache.get_memory(key) for key in keys}
+        misses = [key for key, chart in charts.items() if chart is None]
+        if misses:
+            charts.update(await asyncio.to_thread(
+                lambda: {key: self.cache.lookup(key, canonicals[key], self.store) for key in misses}))
+        missing = {}
+        for key, item in zip(keys, items):
+            if charts[key] is None:
+                missing.setdefault(key, item)
+        if missing:
+            results = await self.engine_call('calculate_many', {**flags, "items": list(missing.values())}, deadline)
+            stored = await asyncio.to_thread(
+                lambda: [self.cache.remember(key, result) for key, result in zip(missing, results)])
+            for key, result, chart in zip(missing, results, stored):
+                # 失败结果（确定性错误）不缓存，原样返回
+                charts[key] = result if chart is None else chart
+        parts = [dumps_json(chart) if isinstance(chart, dict) else splice_object({"success": True}, "data", chart.render({}))
+                 for chart in (charts[key] for key in keys)]
+        return b'[' + b','.join(parts) + b']'
+
+    async def _compute(self, key, params, deadline):
+        result = await self.engine_call('calculate', params, deadline)
+        chart = await asyncio.to_thread(self.cache.remember, key, result)
+        return result if chart is None else chart
+
+    def health(self):
+        return {
+            "pid": os.getpid(),
+            "uptime": round(time.time() - self.started, 1),
+            "connections": self.connections,
+            "stats": dict(self.stats),
+            "iztro": self.version,
+            "engine_pool": {
+                "size": self.engine.size,
+                "max_calls": self.engine.max_calls,
+                "call_timeout": self.engine.call_timeout,
+                "stats": dict(self.engine.stats),
+            },
+            "chart_cache": self.cache.snapshot(),
+            "chart_store": self.store.info() if self.store is not None else None,
+            "single_flight": {"in_flight": len(self.flights)},
+            "admission": self.admission.snapshot(),
+        }
+
+
+async def serve(path):
+    daemon = ComputeDaemon()
+    await daemon.start(path)
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopping.set)
+    try:
+        await stopping.wait()
+    finally:
+        logger.info("计算守护进程退出")
+        await daemon.close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def wait_for_socket(path, timeout):
+    """等到守护进程的 socket 接受连接；超时返回 False"""
+    deadline = time.monotonic() + timeout
+    while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+            return True
+        except OSError:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.2)
+        finally:
+            sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="紫微斗数计算守护进程")
+    parser.add_argument('--socket', default=os.environ.get('ZIWEI_DAEMON_SOCKET', DEFAULT_SOCKET))
+    parser.add_argument('--wait', type=float, metavar='SECONDS',
+                        help="不启动守护进程，只等待已启动的守护进程开始接受连接（超时以状态码 1 退出）")
+    args = parser.parse_args(argv)
+    if args.wait is not None:
+        if not wait_for_socket(args.socket, args.wait):
+            print(f"计算守护进程在 {args.wait:g} 秒内没有开始接受连接: {args.socket}", file=sys.stderr)
+            raise SystemExit(1)
+        return
+    events.configure_from_env()
+    # json 模式下根 logger 已有队列 handler，basicConfig 不再生效
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    asyncio.run(serve(args.socket))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+"""计算守护进程的客户端（ZIWEI_ENGINE=daemon，守护进程见 compute_daemon.py）
+
+DaemonEngine 实现 engine_pool 的同步接口，供 gunicorn 同步 worker 使用：
+每个 worker 持有一组到守护进程的连接，每个连接同一时间只有一个请求，用完放回池中复用。
+AsyncDaemonEngine 实现 async_engine 的协程接口（ASGI 模式），所有请求复用同一个连接，
+按请求号分发响应；等待的协程被取消时通知守护进程取消对应请求。
+"""
+import asyncio
+import itertools
+import logging
+import os
+import socket
+import threading
+import time
+
+import metrics
+from admission import Overloaded
+from engine_pool import EngineError, EngineTimeout, _env_float, _env_int
+from fastjson import loads as loads_json
+from wire import (
+    MAX_FRAME_SIZE, STATUS_OK, STATUS_OVERLOADED, STATUS_TIMEOUT, FrameError,
+    encode_request, read_response, read_response_async,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = '/tmp/ziwei-compute.sock'
+# 守护进程自己按截止时间返回 TIMEOUT；客户端多等这么久才认为连接失去响应
+GRACE = 1.0
+
+
+def _unpack(status, body, stats):
+    """把守护进程的响应转换为结果或 engine_pool 的异常"""
+    with metrics.timed('decode'):
+        payload = loads_json(body)
+    if status == STATUS_OK:
+        return payload
+    if status == STATUS_OVERLOADED:
+        raise Overloaded(payload.get('retry_after', 1))
+    if status == STATUS_TIMEOUT:
+        stats["timeouts"] += 1
+        raise EngineTimeout(payload.get('error', '计算超时'))
+    raise EngineError(payload.get('error', '未知错误'))
+
+
+class DaemonConnection:
+    """到守护进程的一个阻塞连接"""
+
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.sock.connect(path)
+        except OSError as e:
+            self.sock.close()
+            raise EngineError(f"无法连接计算守护进程 {path}: {e}")
+        self.stream = self.sock.makefile('rb')
+        self._ids = itertools.count(1)
+
+    def request(self, op, params, timeout):
+        """返回 (状态, 正文)；连接出错时抛出异常，调用方不能再复用这个连接"""
+        request_id = next(self._ids) & 0xFFFFFFFF
+        self.sock.settimeout(timeout + GRACE)
+        try:
+            self.sock.sendall(encode_request(request_id, op, params, timeout))
+            while True:
+                response = read_response(self.stream)
+                if response is None:
+                    raise EngineError("计算守护进程关闭了连接")
+                if response[0] == request_id:
+                    return response[1:]
+        except socket.timeout:
+            raise EngineTimeout(f"计算守护进程无响应（{timeout:g}秒）")
+        except (FrameError, OSError) as e:
+            raise EngineError(f"计算守护进程通信失败: {e}")
+
+    def close(self):
+        self.stream.close()
+        self.sock.close()
+
+
+class DaemonEngine:
+    """同步客户端；size / max_calls 反映守护进程中进程池的配置（批量接口按 size 分片）"""
+
+    def __init__(self, path=DEFAULT_SOCKET, connections=8, size=2, max_calls=1000, call_timeout=30.0):
+        self.path = path
+        self.connections = max(1, connections)
+        self.size = max(1, size)
+        self.max_calls = max_calls
+        self.call_timeout = call_timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self.stats = {"calls": 0, "timeouts": 0, "crashes": 0, "recycled": 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            path=os.environ.get('ZIWEI_DAEMON_SOCKET', DEFAULT_SOCKET),
+            connections=_env_int('ZIWEI_DAEMON_CONNECTIONS', 8),
+            size=_env_int('ZIWEI_POOL_SIZE', 2),
+            max_calls=_env_int('ZIWEI_POOL_MAX_CALLS', 1000),
+            call_timeout=_env_float('ZIWEI_CALL_TIMEOUT', 30),
+        )
+
+    def _acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # fork 之后继承来的连接属于父进程，不能共用
+                self._idle, self._pid = [], os.getpid()
+            if self._idle:
+                return self._idle.pop()
+        return DaemonConnection(self.path)
+
+    def _release(self, connection):
+        with self._lock:
+            if len(self._idle) < self.connections and self._pid == os.getpid():
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def call(self, op, params=None, timeout=None):
+        timeout = self.call_timeout if timeout is None else timeout
+        self.stats["calls"] += 1
+        try:
+            connection = self._acquire()
+        except EngineError:
+            self.stats["crashes"] += 1
+            raise
+        started = time.perf_counter()
+        try:
+            status, body = connection.request(op, params, timeout)
+        except EngineError as e:
+            connection.close()
+            self.stats["timeouts" if isinstance(e, EngineTimeout) else "crashes"] += 1
+            raise
+        metrics.record('dispatch', time.perf_counter() - started)
+        self._release(connection)
+        return _unpack(status, body, self.stats)
+
+    def warm_up(self):
+        pass
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+class AsyncDaemonEngine:
+    """协程客户端：单个连接上多路复用"""
+
+    def __init__(self, path=DEFAULT_SOCKET, size=2, max_calls=1000, call_timeout=30.0):
+        self.path = path
+        self.size = max(1, size)
+        self.max_calls = max_calls
+        self.call_timeout = call_timeout
+        self._writer = None
+        self._pending = {}
+        self._ids = itertools.count(1)
+        self._connecting = asyncio.Lock()
+        self.stats = {"calls": 0, "timeouts": 0, "crashes": 0, "recycled": 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            path=os.environ.get('ZIWEI_DAEMON_SOCKET', DEFAULT_SOCKET),
+            size=_env_int('ZIWEI_POOL_SIZE', 2),
+            max_calls=_env_int('ZIWEI_POOL_MAX_CALLS', 1000),
+            call_timeout=_env_float('ZIWEI_CALL_TIMEOUT', 30),
+        )
+
+    async def _connect(self):
+        async with self._connecting:
+            if self._writer is None:
+                try:
+                    reader, writer = await asyncio.open_unix_connection(self.path, limit=MAX_FRAME_SIZE)
+                except OSError as e:
+                    self.stats["crashes"] += 1
+                    raise EngineError(f"无法连接计算守护进程 {self.path}: {e}")
+                self._writer = writer
+                asyncio.ensure_future(self._read_responses(reader, writer))
+        return self._writer
+
+    async def _read_responses(self, reader, writer):
+        try:
+            while True:
+                response = await read_response_async(reader)
+                if response is None:
+                    break
+                future = self._pending.pop(response[0], None)
+                if future is not None and not future.done():
+                    future.set_result(response[1:])
+        except (FrameError, OSError) as e:
+            logger.error(f"计算守护进程响应读取失败: {e}")
+        finally:
+            if self._writer is writer:
+                self._writer = None
+            writer.close()
+            pending, self._pending = self._pending, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(EngineError("计算守护进程连接已断开"))
+
+    async def call(self, op, params=None, timeout=None):
+        timeout = self.call_timeout if timeout is None else timeout
+        writer = await self._connect()
+        request_id = next(self._ids) & 0xFFFFFFFF
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        self.stats["calls"] += 1
+        started = time.perf_counter()
+        try:
+            writer.write(encode_request(request_id, op, params, timeout))
+            status, body = await asyncio.wait_for(future, timeout + GRACE)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise EngineTimeout(f"计算守护进程无响应（{timeout:g}秒）")
+        except asyncio.CancelledError:
+            # 请求方已放弃，让守护进程也停止等待
+            if not writer.is_closing():
+                writer.write(encode_request(next(self._ids) & 0xFFFFFFFF, 'cancel', {"id": request_id}, 0))
+            raise
+        finally:
+            self._pending.pop(request_id, None)
+        metrics.record('dispatch', time.perf_counter() - started)
+        return _unpack(status, body, self.stats)
+
+    async def warm_up(self):
+        await self._connect()
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
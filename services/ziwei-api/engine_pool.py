@@ -0,0 +1,420 @@
+"""常驻 Node.js 计算进程池
+
+每个 worker 是一个长期运行的 `node iztro_worker.js` 进程，启动时只加载一次 iztro，
+请求帧经 stdin 发送，响应帧从专用 pipe 读取（帧格式见 wire.py），
+stdout/stderr 只用于意外的错误输出（调试输出按请求随响应帧返回，见 events.py）。
+"""
+import itertools
+import json
+import logging
+import os
+import queue
+import signal
+import subprocess
+import threading
+import time
+
+import events
+import metrics
+from wire import FrameError, decode_body, decode_frame, encode_frame, read_frame
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+WORKER_SCRIPT = os.path.join(BASE_DIR, 'iztro_worker.js')
+CALCULATE_SCRIPT = os.path.join(BASE_DIR, 'iztro_calculate.js')
+
+# worker 崩溃时读取线程放入队列的哨兵
+_EOF = object()
+
+
+class EngineError(Exception):
+    """计算进程不可用或协议异常"""
+
+
+class EngineTimeout(EngineError):
+    """计算超过截止时间"""
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def kill_process_group(proc):
+    """
+    结束计算进程及其可能派生的子进程
+    每个 node 进程都以 start_new_session 启动，自成一个进程组
+    """
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        # 进程组已经不存在，只剩等待回收的主进程
+        pass
+
+
+def record_engine_timing(round_trip, message):
+    """把一次引擎往返拆成 iztro 计算（Node 自己计时）与其余开销（进程启动、IPC）"""
+    compute = message.get('compute_ms', 0) / 1000
+    metrics.record('compute', compute)
+    metrics.record('dispatch', max(round_trip - compute, 0.0))
+
+
+class NodeWorker:
+    """单个常驻 Node.js 进程"""
+
+    def __init__(self, script=WORKER_SCRIPT, cwd=BASE_DIR):
+        self.script = script
+        self.cwd = cwd
+        self.proc = None
+        self.calls = 0
+        self.rss = 0
+        self._responses = queue.Queue()
+        self._ids = itertools.count(1)
+
+    @property
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self):
+        # 响应帧走独立的 pipe，子进程通过 ZIWEI_FRAME_FD 得知写端 fd
+        frame_read, frame_write = os.pipe()
+        try:
+            self.proc = subprocess.Popen(
+                ['node', self.script],
+                cwd=self.cwd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                pass_fds=(frame_write,),
+                env={**os.environ, 'ZIWEI_FRAME_FD': str(frame_write)},
+                start_new_session=True,
+            )
+        except OSError as e:
+            os.close(frame_read)
+            raise EngineError(f"无法启动Node.js: {e}")
+        finally:
+            os.close(frame_write)
+        frames = os.fdopen(frame_read, 'rb')
+        self.calls = 0
+        self.rss = 0
+        self._responses = queue.Queue()
+        threading.Thread(target=self._read_frames, args=(frames, self._responses), daemon=True).start()
+        threading.Thread(target=self._read_diagnostics, args=(self.proc,), daemon=True).start()
+        logger.info(f"Node worker 已启动 - pid: {self.proc.pid}")
+
+    def stop(self):
+        proc, self.proc = self.proc, None
+        if proc is None:
+            return
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            proc.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            kill_process_group(proc)
+            proc.wait()
+
+    def kill(self):
+        proc, self.proc = self.proc, None
+        if proc is not None and proc.poll() is None:
+            kill_process_group(proc)
+            proc.wait()
+
+    @staticmethod
+    def _read_frames(frames, responses):
+        try:
+            while True:
+                body = read_frame(frames)
+                if body is None:
+                    break
+                responses.put(body)
+        except (FrameError, OSError, ValueError) as e:
+            logger.error(f"Node worker 帧读取失败: {e}")
+        finally:
+            frames.close()
+            responses.put(_EOF)
+
+    @staticmethod
+    def _read_diagnostics(proc):
+        for line in proc.stdout:
+            # 计算输出默认不写 stderr（见 wire.js），这里只剩意外的错误与 Node 自身的警告
+            logger.warning("Node worker[%d]: %s", proc.pid, line.decode('utf-8', 'replace').rstrip())
+
+    def request(self, op, params, timeout):
+        """发送一个请求并等待对应响应，超时或进程退出时抛出异常"""
+        sent = time.perf_counter()
+        if not self.alive:
+            self.start()
+
+        request_id = next(self._ids)
+        try:
+            self.proc.stdin.write(encode_frame({"id": request_id, "op": op, "params": params}))
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            self.kill()
+            raise EngineError(f"Node worker 写入失败: {e}")
+
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.kill()
+                raise EngineTimeout(f"计算超时（{timeout:g}秒）")
+            try:
+                raw = self._responses.get(timeout=remaining)
+            except queue.Empty:
+                continue
+            if raw is _EOF:
+                returncode = self.proc.poll() if self.proc else None
+                self.kill()
+                raise EngineError(f"Node worker 意外退出，返回码: {returncode}")
+            received = time.perf_counter()
+
+            try:
+                with metrics.timed('decode'):
+                    message = decode_body(raw)
+            except ValueError as e:
+                self.kill()
+                raise EngineError(f"响应解析失败: {e}")
+
+            # 上一个超时请求的迟到响应直接丢弃
+            if message.get('id') != request_id:
+                continue
+
+            record_engine_timing(received - sent, message)
+            events.engine_diagnostics(op, message, self.proc.pid)
+            self.calls += 1
+            self.rss = message.get('rss', 0)
+            if not message.get('ok'):
+                raise EngineError(message.get('error', '未知错误'))
+            return message.get('result')
+
+
+class NodeWorkerPool:
+    """固定大小的 Node.js 进程池，支持超时、崩溃重启与按调用次数/内存回收"""
+
+    def __init__(self, size=2, max_calls=1000, max_rss_mb=256, call_timeout=30.0,
+                 script=WORKER_SCRIPT, cwd=BASE_DIR):
+        self.size = max(1, size)
+        self.max_calls = max_calls
+        self.max_rss = max_rss_mb * 1024 * 1024
+        self.call_timeout = call_timeout
+        self._idle = queue.LifoQueue()
+        for _ in range(self.size):
+            self._idle.put(NodeWorker(script, cwd))
+        self.stats = {"calls": 0, "timeouts": 0, "crashes": 0, "recycled": 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            size=_env_int('ZIWEI_POOL_SIZE', 2),
+            max_calls=_env_int('ZIWEI_POOL_MAX_CALLS', 1000),
+            max_rss_mb=_env_int('ZIWEI_POOL_MAX_RSS_MB', 256),
+            call_timeout=_env_float('ZIWEI_CALL_TIMEOUT', 30),
+        )
+
+    def call(self, op, params=None, timeout=None):
+        """在空闲 worker 上执行一次请求；等待空闲 worker 的时间也计入截止时间"""
+        timeout = self.call_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        try:
+            with metrics.timed('queue'):
+                worker = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            self.stats["timeouts"] += 1
+            raise EngineTimeout(f"等待空闲计算进程超时（{timeout:g}秒）")
+
+        try:
+            self.stats["calls"] += 1
+            return worker.request(op, params or {}, max(deadline - time.monotonic(), 0.001))
+        except EngineTimeout:
+            self.stats["timeouts"] += 1
+            raise
+        except EngineError:
+            if not worker.alive:
+                self.stats["crashes"] += 1
+            raise
+        finally:
+            if worker.alive and (worker.calls >= self.max_calls or worker.rss > self.max_rss):
+                logger.info(f"回收 Node worker - 调用次数: {worker.calls}, RSS: {worker.rss}")
+                self.stats["recycled"] += 1
+                worker.stop()
+            self._idle.put(worker)
+
+    def warm_up(self):
+        """预先启动所有 worker"""
+        workers = [self._idle.get() for _ in range(self.size)]
+        try:
+            for worker in workers:
+                if not worker.alive:
+                    worker.start()
+        finally:
+            for worker in workers:
+                self._idle.put(worker)
+
+    def close(self):
+        for _ in range(self.size):
+            self._idle.get().stop()
+
+
+class SpawnEngine:
+    """
+    每次调用启动一个一次性 node 进程（ZIWEI_ENGINE=spawn）
+    与 NodeWorkerPool 接口相同，适合内存受限或调用量很小的部署；
+    固定的 iztro_calculate.js 配合编译缓存，冷启动无需重新编译 iztro
+    """
+
+    def __init__(self, size=2, call_timeout=30.0, script=CALCULATE_SCRIPT, cwd=BASE_DIR):
+        self.size = max(1, size)
+        self.max_calls = 1
+        self.call_timeout = call_timeout
+        self.script = script
+        self.cwd = cwd
+        self.stats = {"calls": 0, "timeouts": 0, "crashes": 0, "recycled": 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            size=_env_int('ZIWEI_POOL_SIZE', 2),
+            call_timeout=_env_float('ZIWEI_CALL_TIMEOUT', 30),
+        )
+
+    def call(self, op, params=None, timeout=None):
+        timeout = self.call_timeout if timeout is None else timeout
+        self.stats["calls"] += 1
+        started = time.perf_counter()
+        try:
+            proc = subprocess.Popen(
+                ['node', self.script],
+                cwd=self.cwd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                start_new_session=True,
+            )
+        except OSError as e:
+            raise EngineError(f"无法启动Node.js: {e}")
+        try:
+            stdout, stderr = proc.communicate(encode_frame({"op": op, "params": params or {}}), timeout=timeout)
+        except subprocess.TimeoutExpired:
+            kill_process_group(proc)
+            proc.communicate()
+            self.stats["timeouts"] += 1
+            raise EngineTimeout(f"计算超时（{timeout:g}秒）")
+        finished = time.perf_counter()
+
+        if stderr and proc.returncode == 0:
+            logger.warning("Node.js stderr: %s", stderr.decode('utf-8', 'replace').rstrip())
+        if proc.returncode != 0:
+            self.stats["crashes"] += 1
+            raise EngineError(f"返回码 {proc.returncode}: {stderr.decode('utf-8', 'replace')[-500:]}")
+
+        try:
+            with metrics.timed('decode'):
+                message = decode_frame(stdout)
+        except (FrameError, ValueError) as e:
+            raise EngineError(f"响应解析失败: {e}")
+        record_engine_timing(finished - started, message)
+        events.engine_diagnostics(op, message, proc.pid)
+        if not message.get('ok'):
+            raise EngineError(message.get('error', '未知错误'))
+        return message.get('result')
+
+    def warm_up(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# None：尚未解析；''：已确定无法得知（预热时查询引擎也失败），不再重试
+_iztro_version = None
+
+
+def _read_iztro_version():
+    """ZIWEI_IZTRO_VERSION 或 node_modules 中 iztro 的 package.json，都没有时返回 None"""
+    version = os.environ.get('ZIWEI_IZTRO_VERSION')
+    search_dirs = [os.path.join(BASE_DIR, 'node_modules')]
+    search_dirs += [d for d in os.environ.get('NODE_PATH', '').split(os.pathsep) if d]
+    for directory in search_dirs:
+        if version:
+            break
+        try:
+            with open(os.path.join(directory, 'iztro', 'package.json'), encoding='utf-8') as f:
+                version = json.load(f).get('version')
+        except (OSError, ValueError):
+            continue
+    return version or None
+
+
+def iztro_version():
+    """
+    iztro 版本号，供请求路径（ETag）使用：只读取环境变量与 package.json 及预热时解析的结果，
+    从不调用计算引擎；尚不能确定时返回 None
+    """
+    global _iztro_version
+    if _iztro_version is None:
+        version = _read_iztro_version()
+        if version:
+            _iztro_version = version
+    return _iztro_version or None
+
+
+def resolve_iztro_version(engine=None):
+    """
+    预热时调用一次：package.json 找不到时向计算引擎查询（engine 为 None 时不查询），
+    查询失败也记录下来，之后不再重试；返回版本号或 None
+    """
+    global _iztro_version
+    if _iztro_version is None:
+        version = _read_iztro_version()
+        if not version and engine is not None:
+            try:
+                version = engine.call('version', timeout=10).get('version')
+            except EngineError as e:
+                logger.error(f"无法获取iztro版本: {e}")
+        _iztro_version = version or ''
+    return _iztro_version or None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    进程内单例；gunicorn fork 之后在各 worker 中首次使用时创建
+    ZIWEI_ENGINE=spawn 时改用一次性进程，ZIWEI_ENGINE=daemon 时转发给计算守护进程
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                engine = os.environ.get('ZIWEI_ENGINE', 'pool')
+                if engine == 'daemon':
+                    from daemon_client import DaemonEngine
+                    _pool = DaemonEngine.from_env()
+                elif engine == 'spawn':
+                    _pool = SpawnEngine.from_env()
+                else:
+                    _pool = NodeWorkerPool.from_env()
+    return _pool
+
+
+def install_pool(pool):
+    """替换进程内的计算引擎（ASGI 模式下换成共用事件循环进程池的同步包装）"""
+    global _pool
+    with _pool_lock:
+        _pool = pool
@@ -0,0 +1,224 @@
+"""结构化日志
+
+请求路径上只调用 emit(事件名, **字段)：
+- 先检查级别和该事件的采样率，不记录的事件在这里直接返回，不做任何格式化
+- 字段原样放进 LogRecord，格式化在真正输出时才进行
+
+ZIWEI_LOG_FORMAT=json 时整个进程的日志（包括其他模块的 logger）都经队列交给后台线程，
+由后台线程编码为一行紧凑 JSON 写到 stderr；队列已满时丢弃并计数，请求线程从不阻塞在 I/O 上。
+默认（text）不改动 logging 的配置，事件以 "事件名 key=value ..." 的文本输出。
+
+    ZIWEI_LOG_FORMAT  text | json
+    ZIWEI_LOG_LEVEL   json 模式下的根级别，默认 INFO
+    ZIWEI_LOG_SAMPLE  按事件类型的采样率，如 "calculate.request=0.01,chart.canonical=0,*=1"
+                      （* 为其余事件的默认值）；WARNING 及以上的事件不采样
+    ZIWEI_LOG_QUEUE   json 模式的队列长度，默认 10000
+
+计算引擎的调试输出默认不收集；请求带 X-Ziwei-Debug 标头且值与 ZIWEI_DEBUG_TOKEN 相同时，
+这次请求的引擎调用会带上 debug 参数，Node 收集该次调用的 console 输出随响应帧返回，
+再以 engine.diagnostics 事件记录（未设置 ZIWEI_DEBUG_TOKEN 时标头无效）。
+"""
+import atexit
+import contextvars
+import hmac
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+
+from fastjson import dumps as dumps_json
+
+DEBUG_HEADER = 'X-Ziwei-Debug'
+
+DEFAULT_SAMPLE = {
+    # 每个 /calculate 各一次，默认只保留 1%
+    'calculate.request': 0.01,
+    'chart.canonical': 0.01,
+}
+
+logger = logging.getLogger('ziwei.events')
+
+_rates = dict(DEFAULT_SAMPLE)
+_default_rate = 1.0
+_random = random.random
+
+# 当前请求是否要求引擎调试输出
+_engine_debug = contextvars.ContextVar('ziwei_engine_debug', default=False)
+
+stats = {"sampled_out": 0, "dropped": 0}
+
+
+def parse_sample(spec):
+    """解析 ZIWEI_LOG_SAMPLE，返回 ({事件名: 采样率}, 默认采样率或 None)"""
+    rates, default = {}, None
+    for item in (spec or '').split(','):
+        if not item.strip():
+            continue
+        name, _, value = item.partition('=')
+        rate = min(max(float(value), 0.0), 1.0)
+        if name.strip() == '*':
+            default = rate
+        else:
+            rates[name.strip()] = rate
+    return rates, default
+
+
+def set_sample(rates, default=None):
+    global _default_rate
+    _rates.update(rates)
+    if default is not None:
+        _default_rate = default
+
+
+class _Fields:
+    """事件字段，只在输出文本日志时才拼接成 key=value"""
+
+    __slots__ = ('fields',)
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def __str__(self):
+        return ' '.join(f"{key}={value!r}" if isinstance(value, str) else f"{key}={value}"
+                        for key, value in self.fields.items())
+
+
+def emit(name, level=logging.INFO, **fields):
+    """
+    记录一个事件；字段在输出时才格式化（json 模式下在后台线程），传入后不应再修改
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if level < logging.WARNING:
+        rate = _rates.get(name, _default_rate)
+        if rate < 1.0 and (rate <= 0.0 or _random() >= rate):
+            stats["sampled_out"] += 1
+            return
+    logger.log(level, '%s %s', name, _Fields(fields), extra={'event': name, 'fields': fields})
+
+
+def enabled(name, level=logging.INFO):
+    """该事件是否可能被记录（用于跳过构造字段本身的开销）"""
+    return logger.isEnabledFor(level) and (level >= logging.WARNING or _rates.get(name, _default_rate) > 0.0)
+
+
+# ---- 引擎调试输出 ----
+
+def begin_request(header_value):
+    """按请求的 X-Ziwei-Debug 标头决定这次请求是否收集引擎调试输出"""
+    token = os.environ.get('ZIWEI_DEBUG_TOKEN')
+    _engine_debug.set(bool(token and header_value and hmac.compare_digest(header_value, token)))
+
+
+def with_engine_debug(params):
+    """当前请求要求调试输出时，给引擎参数加上 debug 标记"""
+    return {**params, "debug": True} if _engine_debug.get() else params
+
+
+def engine_diagnostics(op, message, pid=None):
+    """记录 Node 随响应帧返回的调试输出（只有带 debug 的调用才有）"""
+    lines = message.get('diagnostics')
+    if lines:
+        # 调用方显式要求的输出，按 WARNING 记录，默认配置下也能看到，且不参与采样
+        emit('engine.diagnostics', logging.WARNING, op=op, pid=pid, lines=lines)
+
+
+# ---- json 模式 ----
+
+class JsonFormatter(logging.Formatter):
+    """一条记录一行紧凑 JSON：ts、level、logger、event（或 msg）、字段、异常"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+        }
+        event = getattr(record, 'event', None)
+        if event is not None:
+            entry["event"] = event
+            entry.update(record.fields)
+        else:
+            entry["msg"] = record.getMessage()
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        try:
+            return dumps_json(entry).decode('utf-8')
+        except TypeError:
+            # 字段里有无法编码的对象时退回字符串
+            return dumps_json({key: value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+                               for key, value in entry.items()}).decode('utf-8')
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    同进程内的队列：记录原样入队（不在请求线程格式化），队列已满时丢弃并计数
+    """
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            stats["dropped"] += 1
+
+
+_listener = None
+_queue = None
+_output = None
+
+
+def _start_listener():
+    global _listener
+    _listener = logging.handlers.QueueListener(_queue, _output, respect_handler_level=True)
+    _listener.start()
+
+
+def _after_fork():
+    # 后台线程不会随 fork 复制（如 gunicorn --preload），子进程各自重新启动
+    global _queue
+    if _listener is not None:
+        _queue = queue.Queue(_queue.maxsize)
+        for handler in logging.getLogger().handlers:
+            if isinstance(handler, DroppingQueueHandler):
+                handler.queue = _queue
+        _start_listener()
+
+
+def configure_from_env():
+    """按环境变量配置采样率与输出格式；每个进程调用一次，重复调用无副作用"""
+    global _queue, _output
+    try:
+        set_sample(*parse_sample(os.environ.get('ZIWEI_LOG_SAMPLE')))
+    except ValueError as e:
+        logger.error("ZIWEI_LOG_SAMPLE 格式错误: %s", e)
+    if os.environ.get('ZIWEI_LOG_FORMAT', 'text').lower() != 'json' or _listener is not None:
+        return
+
+    _output = logging.StreamHandler(sys.stderr)
+    _output.setFormatter(JsonFormatter())
+    try:
+        size = int(os.environ.get('ZIWEI_LOG_QUEUE', 10000))
+    except ValueError:
+        size = 10000
+    _queue = queue.Queue(size)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DroppingQueueHandler(_queue))
+    root.setLevel(os.environ.get('ZIWEI_LOG_LEVEL', 'INFO').upper())
+    _start_listener()
+    os.register_at_fork(after_in_child=_after_fork)
+    atexit.register(_stop_listener)
+
+
+def _stop_listener():
+    # 退出前写完队列中剩余的记录
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
@@ -0,0 +1,42 @@
+"""JSON 编码
+
+优先使用 orjson（比标准库快一个数量级，直接输出 UTF-8 字节），未安装时退回标准库。
+两者输出一致：不排序键、不转义非 ASCII、无多余空白。
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 取决于部署环境
+    orjson = None
+
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+
+def dumps(obj):
+    """编码为 UTF-8 字节"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def splice_object(head, field, raw, tail=None):
+    """
+    把已编码的字节 raw 作为 field 字段拼进对象，无需重新编码：
+    splice_object({"a": 1}, "b", b'[1]', {"c": 2}) -> b'{"a":1,"b":[1],"c":2}'
+    """
+    parts = [dumps(head)[:-1]]
+    if head:
+        parts.append(b',')
+    parts.append(dumps(field) + b':' + raw)
+    if tail:
+        parts.append(b',' + dumps(tail)[1:])
+    else:
+        parts.append(b'}')
+    return b''.join(parts)
@@ -0,0 +1,609 @@
+"""金标准命盘语料与差分验证
+
+任何绕过 call_iztro_api 的加速（预计算命盘库、进程池、新的序列化方式……）都要证明结果与 iztro 一致。
+语料收录一组规范输入及 iztro 给出的宫位/星曜结果，重点覆盖容易出错的边界：
+    boundary   时辰边界（23:00/23:59/00:00/00:59 以及每个时辰交界的前后一分钟）
+    leap_month 1900–2100 每个闰月的首日、末日与同名正常月
+    century    世纪与历法边界（1900-01-31 农历起点、2000-02-29、2100-12-31 等）
+    random     整个范围内的随机日期与时间
+每个输入都有男、女两种性别，固定日期的输入 is_leap 开、关各一次。
+
+语料以列式存放在一个 np.savez_compressed 文件中（与 analytics.py 相同的列名与词表编码）：
+    birth_date / birth_time / gender / is_leap / tags   原始输入（yyyymmdd、当日分钟数）与收录原因（位掩码）
+    chen                                                 期望的时辰索引（校验时辰划分）
+    texts                                                [行, 13] 基本信息与摘要，texts 表编码
+    palace_name / palace_branch / palace_stem            [行, 12] 词表编码
+    major_count / minor_count / adjective_count          [行, 12]
+    major_star / major_brightness / major_mutagen        [行, 12, 3]
+    minor_star / minor_mutagen                           [行, 12, 8]
+    meta                                                 JSON：词表、texts 表、iztro 版本等
+
+差分验证在进程池中进行，每个进程各自持有候选引擎（与参照引擎），按块比较并报告最先出现差异的输入与字段：
+    python golden.py build --output golden.npz                        # 用 iztro 生成语料
+    python golden.py info golden.npz
+    python golden.py verify golden.npz --candidate store:charts.bin   # 候选对语料
+    python golden.py diff --candidate encoded:pool --start 1900-01-01 --end 2100-12-31 --stride 7
+                                                                      # 候选对在线 iztro，覆盖整个范围
+候选：pool / spawn / daemon（对应 ZIWEI_ENGINE）、encoded:<引擎>（经 EncodedChart 编码再解码）、
+store:<命盘库路径>、python:<模块>:<函数>（函数接收规范键列表，返回命盘核心数据列表）。
+"""
+import argparse
+import atexit
+import importlib
+import json
+import logging
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+import numpy as np
+
+import lunar_calendar
+from chart_store import BASIC_FIELDS, GENDERS, MAX_MAJOR, MAX_MINOR, PALACE_COUNT, SUMMARY_FIELDS, StringTable
+
+FORMAT_VERSION = 1
+
+TAGS = ('boundary', 'leap_month', 'century', 'random')
+TAG_BITS = {name: 1 << i for i, name in enumerate(TAGS)}
+
+# 每个时辰交界（奇数整点）的前后一分钟，以及子时中跨日的 23:59 / 00:00
+BOUNDARY_TIMES = tuple(f"{(h - 1) % 24:02d}:59" for h in range(1, 24, 2)) + \
+    tuple(f"{h:02d}:00" for h in range(1, 24, 2)) + ('23:59', '00:00')
+BOUNDARY_DATES = ('2000-08-16', '1984-02-02', '1966-06-15', '2024-02-10')
+# 每个时辰的第一分钟（子时取 23:00）
+CHEN_TIMES = tuple(f"{(2 * chen - 1) % 24:02d}:00" for chen in range(12))
+CENTURY_DATES = (
+    '1900-01-01', '1900-01-30', '1900-01-31', '1900-02-28', '1900-03-01',
+    '1999-12-31', '2000-01-01', '2000-02-04', '2000-02-05', '2000-02-29', '2000-03-01',
+    '2099-12-31', '2100-01-01', '2100-02-28', '2100-03-01', '2100-12-31',
+)
+FIRST_DATE = date(1900, 1, 1)
+LAST_DATE = date(2100, 12, 31)
+
+INPUT_COLUMNS = ('birth_date', 'birth_time', 'gender', 'is_leap', 'tags', 'chen')
+PALACE_COLUMNS = ('palace_name', 'palace_branch', 'palace_stem', 'major_count', 'minor_count', 'adjective_count')
+STAR_COLUMNS = ('major_star', 'major_brightness', 'major_mutagen', 'minor_star', 'minor_mutagen')
+TEXT_FIELDS = tuple(('basic_info', f) for f in BASIC_FIELDS) + tuple(('summary', f) for f in SUMMARY_FIELDS)
+
+# 每块的输入数（一次 calculate_many）
+CHUNK_SIZE = 512
+# 每个差异最多列出的字段数
+MAX_FIELDS = 8
+
+logger = logging.getLogger(__name__)
+
+
+# ---------- 输入 ----------
+
+def chen_of(birth_time):
+    """与 index.get_time_chen_index 相同的时辰划分：子时 23:00–00:59，其余每两小时一个时辰"""
+    hour, minute = map(int, birth_time.split(':'))
+    return ((hour * 60 + minute + 60) // 120) % 12
+
+
+def _leap_month_dates():
+    """每个闰月的首日、末日，以及同名正常月的十五"""
+    for year in range(lunar_calendar.FIRST_YEAR, lunar_calendar.LAST_YEAR + 1):
+        month = lunar_calendar.leap_month(year)
+        if not month:
+            continue
+        first = lunar_calendar.to_solar(year, month, 1, True)
+        try:
+            last = lunar_calendar.to_solar(year, month, 30, True)
+        except ValueError:
+            last = lunar_calendar.to_solar(year, month, 29, True)
+        for day in (first, last, lunar_calendar.to_solar(year, month, 15, False)):
+            if FIRST_DATE <= day <= LAST_DATE:
+                yield day
+
+
+def corpus_inputs(random_count=5000, seed=1):
+    """语料的全部输入：[(出生日期, 时间, 性别, is_leap, tags)]，按出现顺序去重并合并 tags"""
+    inputs = {}
+
+    def add(day, birth_time, tag, genders=GENDERS, leaps=(False, True)):
+        for gender in genders:
+            for is_leap in leaps:
+                key = (day.isoformat(), birth_time, gender, is_leap)
+                inputs[key] = inputs.get(key, 0) | TAG_BITS[tag]
+
+    for text in BOUNDARY_DATES:
+        for birth_time in BOUNDARY_TIMES:
+            add(date.fromisoformat(text), birth_time, 'boundary')
+    for day in _leap_month_dates():
+        for birth_time in CHEN_TIMES:
+            add(day, birth_time, 'leap_month')
+    for text in CENTURY_DATES:
+        for birth_time in CHEN_TIMES:
+            add(date.fromisoformat(text), birth_time, 'century')
+    rng = random.Random(seed)
+    span = (LAST_DATE - FIRST_DATE).days + 1
+    for _ in range(random_count):
+        day = FIRST_DATE + timedelta(days=rng.randrange(span))
+        minute = rng.randrange(24 * 60)
+        add(day, f"{minute // 60:02d}:{minute % 60:02d}", 'random',
+            genders=(rng.choice(GENDERS),), leaps=(rng.random() < 0.5,))
+    return [key + (tags,) for key, tags in inputs.items()]
+
+
+def canonical_key(birth_date, birth_time, gender, is_leap):
+    """规范键 (iztro 日期, 时辰索引, 性别, is_leap)，与 index.canonical_chart_params 相同"""
+    year, month, day = birth_date.split('-')
+    return f"{int(year)}-{int(month)}-{int(day)}", chen_of(birth_time), gender, bool(is_leap)
+
+
+def slot_key(first_ordinal, slot):
+    """日期范围内的第 slot 个规范键；槽位顺序与 chart_store.slot_of 相同（天、时辰、性别、is_leap）"""
+    slot, is_leap = divmod(slot, 2)
+    slot, gender = divmod(slot, len(GENDERS))
+    day, chen = divmod(slot, 12)
+    day = date.fromordinal(first_ordinal + day)
+    return f"{day.year}-{day.month}-{day.day}", chen, GENDERS[gender], bool(is_leap)
+
+
+# ---------- 命盘比较 ----------
+
+def _text(value):
+    return '' if value is None else value
+
+
+def project(core):
+    """只保留语料收录的字段（去掉回显、主题评分等），缺失的文本统一为空串"""
+    basic = core.get('basic_info') or {}
+    summary = core.get('summary') or {}
+    return {
+        "basic_info": {f: _text(basic.get(f)) for f in BASIC_FIELDS},
+        "palaces": [
+            {
+                "name": _text(palace.get('name')),
+                "earthly_branch": _text(palace.get('earthly_branch')),
+                "heavenly_stem": _text(palace.get('heavenly_stem')),
+                "major_stars": [{"name": _text(s.get('name')), "brightness": _text(s.get('brightness')),
+                                 "mutagen": _text(s.get('mutagen'))} for s in palace.get('major_stars') or []],
+                "minor_stars": [{"name": _text(s.get('name')), "mutagen": _text(s.get('mutagen'))}
+                                for s in palace.get('minor_stars') or []],
+                "adjective_stars_count": palace.get('adjective_stars_count', 0),
+            }
+            for palace in core.get('palaces') or []
+        ],
+        "summary": {f: _text(summary.get(f)) for f in SUMMARY_FIELDS},
+    }
+
+
+def diff_fields(expected, actual, path='', out=None, limit=MAX_FIELDS):
+    """两份命盘中取值不同的字段：["palaces[3].major_stars[0].brightness: '庙' != '旺'", ...]，最多 limit 条"""
+    out = [] if out is None else out
+    if len(out) >= limit:
+        return out
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        for key in expected.keys() | actual.keys():
+            if expected.get(key) != actual.get(key):
+                diff_fields(expected.get(key), actual.get(key), f"{path}.{key}" if path else key, out, limit)
+    elif isinstance(expected, list) and isinstance(actual, list):
+        if len(expected) != len(actual):
+            out.append(f"{path}: 长度 {len(expected)} != {len(actual)}")
+        for i, (a, b) in enumerate(zip(expected, actual)):
+            if a != b:
+                diff_fields(a, b, f"{path}[{i}]", out, limit)
+    else:
+        out.append(f"{path}: {expected!r} != {actual!r}")
+    return out[:limit]
+
+
+# ---------- 列式语料 ----------
+
+class ColumnEncoder:
+    """把命盘编码为语料的列；词表与 texts 表沿用 chart_store 的字符串驻留表"""
+
+    def __init__(self, rows):
+        self.vocab = StringTable(256)
+        self.texts = StringTable(0xFFFFFFFF)
+        self.columns = {
+            "texts": np.zeros((rows, len(TEXT_FIELDS)), dtype='<u4'),
+            **{name: np.zeros((rows, PALACE_COUNT), dtype='u1') for name in PALACE_COLUMNS},
+            "adjective_count": np.zeros((rows, PALACE_COUNT), dtype='<u2'),
+            **{name: np.zeros((rows, PALACE_COUNT, MAX_MAJOR), dtype='u1') for name in STAR_COLUMNS[:3]},
+            **{name: np.zeros((rows, PALACE_COUNT, MAX_MINOR), dtype='u1') for name in STAR_COLUMNS[3:]},
+        }
+
+    def encode(self, row, core):
+        c, v = self.columns, self.vocab.intern
+        for i, (section, field) in enumerate(TEXT_FIELDS):
+            c["texts"][row, i] = self.texts.intern(core[section][field])
+        palaces = core["palaces"]
+        if len(palaces) != PALACE_COUNT:
+            raise ValueError(f"宫位数量异常: {len(palaces)}")
+        for p, palace in enumerate(palaces):
+            majors, minors = palace["major_stars"], palace["minor_stars"]
+            if len(majors) > MAX_MAJOR or len(minors) > MAX_MINOR:
+                raise ValueError(f"星曜数量超出容量: 主星 {len(majors)}, 辅星 {len(minors)}")
+            c["palace_name"][row, p] = v(palace["name"])
+            c["palace_branch"][row, p] = v(palace["earthly_branch"])
+            c["palace_stem"][row, p] = v(palace["heavenly_stem"])
+            c["major_count"][row, p] = len(majors)
+            c["minor_count"][row, p] = len(minors)
+            c["adjective_count"][row, p] = palace["adjective_stars_count"]
+            for s, star in enumerate(majors):
+                c["major_star"][row, p, s] = v(star["name"])
+                c["major_brightness"][row, p, s] = v(star["brightness"])
+                c["major_mutagen"][row, p, s] = v(star["mutagen"])
+            for s, star in enumerate(minors):
+                c["minor_star"][row, p, s] = v(star["name"])
+                c["minor_mutagen"][row, p, s] = v(star["mutagen"])
+
+
+class Corpus:
+    """只读语料；整个文件在打开时解压到内存（几万行只有几 MB）"""
+
+    def __init__(self, path):
+        self.path = path
+        with np.load(path, allow_pickle=False) as data:
+            self.meta = json.loads(str(data["meta"]))
+            if self.meta.get("format_version") != FORMAT_VERSION:
+                raise ValueError(f"不支持的语料版本: {path}")
+            self.columns = {name: data[name] for name in data.files if name != "meta"}
+        self.rows = len(self.columns["birth_date"])
+        self.vocab = self.meta["vocab"]
+        self.texts = self.meta["texts"]
+
+    def inputs(self, lo=0, hi=None):
+        """原始输入 [(出生日期, 时间, 性别, is_leap)]"""
+        c = self.columns
+        rows = range(lo, self.rows if hi is None else hi)
+        return [(f"{d // 10000:04d}-{d // 100 % 100:02d}-{d % 100:02d}", f"{t // 60:02d}:{t % 60:02d}",
+                 GENDERS[g], bool(leap))
+                for d, t, g, leap in zip(c["birth_date"][rows.start:rows.stop].tolist(),
+                                         c["birth_time"][rows.start:rows.stop].tolist(),
+                                         c["gender"][rows.start:rows.stop].tolist(),
+                                         c["is_leap"][rows.start:rows.stop].tolist())]
+
+    def keys(self, lo=0, hi=None):
+        """期望的规范键（日期去掉前导 0，时辰取语料中保存的 chen）"""
+        chens = self.columns["chen"][lo:hi].tolist()
+        return [(f"{int(d[:4])}-{int(d[5:7])}-{int(d[8:])}", chen, gender, is_leap)
+                for (d, _, gender, is_leap), chen in zip(self.inputs(lo, hi), chens)]
+
+    def tags(self, row):
+        bits = int(self.columns["tags"][row])
+        return [name for name in TAGS if bits & TAG_BITS[name]]
+
+    def cores(self, lo, hi):
+        """[lo, hi) 行的期望命盘（project 之后的形式）"""
+        c, vocab, texts = self.columns, self.vocab, self.texts
+        block = {name: c[name][lo:hi].tolist() for name in ("texts",) + PALACE_COLUMNS + STAR_COLUMNS}
+        cores = []
+        for r in range(hi - lo):
+            text_ids = block["texts"][r]
+            core = {"basic_info": {}, "palaces": [], "summary": {}}
+            for (section, field), text_id in zip(TEXT_FIELDS, text_ids):
+                core[section][field] = texts[text_id]
+            for p in range(PALACE_COUNT):
+                core["palaces"].append({
+                    "name": vocab[block["palace_name"][r][p]],
+                    "earthly_branch": vocab[block["palace_branch"][r][p]],
+                    "heavenly_stem": vocab[block["palace_stem"][r][p]],
+                    "major_stars": [
+                        {"name": vocab[block["major_star"][r][p][s]],
+                         "brightness": vocab[block["major_brightness"][r][p][s]],
+                         "mutagen": vocab[block["major_mutagen"][r][p][s]]}
+                        for s in range(block["major_count"][r][p])
+                    ],
+                    "minor_stars": [
+                        {"name": vocab[block["minor_star"][r][p][s]], "mutagen": vocab[block["minor_mutagen"][r][p][s]]}
+                        for s in range(block["minor_count"][r][p])
+                    ],
+                    "adjective_stars_count": block["adjective_count"][r][p],
+                })
+            cores.append(core)
+        return cores
+
+    def info(self):
+        counts = {name: int(np.count_nonzero(self.columns["tags"] & TAG_BITS[name])) for name in TAGS}
+        return {
+            "path": self.path,
+            "rows": self.rows,
+            "iztro": self.meta.get("iztro"),
+            "created": self.meta.get("created"),
+            "tags": counts,
+            "vocab": len(self.vocab),
+            "texts": len(self.texts),
+            "file_size": os.path.getsize(self.path),
+        }
+
+
+def build(output, source, random_count=5000, seed=1, progress=True):
+    """用 source（通常是在线 iztro）计算全部语料输入，写入 output，返回行数"""
+    inputs = corpus_inputs(random_count, seed)
+    rows = len(inputs)
+    encoder = ColumnEncoder(rows)
+    columns = {
+        "birth_date": np.array([int(d.replace('-', '')) for d, *_ in inputs], dtype='<u4'),
+        "birth_time": np.array([int(t[:2]) * 60 + int(t[3:]) for _, t, *_ in inputs], dtype='<u2'),
+        "gender": np.array([GENDERS.index(g) for _, _, g, *_ in inputs], dtype='u1'),
+        "is_leap": np.array([leap for *_, leap, _ in inputs], dtype='u1'),
+        "tags": np.array([tags for *_, tags in inputs], dtype='u1'),
+        "chen": np.array([chen_of(t) for _, t, *_ in inputs], dtype='u1'),
+    }
+    started = time.monotonic()
+    for lo in range(0, rows, CHUNK_SIZE):
+        hi = min(lo + CHUNK_SIZE, rows)
+        keys = [canonical_key(*item[:4]) for item in inputs[lo:hi]]
+        for row, core in enumerate(source.charts(keys), lo):
+            if "error" in core:
+                raise RuntimeError(f"计算失败 {inputs[row][:4]}: {core['error']}")
+            encoder.encode(row, core)
+        if progress:
+            print(f"  {hi}/{rows} 行, {time.monotonic() - started:.1f}s", file=sys.stderr)
+
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "rows": rows,
+        "iztro": source.version(),
+        "created": date.today().isoformat(),
+        "random": random_count,
+        "seed": seed,
+        "genders": list(GENDERS),
+        "tags": list(TAGS),
+        "vocab": encoder.vocab.strings,
+        "texts": encoder.texts.strings,
+    }
+    tmp_output = output + '.tmp.npz'
+    np.savez_compressed(tmp_output, meta=np.array(json.dumps(meta, ensure_ascii=False)),
+                        **columns, **encoder.columns)
+    os.replace(tmp_output, output)
+    return rows
+
+
+# ---------- 候选 / 参照 ----------
+
+def open_engine(name):
+    """每个进程自己的计算引擎（进程池模式只开一个 Node 进程，并行度来自进程数）"""
+    from engine_pool import SpawnEngine, NodeWorkerPool, _env_float
+    call_timeout = _env_float('ZIWEI_CALL_TIMEOUT', 30)
+    if name == 'pool':
+        engine = NodeWorkerPool(size=1, max_calls=1 << 30, call_timeout=call_timeout)
+    elif name == 'spawn':
+        engine = SpawnEngine(size=1, call_timeout=call_timeout)
+    elif name == 'daemon':
+        from daemon_client import DaemonEngine
+        engine = DaemonEngine.from_env()
+    else:
+        raise ValueError(f"未知的引擎: {name}")
+    atexit.register(engine.close)
+    return engine
+
+
+class EngineSource:
+    """经 calculate_many 一次算一块"""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def raw(self, keys):
+        items = [{"date": d, "hour": chen, "gender": gender, "fix_leap": is_leap} for d, chen, gender, is_leap in keys]
+        return self.engine.call('calculate_many', {"items": items}, timeout=self.engine.call_timeout * 4)
+
+    def charts(self, keys):
+        return [project(result['data']) if result.get('success') else {"error": result.get('error')}
+                for result in self.raw(keys)]
+
+    def version(self):
+        try:
+            return self.engine.call('version', timeout=10).get('version')
+        except Exception as e:
+            return f"未知（{e}）"
+
+
+class EncodedSource(EngineSource):
+    """引擎结果经 EncodedChart 预编码、拼接回显后再解码，验证 /calculate 实际返回的字节"""
+
+    def charts(self, keys):
+        from chart_cache import EncodedChart, split_chart
+        from fastjson import loads
+        charts = []
+        for result in self.raw(keys):
+            if not result.get('success'):
+                charts.append({"error": result.get('error')})
+                continue
+            core, echo = split_chart(result['data'])
+            charts.append(project(loads(EncodedChart(core).render(echo))))
+        return charts
+
+
+class StoreSource:
+    def __init__(self, path):
+        from chart_store import ChartStore
+        self.store = ChartStore(path)
+
+    def charts(self, keys):
+        charts = []
+        for key in keys:
+            core = self.store.lookup(*key)
+            charts.append(project(core) if core is not None else {"error": "命盘库中没有此输入"})
+        return charts
+
+    def version(self):
+        return self.store.path
+
+
+class FunctionSource:
+    def __init__(self, spec):
+        module, function = spec.rsplit(':', 1)
+        self.function = getattr(importlib.import_module(module), function)
+        self.spec = spec
+
+    def charts(self, keys):
+        return [project(core) if core is not None else {"error": "无结果"} for core in self.function(keys)]
+
+    def version(self):
+        return self.spec
+
+
+def open_source(spec):
+    """pool / spawn / daemon / encoded:<引擎> / store:<路径> / python:<模块>:<函数>"""
+    kind, _, rest = spec.partition(':')
+    if kind == 'encoded':
+        return EncodedSource(open_engine(rest or 'pool'))
+    if kind == 'store':
+        return StoreSource(rest)
+    if kind == 'python':
+        return FunctionSource(rest)
+    return EngineSource(open_engine(spec))
+
+
+# ---------- 进程池中的比较 ----------
+
+_worker = {}
+
+
+def _init_worker(candidate, reference, corpus_path):
+    logging.disable(logging.INFO)
+    _worker["candidate"] = open_source(candidate)
+    _worker["reference"] = open_source(reference) if reference else None
+    _worker["corpus"] = Corpus(corpus_path) if corpus_path else None
+
+
+def _compare(positions, keys, expected, actual):
+    mismatches = []
+    for position, key, want, got in zip(positions, keys, expected, actual):
+        if want != got:
+            mismatches.append((position, key, diff_fields(want, got) if "error" not in got and "error" not in want
+                               else [f"错误: {got.get('error') or want.get('error')}"]))
+    return mismatches
+
+
+def _check_rows(task):
+    """语料的 [lo, hi) 行：候选 vs 期望"""
+    lo, hi = task
+    corpus = _worker["corpus"]
+    keys = corpus.keys(lo, hi)
+    return len(keys), _compare(range(lo, hi), keys, corpus.cores(lo, hi), _worker["candidate"].charts(keys))
+
+
+def _check_slots(task):
+    """日期范围内的 [lo, hi) 槽位（每 stride 个取一个）：候选 vs 参照"""
+    first_ordinal, lo, hi, stride = task
+    positions = range(lo + (-lo) % stride, hi, stride)
+    keys = [slot_key(first_ordinal, slot) for slot in positions]
+    if not keys:
+        return 0, []
+    expected = _worker["reference"].charts(keys)
+    return len(keys), _compare(positions, keys, expected, _worker["candidate"].charts(keys))
+
+
+def run(check, tasks, total, workers, initargs, show, fail_fast, describe, progress=True):
+    """
+    在进程池中执行比较，按输入顺序汇总：返回 {"checked", "mismatches", "first": [...], "elapsed_s", "rate"}
+    first 为最先出现差异的 show 个输入及其字段；fail_fast 时遇到第一处差异即停止
+    """
+    started = time.monotonic()
+    checked, mismatched, first = 0, 0, []
+    last_report = started
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as executor:
+        for count, mismatches in executor.map(check, tasks):
+            checked += count
+            mismatched += len(mismatches)
+            for position, key, fields in mismatches[:max(0, show - len(first))]:
+                first.append({"position": position, **describe(position, key), "fields": fields})
+            if progress and time.monotonic() - last_report > 2:
+                last_report = time.monotonic()
+                print(f"  {checked}/{total}, 差异 {mismatched}, {checked / (last_report - started):.0f}/s",
+                      file=sys.stderr)
+            if fail_fast and mismatched:
+                executor.shutdown(wait=False, cancel_futures=True)
+                break
+    elapsed = time.monotonic() - started
+    return {"checked": checked, "mismatches": mismatched, "first": first,
+            "elapsed_s": round(elapsed, 2), "rate": round(checked / elapsed, 1) if elapsed else None}
+
+
+def check_binning(corpus):
+    """原始输入经 index.canonical_chart_params 得到的规范键应与语料中的一致，返回不一致的行"""
+    from index import canonical_chart_params
+    wrong = []
+    for row, (key, raw) in enumerate(zip(corpus.keys(), corpus.inputs())):
+        actual = canonical_chart_params(*raw)
+        if actual != key:
+            wrong.append({"position": row, "input": list(raw), "expected": list(key), "actual": list(actual)})
+    return wrong
+
+
+def verify(corpus_path, candidate, workers=None, show=10, fail_fast=False, chunk=CHUNK_SIZE, progress=True):
+    """候选对语料"""
+    corpus = Corpus(corpus_path)
+    tasks = [(lo, min(lo + chunk, corpus.rows)) for lo in range(0, corpus.rows, chunk)]
+
+    def describe(row, key):
+        return {"input": list(corpus.inputs(row, row + 1)[0]), "key": list(key), "tags": corpus.tags(row)}
+
+    report = run(_check_rows, tasks, corpus.rows, workers, (candidate, None, corpus_path),
+                 show, fail_fast, describe, progress)
+    report["binning"] = check_binning(corpus)[:show]
+    return {"candidate": candidate, "corpus": corpus.info(), **report}
+
+
+def diff(candidate, reference, start, end, stride=1, workers=None, show=10, fail_fast=False, chunk=CHUNK_SIZE,
+         progress=True):
+    """候选对参照（默认在线 iztro），覆盖 [start, end] 内的全部规范键（每 stride 个取一个）"""
+    slots = ((end - start).days + 1) * 12 * len(GENDERS) * 2
+    span = chunk * stride
+    tasks = [(start.toordinal(), lo, min(lo + span, slots), stride) for lo in range(0, slots, span)]
+    report = run(_check_slots, tasks, (slots + stride - 1) // stride, workers, (candidate, reference, None),
+                 show, fail_fast, lambda slot, key: {"key": list(key)}, progress)
+    return {"candidate": candidate, "reference": reference, "start": start.isoformat(), "end": end.isoformat(),
+            "stride": stride, **report}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="金标准命盘语料与差分验证")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_build = sub.add_parser('build', help="用 iztro 生成语料")
+    p_build.add_argument('--output', default='golden.npz')
+    p_build.add_argument('--source', default='pool', help="计算语料的引擎，默认 pool（在线 iztro）")
+    p_build.add_argument('--random', type=int, default=5000, help="随机输入的个数")
+    p_build.add_argument('--seed', type=int, default=1)
+
+    p_info = sub.add_parser('info', help="查看语料信息")
+    p_info.add_argument('path')
+
+    for name, help_text in (('verify', "候选对语料"), ('diff', "候选对在线参照")):
+        p = sub.add_parser(name, help=help_text)
+        if name == 'verify':
+            p.add_argument('path')
+        else:
+            p.add_argument('--reference', default='pool')
+            p.add_argument('--start', default='1900-01-01')
+            p.add_argument('--end', default='2100-12-31')
+            p.add_argument('--stride', type=int, default=1, help="每 stride 个规范键取一个")
+        p.add_argument('--candidate', required=True)
+        p.add_argument('--workers', type=int, default=os.cpu_count())
+        p.add_argument('--chunk', type=int, default=CHUNK_SIZE)
+        p.add_argument('--show', type=int, default=10, help="列出最先出现差异的输入个数")
+        p.add_argument('--fail-fast', action='store_true')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        source = open_source(args.source)
+        rows = build(args.output, source, random_count=args.random, seed=args.seed)
+        print(json.dumps(Corpus(args.output).info(), ensure_ascii=False, indent=2))
+        print(f"共写入 {rows} 行", file=sys.stderr)
+        return 0
+    if args.command == 'info':
+        print(json.dumps(Corpus(args.path).info(), ensure_ascii=False, indent=2))
+        return 0
+    if args.command == 'verify':
+        report = verify(args.path, args.candidate, args.workers, args.show, args.fail_fast, args.chunk)
+    else:
+        report = diff(args.candidate, args.reference, date.fromisoformat(args.start), date.fromisoformat(args.end),
+                      args.stride, args.workers, args.show, args.fail_fast, args.chunk)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 1 if report["mismatches"] or report.get("binning") else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
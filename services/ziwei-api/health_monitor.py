@@ -0,0 +1,108 @@
+"""健康状态的后台刷新
+
+/health、/ready、/test 只读取这里缓存的状态，探针请求本身不会启动 Node.js 或执行计算。
+后台线程先执行一次 warm_up（启动计算进程、预载缓存），之后每隔 interval 秒执行一次 check：
+验证引擎可用、取得 iztro 版本，并记录最近一次成功计算的耗时与时间。
+
+就绪（ready）= warm_up 已完成且最近一次 check 成功；新实例在预热完成前不接收流量。
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from engine_pool import _env_float
+
+logger = logging.getLogger(__name__)
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class HealthMonitor:
+    """
+    warm_up(): 预热，返回预载的缓存条目数；失败时抛出异常，稍后重试
+    check(): 验证引擎，返回 (信息, 计算耗时秒数, 样例结果)；失败时抛出异常
+    """
+
+    def __init__(self, warm_up, check, interval=30.0, retry_interval=5.0):
+        self._warm_up = warm_up
+        self._check = check
+        self.interval = interval
+        self.retry_interval = min(retry_interval, interval)
+        self.warm = False
+        self.preloaded = 0
+        self.info = {}
+        self.sample = None
+        self.last_check = None
+        self.last_compute = None
+        self.stats = {"checks": 0, "failures": 0}
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_env(cls, warm_up, check):
+        return cls(warm_up, check, interval=_env_float('ZIWEI_HEALTH_INTERVAL', 30))
+
+    @property
+    def ready(self):
+        return self.warm and bool(self.last_check and self.last_check["ok"])
+
+    def start(self):
+        """启动后台线程；已在当前进程中运行时什么也不做（fork 之后在子进程中重新启动）"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='ziwei-health', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            ok = self.refresh()
+            self._stop.wait(self.interval if ok else self.retry_interval)
+
+    def refresh(self):
+        """执行一轮预热（如尚未完成）与检查，返回是否成功"""
+        started = time.perf_counter()
+        try:
+            if not self.warm:
+                self.preloaded = self._warm_up()
+                self.warm = True
+                logger.info(f"计算引擎预热完成，预载缓存 {self.preloaded} 条")
+            info, compute_seconds, sample = self._check()
+        except Exception as e:
+            self.stats["checks"] += 1
+            self.stats["failures"] += 1
+            self.last_check = {"ok": False, "at": _now(), "error": str(e),
+                               "duration_ms": round((time.perf_counter() - started) * 1000, 2)}
+            logger.error(f"健康检查失败: {e}")
+            return False
+        self.stats["checks"] += 1
+        self.info = info
+        self.sample = sample
+        self.last_compute = {"at": _now(), "latency_ms": round(compute_seconds * 1000, 2)}
+        self.last_check = {"ok": True, "at": _now(), "error": None,
+                           "duration_ms": round((time.perf_counter() - started) * 1000, 2)}
+        return True
+
+    def snapshot(self):
+        return {
+            "ready": self.ready,
+            "warm": self.warm,
+            "preloaded": self.preloaded,
+            "interval": self.interval,
+            "last_check": self.last_check,
+            "last_compute": self.last_compute,
+            "stats": dict(self.stats),
+        }
@@ -0,0 +1,53 @@
+"""运限（大限 / 流年 / 流月）时段规划
+
+流年、流月按阳历时段标记：流年取该年 7 月 1 日（必然落在同一农历年内），
+流月取该月 15 日，计算结果中同时给出对应的农历日期。
+大限由本命盘各宫的岁数区间决定，交给计算进程一次算出。
+"""
+import os
+from datetime import date
+
+SCOPES = ('decadal', 'yearly', 'monthly')
+DEFAULT_COUNT = {'yearly': 10, 'monthly': 12}
+MAX_PERIODS = int(os.environ.get('ZIWEI_HOROSCOPE_MAX_PERIODS', 1200))
+
+
+def plan_periods(scope, start=None, count=None, today=None):
+    """
+    返回 [(时段标签, 阳历日期)]；scope 为 decadal 时返回 None
+    start: 流年为起始年份（如 2025），流月为起始年月（如 2025-03），默认当前年/月
+    count: 时段数量；参数有误时抛出 ValueError
+    """
+    if scope not in SCOPES:
+        raise ValueError(f"scope 必须是 {', '.join(SCOPES)} 之一")
+    if scope == 'decadal':
+        return None
+
+    today = today or date.today()
+    count = DEFAULT_COUNT[scope] if count in (None, '') else int(count)
+    if not 1 <= count <= MAX_PERIODS:
+        raise ValueError(f"count 必须在 1 到 {MAX_PERIODS} 之间")
+
+    if scope == 'yearly':
+        year = today.year if start in (None, '') else int(start)
+        if not 1 <= year <= 9999 - count:
+            raise ValueError(f"start 年份超出范围: {start}")
+        return [(str(y), f"{y}-7-1") for y in range(year, year + count)]
+
+    if start in (None, ''):
+        year, month = today.year, today.month
+    else:
+        year, month = (int(part) for part in str(start).split('-'))
+    if not 1 <= month <= 12 or not 1 <= year <= 9999 - count // 12 - 1:
+        raise ValueError(f"start 年月超出范围: {start}")
+    first = year * 12 + month - 1
+    periods = []
+    for offset in range(count):
+        y, m = divmod(first + offset, 12)
+        periods.append((f"{y}-{m + 1:02d}", f"{y}-{m + 1}-15"))
+    return periods
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
@@ -0,0 +1,87 @@
+"""HTTP 缓存语义：ETag、Cache-Control、条件请求与响应压缩
+
+同一 iztro 版本下，规范键相同的命盘永远不变，因此 ETag 由规范缓存键 + 回显字段 + iztro 版本 + API 版本派生，
+GET 请求命中 If-None-Match 时直接返回 304，不需要查缓存或调用计算引擎。
+/calculate 的响应带有 request_info.timestamp、calculation_time 等处理时间，同一命盘的字节并不相同，
+这些字段不参与 ETag，因此只能用弱 ETag（语义相同，不保证字节相同）；内容完全由令牌决定的 /charts/<token> 用强 ETag。
+"""
+import gzip
+import hashlib
+import os
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - 取决于部署环境
+    brotli = None
+
+MAX_AGE = int(os.environ.get('ZIWEI_HTTP_MAX_AGE', 86400))
+COMPRESS_MIN_SIZE = int(os.environ.get('ZIWEI_COMPRESS_MIN_SIZE', 1024))
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson')
+
+ENCODINGS = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+# /calculate 的响应回显请求者的出生信息、User-Agent 与处理时间，只允许浏览器自己缓存，
+# CDN / 共享代理不能把一个用户的回显交给其他用户；内容完全由令牌决定的 /charts/<token> 才用 public
+PRIVATE_CACHE_CONTROL = f"private, max-age={MAX_AGE}, stale-while-revalidate={MAX_AGE * 7}"
+CACHE_CONTROL = f"public, max-age={MAX_AGE}, stale-while-revalidate={MAX_AGE * 7}"
+
+
+def make_etag(cache_key, echo_values, engine_version, api_version):
+    """ETag 值（不含引号与 W/ 前缀）；echo_values 为响应中回显的请求参数"""
+    source = "|".join([cache_key, *map(str, echo_values), str(engine_version), api_version])
+    digest = hashlib.blake2b(source.encode('utf-8'), digest_size=12)
+    return digest.hexdigest()
+
+
+def etag_variants(etag):
+    # 压缩后的表示使用带编码后缀的 ETag，这里列出所有可能被客户端回传的形式
+    return [etag] + [f"{etag}-{encoding}" for encoding in ENCODINGS]
+
+
+def not_modified(if_none_match, etag):
+    """
+    If-None-Match（werkzeug ETags 对象）按弱比较命中时，返回客户端持有的那个 ETag，否则返回 None
+    """
+    if not if_none_match:
+        return None
+    if if_none_match.star_tag:
+        return etag
+    for tag in etag_variants(etag):
+        if if_none_match.contains_weak(tag):
+            return tag
+    return None
+
+
+def choose_encoding(accept_encodings):
+    """按 Accept-Encoding 的权重选择压缩算法"""
+    return accept_encodings.best_match(ENCODINGS)
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+def compress_response(response, accept_encodings):
+    """对足够大的 JSON 响应按协商结果压缩，带 ETag 时追加编码后缀"""
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+    encoding = choose_encoding(accept_encodings)
+    if encoding is None:
+        return response
+
+    response.set_data(compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak=weak)
+    return response
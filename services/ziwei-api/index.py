@@ -1,12 +1,34 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, has_request_context, request, jsonify, stream_with_context
 import json
-import subprocess
 import os
 import sys
-import tempfile
+import time
 from datetime import datetime
 import traceback
 import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from chart_cache import EncodedChart, get_cache, make_key, make_pair_key, make_period_key
+from fastjson import dumps as dumps_json, loads as loads_json, splice_object
+from chart_store import get_store
+from engine_pool import EngineError, EngineTimeout, get_pool, iztro_version, resolve_iztro_version
+from http_cache import CACHE_CONTROL, PRIVATE_CACHE_CONTROL, compress_response, make_etag, not_modified
+from singleflight import FlightTimeout, get_flights
+from admission import Deadline, DeadlineExceeded, Overloaded, get_admission, parse_timeout, worker_admit
+from horoscope import chunked, plan_periods
+from health_monitor import HealthMonitor
+from analytics import QueryError, get_analytics
+from topics import SCORING_VERSION
+import lunar_calendar
+import solar_time
+from compatibility import compare, compare_many, flip, version_tag as compatibility_version
+import metrics
+import events
+import share_token
+
+# 在 app.logger 首次使用之前配置，json 模式下 Flask 不再另加默认 handler
+events.configure_from_env()
 
 app = Flask(__name__)
 
@@ -64,218 +86,403 @@ def get_time_chen_index(hour, minute):
     # 默认返回子时
     return 0
 
-def call_iztro_api(birth_date, birth_time, gender, is_leap=False):
-    """调用iztro库计算紫微斗数 - 完全基于ziwei_terminal.py的逻辑"""
+class ParamError(ValueError):
+    """参数校验失败，payload 为返回给客户端的错误内容"""
+    
+    def __init__(self, payload):
+        super().__init__(payload.get("error"))
+        self.payload = payload
+
+# 可选的输入参数：农历输入（lunar_calendar.py）与真太阳时修正（solar_time.py）
+INPUT_OPTIONS = ('calendar', 'is_leap_month', 'true_solar_time', 'longitude', 'timezone', 'location')
+LUNAR_CALENDARS = ('lunar', '农历', '農曆', '阴历', '陰曆')
+
+def input_options(source):
+    """从请求参数（JSON对象或查询参数）中取出可选的输入参数"""
+    return {field: source.get(field) for field in INPUT_OPTIONS}
+
+def parse_flag(value):
+    """布尔参数：JSON 布尔值或查询参数中的 true/1/yes"""
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', '1', 'yes', 'on')
+    return bool(value)
+
+def lunar_to_solar(birth_datetime, birth_date, is_leap_month):
+    """
+    农历输入换算为公历，返回 (公历日期, 出生时间或 None, 农历信息)
+    农历日期不一定是合法的公历日期（如二月三十），因此不经过 parse_input_time
+    """
+    year, month, day, birth_time = lunar_calendar.parse_lunar(birth_datetime or birth_date)
+    solar = lunar_calendar.to_solar(year, month, day, is_leap_month)
+    lunar = {"date": f"{year}-{month:02d}-{day:02d}", "is_leap_month": bool(is_leap_month)}
+    return solar.strftime("%Y-%m-%d"), birth_time, lunar
+
+def validate_calculation_params(birth_datetime, birth_date, birth_time, gender, is_leap, options=None):
+    """
+    校验并标准化计算参数，返回 processed_params；参数有误时抛出 ParamError
+    options 为可选的输入参数（input_options）：
+    - calendar 为农历时先换算为公历，农历原输入记录在 processed_params["lunar"]
+    - true_solar_time 时 birth_date / birth_time 替换为修正后的真太阳时，
+      原输入与修正量记录在 processed_params["true_solar_time"]
+    两者都在规范键之前完成，与等价的公历输入共用同一条缓存
+    """
+    options = options or {}
+    lunar = None
+    if str(options.get('calendar') or '').strip().lower() in LUNAR_CALENDARS and (birth_datetime or birth_date):
+        try:
+            birth_date, datetime_time, lunar = lunar_to_solar(birth_datetime, birth_date,
+                                                              parse_flag(options.get('is_leap_month')))
+        except ValueError as e:
+            raise ParamError({
+                "success": False,
+                "error": f"农历日期错误: {e}",
+                "parameters": {
+                    "calendar": "lunar 表示 birth_datetime / birth_date 为农历",
+                    "birth_datetime": "农历日期时间，如 1990-04-11 08:30",
+                    "is_leap_month": "是否闰月，默认 false",
+                    "range": f"{lunar_calendar.FIRST_YEAR}–{lunar_calendar.LAST_YEAR}"
+                }
+            })
+        # 与 parse_input_time 相同：birth_datetime 只有日期时按 00:00
+        birth_time = datetime_time or birth_time or ("00:00" if birth_datetime else None)
+        birth_datetime = None
+    
+    # 参数处理：如果有birth_datetime，解析它
+    if birth_datetime:
+        try:
+            with metrics.timed('parse'):
+                birth_date, birth_time = parse_input_time(str(birth_datetime))
+        except ValueError as e:
+            raise ParamError({
+                "success": False,
+                "error": f"时间格式解析错误: {str(e)}",
+                "supported_formats": [
+                    "2000-08-16 14:30",
+                    "2000/08/16 14:30",
+                    "2000.08.16 14:30"
+                ]
+            })
+    
+    # 检查必需参数
+    if not birth_date or not birth_time:
+        raise ParamError({
+            "success": False,
+            "error": "缺少必需参数：出生日期和时间",
+            "required_parameters": {
+                "birth_datetime": "完整的出生日期时间，如：2000-08-16 14:30",
+                "或分别提供": {
+                    "birth_date": "出生日期，如：2000-08-16", 
+                    "birth_time": "出生时间，如：14:30"
+                },
+                "gender": "性别，支持：男/女/male/female"
+            },
+            "examples": {
+                "GET请求": "/calculate?birth_datetime=2000-08-16 14:30&gender=男",
+                "POST请求": {
+                    "birth_datetime": "2000-08-16 14:30",
+                    "gender": "女"
+                }
+            }
+        })
+    
+    # 性别标准化处理
+    started = time.perf_counter()
+    gender_str = str(gender).strip()
+    original_gender = gender_str
+    
+    if gender_str in ['男', 'male', 'M', 'm', '1']:
+        normalized_gender = 'male'
+    elif gender_str in ['女', 'female', 'F', 'f', '0']:
+        normalized_gender = 'female'
+    else:
+        normalized_gender = None
+    metrics.record('gender', time.perf_counter() - started)
+    if normalized_gender is None:
+        raise ParamError({
+            "success": False,
+            "error": "性别参数错误",
+            "received_gender": repr(gender_str),
+            "supported_values": ["男", "女", "male", "female"]
+        })
+    
+    # 真太阳时修正：修正后的时间参与时辰划分，与落在同一时辰的未修正请求共用缓存
+    correction = None
+    if parse_flag(options.get('true_solar_time')):
+        try:
+            correction = solar_time.correct(birth_date, birth_time, options.get('longitude'),
+                                            options.get('timezone'), options.get('location'))
+        except ValueError as e:
+            raise ParamError({
+                "success": False,
+                "error": f"真太阳时参数错误: {e}",
+                "parameters": {
+                    "true_solar_time": "true 时按出生地修正为真太阳时",
+                    "longitude": "出生地经度，东经为正，如 121.56",
+                    "location": "或提供城市名，如 台北、上海",
+                    "timezone": "出生时的时区（小时），默认城市所在时区或 8"
+                }
+            })
+        birth_date, birth_time = correction.pop("birth_date"), correction.pop("birth_time")
+    
+    # 记录处理后的参数
+    processed = {
+        "birth_date": birth_date,
+        "birth_time": birth_time,
+        "original_gender": original_gender,
+        "normalized_gender": normalized_gender,
+        "is_leap": is_leap
+    }
+    if lunar is not None:
+        processed["lunar"] = lunar
+    if correction is not None:
+        processed["true_solar_time"] = correction
+    return processed
+
+def canonical_chart_params(birth_date, birth_time, gender, is_leap=False):
+    """
+    把出生信息归一为命盘的规范键 (formatted_date, time_chen_index, iztro_gender, is_leap)
+    同一规范键的命盘完全相同
+    """
+    # 转换性别格式 - 保持中文，与ziwei_terminal.py一致
+    gender_map = {"男": "男", "女": "女", "male": "男", "female": "女"}
+    iztro_gender = gender_map.get(gender, "男")
+    
+    # 解析时间并获取时辰索引
+    hour, minute = map(int, birth_time.split(':'))
+    time_chen_index = get_time_chen_index(hour, minute)
+    
+    # 格式化日期为iztro需要的格式（去掉前导0）
+    year, month, day = birth_date.split('-')
+    formatted_date = f"{year}-{int(month)}-{int(day)}"
+    
+    return formatted_date, time_chen_index, iztro_gender, bool(is_leap)
+
+def chart_echo(birth_date, birth_time, gender):
+    """命盘中随请求变化的回显字段"""
+    return {
+        "basic_info": {"birth_date": birth_date, "birth_time": birth_time, "gender": gender},
+        "summary": {"calculation_time": datetime.utcnow().isoformat(timespec='milliseconds') + 'Z'}
+    }
+
+def engine_params(canonical, birth_date, birth_time, gender):
+    """Node worker 的 calculate 参数"""
+    formatted_date, time_chen_index, iztro_gender, is_leap = canonical
+    return events.with_engine_debug({
+        "date": formatted_date,
+        "hour": time_chen_index,
+        "gender": iztro_gender,
+        "fix_leap": is_leap,
+        "birth_date": birth_date,
+        "birth_time": birth_time,
+        "raw_gender": gender
+    })
+
+class ChartUnavailable(Exception):
+    """
+    命盘计算失败，result 为失败结果（与 call_iztro_api 的返回格式相同）
+    transient 表示失败来自计算进程本身（超时、崩溃）或负载，重试可能成功
+    status 为对应的 HTTP 状态码，retry_after 为建议的重试等待秒数
+    """
+    
+    def __init__(self, result, transient=False, status=500, retry_after=None):
+        super().__init__(result.get("error"))
+        self.result = result
+        self.transient = transient
+        self.status = status
+        self.retry_after = retry_after
+
+# ASGI 模式（asgi.py）下 /calculate 的引擎调用交给事件循环异步执行：
+# 视图第一次执行时抛出 ComputeDeferred，异步计算完成后带着结果重新执行一次视图
+DEFER_COMPUTE = 'ziwei.defer_compute'
+ENGINE_OUTCOMES = 'ziwei.engine_outcomes'
+DEFERRED = 'ziwei.deferred'
+ENGINE_SECONDS = 'ziwei.engine_seconds'
+
+class ComputeDeferred(Exception):
+    """需要由事件循环异步计算的命盘"""
+    
+    def __init__(self, key, params, deadline):
+        super().__init__(key)
+        self.key = key
+        self.params = params
+        self.deadline = deadline
+
+def call_engine(key, params, deadline):
+    """
+    经准入控制调用计算引擎，排队与计算共用请求的截止时间（守护模式下由守护进程排队）
+    ASGI 模式下只取回事件循环已经算好的结果（或异常），准入控制在事件循环中进行
+    """
+    environ = request.environ if has_request_context() else {}
+    if not environ.get(DEFER_COMPUTE):
+        with metrics.timed('engine'), worker_admit(deadline):
+            if deadline.expired:
+                raise DeadlineExceeded("排队等待超过截止时间")
+            return get_pool().call('calculate', params, timeout=deadline.remaining())
+    outcome = environ.get(ENGINE_OUTCOMES, {}).get(key)
+    if outcome is None:
+        raise ComputeDeferred(key, params, deadline)
+    metrics.record('engine', environ.get(ENGINE_SECONDS, {}).get(key, 0.0))
+    if isinstance(outcome, Exception):
+        raise outcome
+    return outcome
+
+def lookup_chart(canonical):
+    """
+    按 内存缓存 → 预计算命盘库 → 磁盘缓存 的顺序查找预编码命盘，未命中返回 None
+    命盘库的结果只放入内存层，不写磁盘
+    """
+    with metrics.timed('cache'):
+        return _lookup_chart(canonical)
+
+def _lookup_chart(canonical):
+    return get_cache().lookup(make_key(*canonical), canonical, get_store())
+
+def prepare_chart(birth_date, birth_time, gender, is_leap=False, deadline=None):
+    """
+    取得预编码命盘，返回 (EncodedChart, 回显字段)；失败时抛出 ChartUnavailable
+    deadline 为请求的截止时间，默认 ZIWEI_CALL_TIMEOUT
+    """
+    if deadline is None:
+        deadline = Deadline(get_pool().call_timeout)
     try:
-        # 转换性别格式 - 保持中文，与ziwei_terminal.py一致
-        gender_map = {"男": "男", "女": "女", "male": "男", "female": "女"}
-        iztro_gender = gender_map.get(gender, "男")
-        
-        app.logger.info(f"原始性别: {repr(gender)}, 转换后: {iztro_gender}")
-        
-        # 解析时间并获取时辰索引
-        hour, minute = map(int, birth_time.split(':'))
-        time_chen_index = get_time_chen_index(hour, minute)
+        canonical = canonical_chart_params(birth_date, birth_time, gender, is_leap)
+        formatted_date, time_chen_index, iztro_gender, is_leap = canonical
         
-        app.logger.info(f"时间解析: {birth_time} -> 时辰索引: {time_chen_index}")
+        events.emit('chart.canonical', birth_date=birth_date, birth_time=birth_time, gender=gender,
+                    date=formatted_date, hour=time_chen_index, iztro_gender=iztro_gender)
         
-        # 格式化日期为iztro需要的格式（去掉前导0）
-        year, month, day = birth_date.split('-')
-        formatted_date = f"{year}-{int(month)}-{int(day)}"
+        echo = chart_echo(birth_date, birth_time, gender)
         
-        app.logger.info(f"格式化日期: {birth_date} -> {formatted_date}")
+        # 同一天同一时辰的命盘完全相同，先查缓存
+        chart = lookup_chart(canonical)
+        if chart is not None:
+            return chart, echo
         
-        # 创建一个固定名称的JS文件，便于调试
-        js_file_path = 'ziwei_calculation.js'
+        key = make_key(*canonical)
         
-        # 创建Node.js脚本 - 完全复制ziwei_terminal.py的逻辑
-        js_code = f'''console.log('=== 紫微斗数计算开始 ===');
-
-// 环境检查
-console.log('Node.js版本:', process.version);
-console.log('当前工作目录:', process.cwd());
-
-try {{
-    // 加载iztro库 - 尝试多种加载方式
-    let iztro;
-    try {{
-        iztro = require('iztro');
-        console.log('✅ 直接加载iztro成功');
-    }} catch (e1) {{
-        try {{
-            iztro = require('./node_modules/iztro');
-            console.log('✅ 相对路径加载iztro成功');
-        }} catch (e2) {{
-            console.error('❌ 所有加载方式都失败了');
-            console.error('直接加载错误:', e1.message);
-            console.error('相对路径错误:', e2.message);
-            process.exit(1);
-        }}
-    }}
-    
-    // 检查astro对象
-    if (!iztro.astro) {{
-        console.error('❌ iztro.astro 不存在');
-        console.error('iztro对象属性:', Object.keys(iztro));
-        process.exit(1);
-    }}
-    console.log('✅ iztro.astro 对象存在');
-    
-    // 设置计算参数
-    const date = "{formatted_date}";
-    const hour = {time_chen_index};
-    const gender = "{iztro_gender}";
-    const fixLeap = {str(is_leap).lower()};
-    
-    console.log('计算参数:');
-    console.log('- 日期:', date);
-    console.log('- 时辰索引:', hour, '(0-11)');
-    console.log('- 性别:', gender);
-    console.log('- 修正闰年:', fixLeap);
-    
-    // 调用iztro进行计算 - 与ziwei_terminal.py完全一致
-    console.log('开始调用iztro.astro.bySolar...');
-    const astrolabe = iztro.astro.bySolar(
-        date,                    // 阳历日期字符串
-        hour,                    // 时辰索引 0-11
-        gender,                  // 性别 "男"/"女"
-        fixLeap,                 // 是否修正闰年
-        'zh-CN'                  // 语言
-    );
-    
-    console.log('✅ 紫微斗数计算成功！');
-    
-    // 格式化输出结果 - 包含完整信息
-    const result = {{
-        success: true,
-        data: {{
-            basic_info: {{
-                birth_date: "{birth_date}",
-                birth_time: "{birth_time}",
-                gender: "{gender}",
-                solar_date: astrolabe.solarDate || '未知',
-                lunar_date: astrolabe.lunarDate || '未知',
-                time_chen: astrolabe.time || '未知',
-                time_range: astrolabe.timeRange || '未知',
-                sign: astrolabe.sign || '未知',
-                zodiac: astrolabe.zodiac || '未知',
-                five_elements_class: astrolabe.fiveElementsClass || '未知',
-                soul: astrolabe.soul || '未知',
-                body: astrolabe.body || '未知'
-            }},
-            palaces: astrolabe.palaces ? astrolabe.palaces.map(palace => ({{
-                name: palace.name || '未知',
-                earthly_branch: palace.earthlyBranch || '未知',
-                heavenly_stem: palace.heavenlyStem || '未知',
-                major_stars: palace.majorStars ? palace.majorStars.map(star => ({{
-                    name: star.name || '未知',
-                    brightness: star.brightness || '',
-                    mutagen: star.mutagen || ''
-                }})) : [],
-                minor_stars: palace.minorStars ? palace.minorStars.map(star => ({{
-                    name: star.name || '未知',
-                    mutagen: star.mutagen || ''
-                }})) : [],
-                adjective_stars_count: palace.adjectiveStars ? palace.adjectiveStars.length : 0
-            }})) : [],
-            summary: {{
-                description: `${{astrolabe.solarDate || date}}出生，农历${{astrolabe.lunarDate || '未知'}}`,
-                time_info: `${{astrolabe.time || '未知'}} (${{astrolabe.timeRange || '未知'}})`,
-                soul_palace: astrolabe.earthlyBranchOfSoulPalace || '未知',
-                body_palace: astrolabe.earthlyBranchOfBodyPalace || '未知',
-                calculation_time: new Date().toISOString()
-            }}
-        }}
-    }};
-    
-    console.log('CALCULATION_SUCCESS');
-    console.log(JSON.stringify(result, null, 2));
-    console.log('CALCULATION_END');
-    
-}} catch (error) {{
-    console.error('❌ 计算过程发生错误:');
-    console.error('错误消息:', error.message);
-    console.error('错误堆栈:', error.stack);
-    
-    const errorResult = {{
-        success: false,
-        error: error.message,
-        error_type: error.constructor.name,
-        stack: error.stack
-    }};
-    
-    console.log('CALCULATION_ERROR');
-    console.log(JSON.stringify(errorResult, null, 2));
-    console.log('CALCULATION_END');
-}}
-
-console.log('=== 紫微斗数计算结束 ===');'''
-        
-        # 写入JS文件
-        with open(js_file_path, 'w', encoding='utf-8') as f:
-            f.write(js_code)
-        
-        app.logger.info(f"JS计算文件已创建: {js_file_path}")
-        
-        try:
-            # 执行Node.js脚本
-            result = subprocess.run([
-                'node', js_file_path
-            ], capture_output=True, text=True, timeout=30, encoding='utf-8')
-            
-            app.logger.info(f"Node.js执行完成 - 返回码: {result.returncode}")
-            
-            if result.stderr:
-                app.logger.info(f"Node.js调试信息: {result.stderr}")
+        def compute():
+            # 可能刚被同一键的另一次计算写入
+            chart = lookup_chart(canonical)
+            if chart is not None:
+                return chart
+            # 交给常驻Node.js进程池计算，避免每次请求冷启动node并重新加载iztro
+            try:
+                result = call_engine(key, engine_params(canonical, birth_date, birth_time, gender), deadline)
+            except Overloaded as e:
+                app.logger.warning("计算队列已满: %s", e)
+                raise ChartUnavailable({"success": False, "error": str(e), "error_type": "Overloaded"},
+                                       transient=True, status=503, retry_after=e.retry_after)
+            except DeadlineExceeded as e:
+                raise ChartUnavailable({"success": False, "error": str(e), "error_type": "DeadlineExceeded"},
+                                       transient=True, status=504)
+            except EngineTimeout as e:
+                app.logger.error("计算超时: %s", e)
+                raise ChartUnavailable({"success": False, "error": str(e), "error_type": "EngineTimeout"},
+                                       transient=True, status=504)
+            except EngineError as e:
+                app.logger.error("Node.js执行失败: %s", e)
+                raise ChartUnavailable({"success": False, "error": f"Node.js执行失败: {e}"}, transient=True)
             
-            if result.returncode == 0:
-                # 解析成功结果
-                if 'CALCULATION_SUCCESS' in result.stdout and 'CALCULATION_END' in result.stdout:
-                    start_marker = 'CALCULATION_SUCCESS'
-                    end_marker = 'CALCULATION_END'
-                    
-                    start_pos = result.stdout.find(start_marker) + len(start_marker)
-                    end_pos = result.stdout.find(end_marker, start_pos)
-                    
-                    if end_pos != -1:
-                        json_str = result.stdout[start_pos:end_pos].strip()
-                        try:
-                            return json.loads(json_str)
-                        except json.JSONDecodeError as e:
-                            app.logger.error(f"JSON解析错误: {e}")
-                            return {"success": False, "error": f"JSON解析失败: {e}"}
-                
-                # 解析错误结果
-                if 'CALCULATION_ERROR' in result.stdout and 'CALCULATION_END' in result.stdout:
-                    start_marker = 'CALCULATION_ERROR'
-                    end_marker = 'CALCULATION_END'
-                    
-                    start_pos = result.stdout.find(start_marker) + len(start_marker)
-                    end_pos = result.stdout.find(end_marker, start_pos)
-                    
-                    if end_pos != -1:
-                        json_str = result.stdout[start_pos:end_pos].strip()
-                        try:
-                            return json.loads(json_str)
-                        except json.JSONDecodeError:
-                            pass
-                
-                return {"success": False, "error": "无法解析计算结果", "raw_output": result.stdout[:500]}
-            else:
-                return {"success": False, "error": f"Node.js执行失败: {result.stderr}"}
+            chart = get_cache().remember(key, result)
+            if chart is None:
+                raise ChartUnavailable(result)
+            return chart
         
-        finally:
-            # 保留JS文件便于调试（生产环境中可以删除）
-            # if os.path.exists(js_file_path):
-            #     os.remove(js_file_path)
-            pass
-                
+        # 同一键的并发请求只计算一次；只有确定性的失败才共享给等待者
+        try:
+            chart = get_flights().do(
+                key, compute,
+                timeout=deadline.remaining(),
+                peek=lambda: get_cache().get(key),
+                share_error=lambda e: isinstance(e, ChartUnavailable) and not e.transient,
+            )
+        except FlightTimeout as e:
+            app.logger.error("等待计算结果超时: %s", e)
+            raise ChartUnavailable({"success": False, "error": str(e), "error_type": "DeadlineExceeded"},
+                                   transient=True, status=504)
+        return chart, echo
+    
+    except (ChartUnavailable, ComputeDeferred):
+        raise
     except Exception as e:
-        app.logger.error(f"计算异常: {str(e)}\n{traceback.format_exc()}")
-        return {
+        app.logger.exception("计算异常: %s", e)
+        raise ChartUnavailable({
             "success": False, 
             "error": f"Python执行错误: {str(e)}"
-        }
+        })
+
+def call_iztro_api(birth_date, birth_time, gender, is_leap=False):
+    """调用iztro库计算紫微斗数 - 完全基于ziwei_terminal.py的逻辑"""
+    try:
+        chart, echo = prepare_chart(birth_date, birth_time, gender, is_leap)
+    except ChartUnavailable as e:
+        return e.result
+    return {"success": True, "data": chart.to_data(echo)}
+
+# 健康检查：/health、/ready、/test 只读取后台线程刷新的状态
+TEST_CHART = ("2000-08-16", "14:30", "male")
+CACHE_PRELOAD = int(os.environ.get('ZIWEI_CACHE_PRELOAD', 1024))
+
+def store_only():
+    """
+    没有 Node.js（--build-arg WITH_NODE=0 的精简映像）但加载了命盘库：所有命盘都来自命盘库，
+    预热与健康检查不启动计算引擎，改为查表
+    """
+    return shutil.which('node') is None and get_store() is not None
+
+def warm_engine():
+    """启动计算进程、确定 iztro 版本（ETag 的一部分），并把磁盘缓存中最近的命盘载入内存，返回预载条数"""
+    if store_only():
+        resolve_iztro_version()
+    else:
+        pool = get_pool()
+        pool.warm_up()
+        resolve_iztro_version(pool)
+    return get_cache().preload(CACHE_PRELOAD)
+
+def check_store():
+    """精简映像的健康检查：从命盘库读出测试命盘"""
+    birth_date, birth_time, gender = TEST_CHART
+    canonical = canonical_chart_params(birth_date, birth_time, gender)
+    started = time.perf_counter()
+    core = get_store().lookup(*canonical)
+    seconds = time.perf_counter() - started
+    if core is None:
+        raise EngineError("命盘库中没有测试命盘，且没有可用的计算引擎")
+    return {"iztro": {"version": iztro_version() or '未知'}}, seconds, EncodedChart(core)
+
+def check_engine():
+    """
+    绕过缓存实际计算一次测试命盘，确认引擎可用（精简映像改为查命盘库）
+    返回 ({"iztro": 版本信息, "compute_daemon": 守护进程状态}, 计算耗时, 测试命盘)
+    """
+    if store_only():
+        return check_store()
+    pool = get_pool()
+    info = {}
+    if os.environ.get('ZIWEI_ENGINE') == 'daemon':
+        # 守护进程回报自身状态与启动时取得的 iztro 版本
+        info["compute_daemon"] = pool.call('health', timeout=5)
+        info["iztro"] = info["compute_daemon"].get('iztro') or {}
+    else:
+        info["iztro"] = pool.call('version', timeout=10)
+    
+    birth_date, birth_time, gender = TEST_CHART
+    canonical = canonical_chart_params(birth_date, birth_time, gender)
+    started = time.perf_counter()
+    result, = pool.call('calculate_many', {"items": [engine_params(canonical, birth_date, birth_time, gender)]})
+    seconds = time.perf_counter() - started
+    chart = get_cache().remember(make_key(*canonical), result)
+    if chart is None:
+        raise EngineError(result.get('error', '测试命盘计算失败'))
+    return info, seconds, chart
+
+_monitor = HealthMonitor.from_env(warm_engine, check_engine)
+
+def get_monitor():
+    """启动（fork 之后在每个 worker 中各启动一次）并返回健康检查的后台刷新"""
+    _monitor.start()
+    return _monitor
 
 @app.route('/', methods=['GET'])
 def home():
@@ -289,10 +496,19 @@ def home():
         
         "endpoints": {
             "GET /": "API文档首页",
-            "GET /health": "健康检查",
-            "GET /test": "测试用例",
+            "GET /health": "健康检查（存活，读取后台刷新的状态）",
+            "GET /ready": "就绪检查（预热完成前返回503）",
+            "GET /test": "测试用例（返回后台检查算出的结果）",
             "GET /ping": "快速ping测试",
+            "GET /metrics": "Prometheus格式的分阶段耗时与缓存/进程池指标",
             "GET|POST /calculate": "计算紫微斗数命盘（核心功能）",
+            "POST /calculate/batch": "批量计算命盘，NDJSON流式返回",
+            "GET|POST /calculate/horoscope": "运限（大限/流年/流月），按时段流式返回",
+            "POST /calculate/compatibility": "合盘（两人配对，或一人对多人批量计分）",
+            "POST /charts": "生成命盘分享令牌（令牌内含算好的命盘）",
+            "GET /charts/<token>": "解码分享令牌，直接返回命盘，不经过计算引擎",
+            "GET /analytics": "列式分析库信息（日期范围、可分组的列）",
+            "POST /analytics/aggregate": "人群聚合查询（筛选、分组计数、比例）",
             "GET|POST /debug": "调试接口"
         },
         
@@ -320,6 +536,16 @@ def home():
                     "gender": "男"
                 }
             },
+            "batch_api_post": {
+                "description": "批量计算（JSON数组或NDJSON），结果按输入顺序以NDJSON逐行返回",
+                "url": "/calculate/batch",
+                "method": "POST",
+                "headers": {"Content-Type": "application/json 或 application/x-ndjson"},
+                "body": [
+                    {"birth_datetime": "2000-08-16 14:30", "gender": "男"},
+                    {"birth_datetime": "1995-03-02 08:10", "gender": "female", "is_leap": True}
+                ]
+            },
             "separated_format": {
                 "description": "分离式日期时间格式",
                 "body": {
@@ -345,6 +571,39 @@ def home():
                 "description": "是否闰年修正",
                 "default": False,
                 "required": False
+            },
+            "calendar": {
+                "description": "lunar（农历）时 birth_datetime / birth_date 按农历解读，范围 1900–2100",
+                "default": "solar",
+                "required": False
+            },
+            "is_leap_month": {
+                "description": "农历输入是否为闰月",
+                "default": False,
+                "required": False
+            },
+            "true_solar_time": {
+                "description": "按出生地修正为真太阳时后再划分时辰（需提供 longitude 或 location）",
+                "default": False,
+                "required": False
+            },
+            "longitude": {
+                "description": "出生地经度，东经为正，如 121.56",
+                "required": False
+            },
+            "location": {
+                "description": "出生城市（代替 longitude），如 台北、上海、香港",
+                "required": False
+            },
+            "timezone": {
+                "description": "出生时的时区（小时，如 8 或 +08:00；夏令时期间出生请填 9）",
+                "default": "城市所在时区或 8",
+                "required": False
+            },
+            "timeout": {
+                "description": "本次请求的截止秒数（也可用 X-Request-Timeout 请求头），排队与计算共用；计算队列已满时返回503及Retry-After",
+                "default": "ZIWEI_CALL_TIMEOUT（30）",
+                "required": False
             }
         },
         
@@ -414,36 +673,32 @@ def debug():
 
 @app.route('/test', methods=['GET'])
 def test():
-    """测试接口 - 使用固定参数"""
-    try:
-        app.logger.info("开始API测试...")
-        
-        # 使用测试数据
-        test_birth_date = "2000-08-16"
-        test_birth_time = "14:30"
-        test_gender = "male"
-        
-        result = call_iztro_api(test_birth_date, test_birth_time, test_gender)
-        
-        return jsonify({
-            "status": "success",
-            "message": "紫微斗数API服务测试完成",
-            "service_version": "1.0.1",
-            "test_data": {
-                "birth_date": test_birth_date,
-                "birth_time": test_birth_time,
-                "gender": test_gender
-            },
-            "result": result,
-            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        })
-    except Exception as e:
-        app.logger.error(f"测试失败: {str(e)}")
+    """测试接口 - 使用固定参数，直接返回后台健康检查算出的结果，不在请求中计算"""
+    test_birth_date, test_birth_time, test_gender = TEST_CHART
+    monitor = get_monitor()
+    chart = monitor.sample
+    if chart is None:
         return jsonify({
             "status": "error",
-            "message": f"测试失败: {str(e)}",
-            "traceback": traceback.format_exc()
-        }), 500
+            "message": "计算引擎尚未就绪，请稍后再试",
+            "health_check": monitor.snapshot(),
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }), 503
+    
+    echo = chart_echo(test_birth_date, test_birth_time, test_gender)
+    return jsonify({
+        "status": "success",
+        "message": "紫微斗数API服务测试完成",
+        "service_version": "1.0.1",
+        "test_data": {
+            "birth_date": test_birth_date,
+            "birth_time": test_birth_time,
+            "gender": test_gender
+        },
+        "result": {"success": True, "data": chart.to_data(echo)},
+        "last_compute": monitor.last_compute,
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    })
 
 @app.route('/calculate', methods=['GET', 'POST'])  # 🔧 关键改进：同时支持GET和POST
 def calculate():
@@ -461,7 +716,6 @@ def calculate():
         if request.method == 'POST':
             # POST请求：从JSON body获取参数
             data = request.get_json()
-            app.logger.info(f"POST请求 - 收到数据: {data}")
             request_info["source"] = "POST JSON body"
             
             if not data:
@@ -476,6 +730,7 @@ def calculate():
             birth_time = data.get('birth_time')
             gender = data.get('gender', 'male')
             is_leap = data.get('is_leap', False)
+            requested_timeout = data.get('timeout')
             
         else:
             # GET请求：从查询参数获取（Coze平台使用此方式）
@@ -484,113 +739,99 @@ def calculate():
             birth_time = request.args.get('birth_time')
             gender = request.args.get('gender', 'male')
             is_leap = request.args.get('is_leap', 'false').lower() == 'true'
+            requested_timeout = request.args.get('timeout')
             request_info["source"] = "GET query parameters"
-            
-            app.logger.info(f"GET请求 - 参数: birth_datetime={birth_datetime}, gender={gender}")
-        
-        # 参数处理：如果有birth_datetime，解析它
-        if birth_datetime:
-            try:
-                parsed_date, parsed_time = parse_input_time(birth_datetime)
-                birth_date = parsed_date
-                birth_time = parsed_time
-                app.logger.info(f"解析birth_datetime: {birth_datetime} -> {birth_date} {birth_time}")
-            except ValueError as e:
-                return jsonify({
-                    "success": False,
-                    "error": f"时间格式解析错误: {str(e)}",
-                    "supported_formats": [
-                        "2000-08-16 14:30",
-                        "2000/08/16 14:30",
-                        "2000.08.16 14:30"
-                    ],
-                    "request_info": request_info
-                }), 400
+
         
-        # 检查必需参数
-        if not birth_date or not birth_time:
+        # 请求自带的截止时间（秒），排队与计算共用，不超过 ZIWEI_CALL_TIMEOUT
+        try:
+            timeout = parse_timeout(request.headers.get('X-Request-Timeout', requested_timeout), get_pool().call_timeout)
+        except (TypeError, ValueError) as e:
             return jsonify({
                 "success": False,
-                "error": "缺少必需参数：出生日期和时间",
-                "required_parameters": {
-                    "birth_datetime": "完整的出生日期时间，如：2000-08-16 14:30",
-                    "或分别提供": {
-                        "birth_date": "出生日期，如：2000-08-16", 
-                        "birth_time": "出生时间，如：14:30"
-                    },
-                    "gender": "性别，支持：男/女/male/female"
-                },
-                "examples": {
-                    "GET请求": "/calculate?birth_datetime=2000-08-16 14:30&gender=男",
-                    "POST请求": {
-                        "birth_datetime": "2000-08-16 14:30",
-                        "gender": "女"
-                    }
-                },
+                "error": f"timeout参数错误: {e}",
                 "request_info": request_info
             }), 400
+        deadline = Deadline(timeout)
         
-        # 性别标准化处理
-        gender_str = str(gender).strip()
-        original_gender = gender_str
-        
-        if gender_str in ['男', 'male', 'M', 'm', '1']:
-            normalized_gender = 'male'
-        elif gender_str in ['女', 'female', 'F', 'f', '0']:
-            normalized_gender = 'female'
-        else:
-            return jsonify({
-                "success": False,
-                "error": "性别参数错误",
-                "received_gender": repr(gender_str),
-                "supported_values": ["男", "女", "male", "female"],
-                "request_info": request_info
-            }), 400
+        # 参数校验与标准化（与批量接口共用）
+        try:
+            processed_params = validate_calculation_params(birth_datetime, birth_date, birth_time, gender, is_leap,
+                                                           input_options(data if request.method == 'POST' else request.args))
+        except ParamError as e:
+            return jsonify({**e.payload, "request_info": request_info}), 400
+        birth_date = processed_params["birth_date"]
+        birth_time = processed_params["birth_time"]
+        normalized_gender = processed_params["normalized_gender"]
         
-        # 记录处理后的参数
-        processed_params = {
-            "birth_date": birth_date,
-            "birth_time": birth_time,
-            "original_gender": original_gender,
-            "normalized_gender": normalized_gender,
-            "is_leap": is_leap
-        }
+        events.emit('calculate.request', method=request.method, params=processed_params)
         
-        app.logger.info(f"开始计算 - 处理后参数: {processed_params}")
+        # GET请求支持条件请求：命盘由规范键和iztro版本唯一确定，命中时不查缓存也不调用计算引擎
+        # iztro 版本尚不能确定时（预热前且读不到 package.json）不带 ETag，免得版本确定后 ETag 改变
+        etag = None
+        version = iztro_version() if request.method == 'GET' else None
+        if version is not None:
+            try:
+                canonical = canonical_chart_params(birth_date, birth_time, normalized_gender, is_leap)
+                echo_values = (birth_date, birth_time, processed_params["original_gender"], is_leap)
+                # 主题评分随命盘返回，计分规则变化时 ETag 也随之变化
+                etag = make_etag(make_key(*canonical), echo_values, version, f"1.0.1/topics-{SCORING_VERSION}")
+            except ValueError:
+                etag = None
+            matched = not_modified(request.if_none_match, etag) if etag else None
+            if matched:
+                response = Response(status=304)
+                response.set_etag(matched, weak=True)
+                response.headers['Cache-Control'] = PRIVATE_CACHE_CONTROL
+                response.vary.add('Accept-Encoding')
+                return response
         
         # 调用紫微斗数计算
-        result = call_iztro_api(birth_date, birth_time, normalized_gender, is_leap)
-        
-        # 处理计算结果
-        if result.get('success'):
-            response_data = {
-                "success": True,
-                "message": "紫微斗数命盘计算成功",
-                "request_info": request_info,
-                "processed_params": processed_params,
-                "result": result.get('data', {}),
-                "calculation_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "api_version": "1.0.1"
-            }
-            
-            # 如果有summary，也包含进去
-            if 'summary' in result:
-                response_data["summary"] = result['summary']
-            
-            return jsonify(response_data)
-        else:
-            return jsonify({
+        try:
+            chart, echo = prepare_chart(birth_date, birth_time, normalized_gender, is_leap, deadline)
+        except ChartUnavailable as e:
+            result = e.result
+            response = jsonify({
                 "success": False,
                 "message": "紫微斗数计算失败",
                 "error": result.get('error', '未知错误'),
                 "error_type": result.get('error_type', '计算错误'),
                 "request_info": request_info,
                 "processed_params": processed_params,
-                "debug_info": "如需调试，请查看生成的ziwei_calculation.js文件"
-            }), 500
+                "debug_info": "如需调试，请查看服务日志中的Node worker输出"
+            })
+            response.status_code = e.status
+            if e.retry_after is not None:
+                response.headers['Retry-After'] = str(e.retry_after)
+            return response
+        
+        # 命盘部分使用预编码字节，只编码外层的少量请求信息
+        with metrics.timed('encode'):
+            body = splice_object(
+                {
+                    "success": True,
+                    "message": "紫微斗数命盘计算成功",
+                    "request_info": request_info,
+                    "processed_params": processed_params
+                },
+                "result",
+                chart.render(echo),
+                {
+                    "calculation_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "api_version": "1.0.1"
+                }
+            )
+        response = Response(body, mimetype='application/json')
+        if etag:
+            # 响应含处理时间与 processed_params，字节并不稳定，只能给弱 ETag
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = PRIVATE_CACHE_CONTROL
+        return response
             
+    except ComputeDeferred:
+        raise
     except Exception as e:
-        app.logger.error(f"计算接口错误: {str(e)}\n{traceback.format_exc()}")
+        app.logger.exception("计算接口错误: %s", e)
         return jsonify({
             "success": False,
             "message": "服务器内部错误",
@@ -604,38 +845,563 @@ def calculate():
             "traceback": traceback.format_exc() if app.debug else "详细错误信息已记录"
         }), 500
 
+BATCH_CHUNK_SIZE = int(os.environ.get('ZIWEI_BATCH_CHUNK_SIZE', 256))
+BATCH_MAX_ITEMS = int(os.environ.get('ZIWEI_BATCH_MAX_ITEMS', 100000))
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl', 'application/jsonlines')
+
+def iter_ndjson(stream):
+    """逐行解析 NDJSON，解析失败的行以 ParamError 的形式交给调用方"""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            yield ParamError({"success": False, "error": f"NDJSON解析错误: {e}"})
+
+def prepare_batch_item(item):
+    """复用 /calculate 的参数校验，返回 (processed_params, canonical)"""
+    if isinstance(item, ParamError):
+        raise item
+    if not isinstance(item, dict):
+        raise ParamError({"success": False, "error": "批量条目必须是JSON对象"})
+    params = validate_calculation_params(
+        item.get('birth_datetime'),
+        item.get('birth_date'),
+        item.get('birth_time'),
+        item.get('gender', 'male'),
+        item.get('is_leap', False),
+        input_options(item)
+    )
+    try:
+        canonical = canonical_chart_params(params["birth_date"], params["birth_time"],
+                                           params["normalized_gender"], params["is_leap"])
+    except ValueError as e:
+        raise ParamError({"success": False, "error": f"时间格式解析错误: {e}"})
+    return params, canonical
+
+def compute_missing_charts(missing, executor, pool, deadline):
+    """
+    把缓存未命中的规范键分片到进程池中批量计算，每个分片与单次计算一样经过准入控制
+    返回 {canonical: EncodedChart} 与 {canonical: 错误信息}；被拒绝的分片的错误信息带 retry_after
+    executor 为 None 时（合盘两方这样的少量命盘）不分片，在当前线程中一次调用算完
+    守护模式下改用 calculate_batch：守护进程先查共享缓存，算出的命盘也写入共享缓存，其他 worker 不必重算
+    """
+    charts, failures = {}, {}
+    keys = list(missing)
+    shards = [keys[i::pool.size] for i in range(min(pool.size, len(keys)))] if executor is not None else [keys]
+    # 线程池里没有请求的上下文，引擎调试标记在这里读取
+    flags = events.with_engine_debug({})
+    op = 'calculate_batch' if os.environ.get('ZIWEI_ENGINE') == 'daemon' else 'calculate_many'
+    
+    def run(shard):
+        with worker_admit(deadline):
+            if deadline.expired:
+                raise DeadlineExceeded("排队等待超过截止时间")
+            return pool.call(op, {**flags, "items": [missing[k] for k in shard]}, timeout=deadline.remaining())
+    
+    futures = [(shard, executor.submit(run, shard) if executor is not None else None) for shard in shards]
+    for shard, future in futures:
+        try:
+            results = future.result() if future is not None else run(shard)
+        except Overloaded as e:
+            app.logger.warning("计算队列已满: %s", e)
+            failures.update({k: {"error": str(e), "error_type": "Overloaded", "retry_after": e.retry_after}
+                             for k in shard})
+            continue
+        except DeadlineExceeded as e:
+            failures.update({k: {"error": str(e), "error_type": "DeadlineExceeded"} for k in shard})
+            continue
+        except EngineError as e:
+            app.logger.error("批量计算失败: %s", e)
+            failures.update({k: {"error": f"Node.js执行失败: {e}", "error_type": type(e).__name__} for k in shard})
+            continue
+        for canonical, result in zip(shard, results):
+            chart = get_cache().remember(make_key(*canonical), result)
+            if chart is not None:
+                charts[canonical] = chart
+            else:
+                failures[canonical] = {"error": result.get('error', '未知错误'),
+                                       "error_type": result.get('error_type', '计算错误')}
+    return charts, failures
+
+def collect_charts(entries, executor, pool, deadline):
+    """
+    取得 (processed_params, canonical) 对应的命盘，按规范键去重；未命中缓存的一起批量计算
+    返回 {canonical: EncodedChart} 与 {canonical: 错误信息}
+    """
+    charts, missing = {}, {}
+    for params, canonical in entries:
+        if canonical is None or canonical in charts or canonical in missing:
+            continue
+        chart = lookup_chart(canonical)
+        if chart is not None:
+            charts[canonical] = chart
+        else:
+            missing[canonical] = engine_params(canonical, params["birth_date"], params["birth_time"],
+                                               params["original_gender"])
+    
+    failures = {}
+    if missing:
+        computed, failures = compute_missing_charts(missing, executor, pool, deadline)
+        charts.update(computed)
+    return charts, failures
+
+def process_batch_chunk(entries, executor, pool, deadline):
+    """按输入顺序生成一个分块的 NDJSON 行；同一分块内按规范键去重"""
+    charts, failures = collect_charts([(params, canonical) for _, params, canonical, _ in entries],
+                                      executor, pool, deadline)
+    
+    for index, params, canonical, error in entries:
+        if error is not None:
+            yield dumps_json({"index": index, **error}) + b"\n"
+        elif canonical in charts:
+            # 命盘部分直接拼接预编码字节
+            echo = chart_echo(params["birth_date"], params["birth_time"], params["original_gender"])
+            head = {"index": index, "success": True, "processed_params": params}
+            yield splice_object(head, "result", charts[canonical].render(echo)) + b"\n"
+        else:
+            yield dumps_json({"index": index, "success": False, "processed_params": params,
+                              **failures[canonical]}) + b"\n"
+
+@app.route('/calculate/batch', methods=['POST'])
+def calculate_batch():
+    """批量计算接口 - 接收JSON数组或NDJSON，按输入顺序以NDJSON流式返回"""
+    upload = request.files.get('file')
+    if upload is not None:
+        items = iter_ndjson(upload.stream)
+    elif request.mimetype in NDJSON_MIMETYPES:
+        items = iter_ndjson(request.stream)
+    else:
+        data = request.get_json(silent=True)
+        items = data.get('items') if isinstance(data, dict) else data
+        if not isinstance(items, list):
+            return jsonify({
+                "success": False,
+                "error": "批量请求需要提供JSON数组、{\"items\": [...]} 或 NDJSON 数据",
+                "examples": {
+                    "JSON": [{"birth_datetime": "2000-08-16 14:30", "gender": "男"}],
+                    "NDJSON": '{"birth_datetime": "2000-08-16 14:30", "gender": "男"}\\n...'
+                }
+            }), 400
+        if len(items) > BATCH_MAX_ITEMS:
+            return jsonify({
+                "success": False,
+                "error": f"批量条目过多：{len(items)}，上限 {BATCH_MAX_ITEMS}，更大的批量请使用NDJSON上传"
+            }), 413
+    
+    # 截止时间按分块计算：每个分块（排队与计算）不超过 X-Request-Timeout / timeout 参数，默认 ZIWEI_CALL_TIMEOUT
+    try:
+        timeout = parse_timeout(request.headers.get('X-Request-Timeout', request.args.get('timeout')),
+                                get_pool().call_timeout)
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": f"timeout参数错误: {e}"}), 400
+    
+    def generate():
+        pool = get_pool()
+        with ThreadPoolExecutor(max_workers=pool.size) as executor:
+            chunk = []
+            for index, item in enumerate(items):
+                try:
+                    params, canonical = prepare_batch_item(item)
+                    chunk.append((index, params, canonical, None))
+                except ParamError as e:
+                    chunk.append((index, None, None, e.payload))
+                if len(chunk) >= BATCH_CHUNK_SIZE:
+                    yield from process_batch_chunk(chunk, executor, pool, Deadline(timeout))
+                    chunk = []
+            if chunk:
+                yield from process_batch_chunk(chunk, executor, pool, Deadline(timeout))
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# 合盘接口：两张命盘经同一缓存/引擎取得，结果按与顺序无关的配对键缓存
+COMPATIBILITY_MAX_CANDIDATES = int(os.environ.get('ZIWEI_COMPATIBILITY_MAX_CANDIDATES', 1000))
+
+def compatibility_person(data, label):
+    """校验一方的出生信息，返回 (processed_params, canonical)"""
+    if not isinstance(data, dict):
+        raise ParamError({"success": False, "error": f"{label} 需要提供出生信息对象"})
+    return prepare_batch_item(data)
+
+def unavailable_response(error):
+    response = jsonify({**error.result, "success": False})
+    response.status_code = error.status
+    if error.retry_after is not None:
+        response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def chart_failure(failure):
+    """把批量取命盘的错误信息转换为 ChartUnavailable（状态码与 prepare_chart 一致）"""
+    status = {"Overloaded": 503, "DeadlineExceeded": 504, "EngineTimeout": 504}.get(failure["error_type"], 500)
+    result = {"success": False, "error": failure["error"], "error_type": failure["error_type"]}
+    return ChartUnavailable(result, transient=status != 500, status=status, retry_after=failure.get("retry_after"))
+
+def compatibility_pair(person_a, person_b, deadline):
+    """
+    返回合盘结果的 JSON 字节（按请求中 a、b 的顺序）；失败时抛出 ChartUnavailable
+    结果以两方规范键排序后的顺序缓存，顺序相反的请求命中同一条缓存后翻转
+    两方命盘一起查缓存，未命中的在一次 calculate_many 中算出
+    """
+    (params_a, canonical_a), (params_b, canonical_b) = person_a, person_b
+    key_a, key_b = make_key(*canonical_a), make_key(*canonical_b)
+    pair_key = make_pair_key(key_a, key_b, compatibility_version())
+    flipped = key_a > key_b
+    cache = get_cache()
+    raw = cache.get_period(pair_key)
+    if raw is None:
+        with metrics.timed('engine'):
+            charts, failures = collect_charts([person_a, person_b], None, get_pool(), deadline)
+        for canonical in (canonical_a, canonical_b):
+            if canonical not in charts:
+                raise chart_failure(failures[canonical])
+        cores = [charts[canonical_a].core(), charts[canonical_b].core()]
+        with metrics.timed('score'):
+            result = compare(*cores)
+        raw = dumps_json(flip(result) if flipped else result)
+        cache.put_period(pair_key, raw)
+        return dumps_json(result)
+    return dumps_json(flip(loads_json(raw))) if flipped else raw
+
+@app.route('/calculate/compatibility', methods=['POST'])
+def calculate_compatibility():
+    """合盘接口 - {"a", "b"} 两人配对，或 {"a", "candidates": [...]} 一对多"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or ("b" not in data and "candidates" not in data):
+        return jsonify({
+            "success": False,
+            "error": "合盘请求需要提供 a 与 b，或 a 与 candidates",
+            "examples": {
+                "pair": {"a": {"birth_datetime": "2000-08-16 14:30", "gender": "男"},
+                         "b": {"birth_datetime": "1999-03-02 08:10", "gender": "女"}},
+                "one_vs_many": {"a": {"birth_datetime": "2000-08-16 14:30", "gender": "男"},
+                                "candidates": [{"birth_datetime": "1999-03-02 08:10", "gender": "女"}]}
+            }
+        }), 400
+    try:
+        person_a = compatibility_person(data.get("a"), "a")
+        timeout = parse_timeout(request.headers.get('X-Request-Timeout', data.get('timeout')), get_pool().call_timeout)
+    except ParamError as e:
+        return jsonify(e.payload), 400
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": f"timeout参数错误: {e}"}), 400
+    deadline = Deadline(timeout)
+    
+    if "candidates" in data:
+        return compatibility_many(person_a, data["candidates"], deadline)
+    
+    try:
+        person_b = compatibility_person(data.get("b"), "b")
+    except ParamError as e:
+        return jsonify(e.payload), 400
+    try:
+        raw = compatibility_pair(person_a, person_b, deadline)
+    except ChartUnavailable as e:
+        return unavailable_response(e)
+    head = {"success": True, "processed_params": {"a": person_a[0], "b": person_b[0]}}
+    return Response(splice_object(head, "compatibility", raw, {"api_version": "1.0.1"}), mimetype='application/json')
+
+def compatibility_many(person_a, candidates, deadline):
+    """一对多：候选命盘批量取得（未命中的一起计算），所有配对一次向量化计分"""
+    if not isinstance(candidates, list):
+        return jsonify({"success": False, "error": "candidates 必须是数组"}), 400
+    if len(candidates) > COMPATIBILITY_MAX_CANDIDATES:
+        return jsonify({
+            "success": False,
+            "error": f"候选人过多：{len(candidates)}，上限 {COMPATIBILITY_MAX_CANDIDATES}"
+        }), 413
+    
+    params_a, canonical_a = person_a
+    entries = []
+    for index, item in enumerate(candidates):
+        try:
+            entries.append((index,) + compatibility_person(item, f"candidates[{index}]") + (None,))
+        except ParamError as e:
+            entries.append((index, None, None, e.payload))
+    
+    pool = get_pool()
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        # a 与候选命盘一起取得，未命中的在同一批中计算
+        charts, failures = collect_charts([person_a] + [(params, canonical) for _, params, canonical, _ in entries],
+                                          executor, pool, deadline)
+    # 计算队列已满时与单次计算一样回 503，而不是返回一批失败的候选人
+    overloaded = [f for f in failures.values() if f["error_type"] == "Overloaded"]
+    if overloaded:
+        return unavailable_response(ChartUnavailable(
+            {"success": False, "error": overloaded[0]["error"], "error_type": "Overloaded"},
+            transient=True, status=503, retry_after=max(f["retry_after"] for f in overloaded)))
+    if canonical_a not in charts:
+        return unavailable_response(chart_failure(failures[canonical_a]))
+    chart_a = charts[canonical_a]
+    # 同一候选命盘只计分一次
+    unique = list(dict.fromkeys(canonical for _, _, canonical, _ in entries if canonical in charts))
+    with metrics.timed('score'):
+        summaries = dict(zip(unique, compare_many(chart_a, [charts[c] for c in unique])))
+    
+    results = []
+    for index, params, canonical, error in entries:
+        if error is not None:
+            results.append({"index": index, **error})
+        elif canonical in summaries:
+            results.append({"index": index, "success": True, "processed_params": params, **summaries[canonical]})
+        else:
+            results.append({"index": index, "success": False, "processed_params": params, **failures[canonical]})
+    ranking = sorted((r for r in results if r.get("success")), key=lambda r: -r["score"])
+    return Response(dumps_json({
+        "success": True,
+        "processed_params": {"a": params_a},
+        "version": compatibility_version(),
+        "results": results,
+        "ranking": [r["index"] for r in ranking],
+        "api_version": "1.0.1"
+    }), mimetype='application/json')
+
+# 分享令牌：令牌内含算好的命盘（share_token.py），打开分享链接只需解码
+@app.route('/charts', methods=['POST'])
+def create_share_token():
+    """与 /calculate 相同的参数，另可带 note（前端自带的短附注，随令牌原样返回）"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"success": False, "error": "POST请求需要提供JSON数据"}), 400
+    try:
+        params, canonical = prepare_batch_item(data)
+        timeout = parse_timeout(request.headers.get('X-Request-Timeout', data.get('timeout')), get_pool().call_timeout)
+    except ParamError as e:
+        return jsonify(e.payload), 400
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": f"timeout参数错误: {e}"}), 400
+    
+    try:
+        chart, echo = prepare_chart(params["birth_date"], params["birth_time"], params["normalized_gender"],
+                                    params["is_leap"], Deadline(timeout))
+    except ChartUnavailable as e:
+        return unavailable_response(e)
+    try:
+        token = share_token.encode(chart.core(), echo, data.get('note') or '')
+    except ValueError as e:
+        return jsonify({"success": False, "error": f"无法生成分享令牌: {e}"}), 400
+    return jsonify({
+        "success": True,
+        "token": token,
+        "path": f"/charts/{token}",
+        "version": share_token.VERSION,
+        "processed_params": params
+    })
+
+@app.route('/charts/<token>', methods=['GET'])
+def resolve_share_token(token):
+    """解码分享令牌；主题评分按当前规则重新计算，不查缓存也不调用计算引擎"""
+    etag = make_etag(token, (), share_token.VERSION, f"1.0.1/topics-{SCORING_VERSION}")
+    matched = not_modified(request.if_none_match, etag)
+    if matched:
+        response = Response(status=304)
+        response.set_etag(matched)
+        response.headers['Cache-Control'] = CACHE_CONTROL
+        response.vary.add('Accept-Encoding')
+        return response
+    try:
+        core, echo, note = share_token.decode(token)
+    except share_token.ShareTokenError as e:
+        return jsonify({"success": False, "error": f"分享令牌无效: {e}", "error_type": "ShareTokenError"}), 400
+    
+    with metrics.timed('encode'):
+        body = splice_object(
+            {
+                "success": True,
+                "message": "紫微斗数命盘分享",
+                "share": {"version": share_token.VERSION, "note": note}
+            },
+            "result",
+            EncodedChart(core).render(echo),
+            {"api_version": "1.0.1"}
+        )
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    return response
+
+# 运限接口：每块时段一次引擎调用，长时段边算边返回
+HOROSCOPE_CHUNK_SIZE = int(os.environ.get('ZIWEI_HOROSCOPE_CHUNK_SIZE', 120))
+
+def horoscope_engine_call(params, deadline):
+    """运限计算同样经过准入控制，失败时抛出 EngineError / Overloaded / DeadlineExceeded"""
+    with metrics.timed('engine'), worker_admit(deadline):
+        if deadline.expired:
+            raise DeadlineExceeded("排队等待超过截止时间")
+        return get_pool().call('horoscope', events.with_engine_debug(params), timeout=deadline.remaining())
+
+def horoscope_failure(period, error):
+    return {"period": period, "success": False, "error": str(error), "error_type": type(error).__name__}
+
+def iter_horoscope(canonical, scope, periods, deadline):
+    """
+    按时段顺序产生每个运限结果的 JSON 字节
+    每个时段单独缓存；一个分块内未命中的时段在一次引擎调用中算出，本命盘在计算进程中只排一次
+    """
+    cache = get_cache()
+    chart_key = make_key(*canonical)
+    formatted_date, time_chen_index, iztro_gender, is_leap = canonical
+    params = {"date": formatted_date, "hour": time_chen_index, "gender": iztro_gender,
+              "fix_leap": is_leap, "scope": scope}
+    
+    # 大限数量由本命盘决定（最多十二个），整体作为一个缓存项
+    if periods is None:
+        key = make_period_key(chart_key, scope, "all")
+        raw = cache.get_period(key)
+        if raw is None:
+            try:
+                items = horoscope_engine_call(params, deadline)
+            except (EngineError, Overloaded, DeadlineExceeded) as e:
+                yield dumps_json(horoscope_failure(None, e))
+                return
+            if all(item.get("success") for item in items):
+                cache.put_period(key, dumps_json(items))
+        else:
+            items = loads_json(raw)
+        for item in items:
+            yield dumps_json(item)
+        return
+    
+    for chunk in chunked(periods, HOROSCOPE_CHUNK_SIZE):
+        found = {period: cache.get_period(make_period_key(chart_key, scope, period)) for period, _ in chunk}
+        missing = [{"period": period, "date": target} for period, target in chunk if found[period] is None]
+        if missing:
+            try:
+                items = horoscope_engine_call({**params, "targets": missing}, deadline)
+            except (EngineError, Overloaded, DeadlineExceeded) as e:
+                app.logger.error("运限计算失败: %s", e)
+                items = [horoscope_failure(target["period"], e) for target in missing]
+            for item in items:
+                raw = dumps_json(item)
+                if item.get("success"):
+                    cache.put_period(make_period_key(chart_key, scope, item["period"]), raw)
+                found[item["period"]] = raw
+        for period, _ in chunk:
+            yield found[period]
+
+@app.route('/calculate/horoscope', methods=['GET', 'POST'])
+def calculate_horoscope():
+    """运限接口 - 大限/流年/流月，结果按时段顺序流式返回（JSON 或 NDJSON）"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return jsonify({"success": False, "error": "POST请求需要提供JSON对象"}), 400
+        is_leap = data.get('is_leap', False)
+    else:
+        data = request.args
+        is_leap = data.get('is_leap', 'false').lower() == 'true'
+    scope = data.get('scope', 'yearly')
+    
+    try:
+        processed_params = validate_calculation_params(
+            data.get('birth_datetime'), data.get('birth_date'), data.get('birth_time'),
+            data.get('gender', 'male'), is_leap, input_options(data)
+        )
+    except ParamError as e:
+        return jsonify(e.payload), 400
+    try:
+        canonical = canonical_chart_params(processed_params["birth_date"], processed_params["birth_time"],
+                                           processed_params["normalized_gender"], is_leap)
+        periods = plan_periods(scope, data.get('start'), data.get('count'))
+        timeout = parse_timeout(request.headers.get('X-Request-Timeout', data.get('timeout')), get_pool().call_timeout)
+    except (TypeError, ValueError) as e:
+        return jsonify({
+            "success": False,
+            "error": f"运限参数错误: {e}",
+            "parameters": {
+                "scope": "decadal（大限）/ yearly（流年）/ monthly（流月），默认 yearly",
+                "start": "流年起始年份如 2025，流月起始年月如 2025-03，默认当前",
+                "count": "时段数量，流年默认10，流月默认12"
+            }
+        }), 400
+    deadline = Deadline(timeout)
+    items = iter_horoscope(canonical, scope, periods, deadline)
+    
+    if data.get('format') == 'ndjson' or request.accept_mimetypes.best in NDJSON_MIMETYPES:
+        def generate_ndjson():
+            for raw in items:
+                yield raw + b"\n"
+        return Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+    
+    # JSON 同样逐块输出：先写外层字段，再逐个写出时段
+    def generate_json():
+        head = dumps_json({
+            "success": True,
+            "scope": scope,
+            "count": len(periods) if periods is not None else None,
+            "processed_params": processed_params
+        })
+        yield head[:-1] + b',"periods":['
+        for position, raw in enumerate(items):
+            yield (b',' if position else b'') + raw
+        yield b'],"api_version":"1.0.1"}'
+    return Response(stream_with_context(generate_json()), mimetype='application/json')
+
+@app.route('/analytics', methods=['GET'])
+def analytics_info():
+    """分析库信息：日期范围、行数、可分组的列与字典"""
+    store = get_analytics()
+    if store is None:
+        return jsonify({"success": False, "error": "分析库未配置（ZIWEI_ANALYTICS_STORE）"}), 503
+    return jsonify({"success": True, **store.info()})
+
+@app.route('/analytics/aggregate', methods=['POST'])
+def analytics_aggregate():
+    """人群聚合查询 - 在列式分析库上做向量化筛选与分组计数"""
+    store = get_analytics()
+    if store is None:
+        return jsonify({"success": False, "error": "分析库未配置（ZIWEI_ANALYTICS_STORE）"}), 503
+    query = request.get_json(silent=True)
+    try:
+        result = store.aggregate(query)
+    except QueryError as e:
+        return jsonify({
+            "success": False,
+            "error": f"查询参数错误: {e}",
+            "example": {
+                "filter": {"start": "1990-01-01", "end": "1995-12-31"},
+                "match": {"stars": [{"star": "紫微", "palace": "命宫"}]},
+                "group_by": ["gender"]
+            }
+        }), 400
+    return Response(dumps_json({"success": True, **result}), mimetype='application/json')
+
 @app.route('/health', methods=['GET'])
 def health():
-    """健康检查 - 增强版"""
+    """健康检查（存活） - 只读取后台刷新的状态，不调用计算引擎"""
     try:
-        # 检查iztro是否可用
-        result = subprocess.run([
-            'node', '-e', 'console.log(JSON.stringify({version: require("iztro/package.json").version, astro: typeof require("iztro").astro}))'
-        ], capture_output=True, text=True, timeout=10)
-        
-        iztro_status = "已安装" if result.returncode == 0 else "未安装"
-        iztro_info = {}
-        
-        if result.returncode == 0:
-            try:
-                iztro_info = json.loads(result.stdout.strip())
-            except:
-                iztro_info = {"version": "解析失败"}
+        pool = get_pool()
+        monitor = get_monitor()
+        iztro_info = monitor.info.get("iztro") or {}
         
         return jsonify({
             "status": "healthy",
+            "ready": monitor.ready,
             "service": "紫微斗数API",
             "api_version": "1.0.1",
             "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             "dependencies": {
                 "iztro": {
-                    "status": iztro_status,
+                    "status": "已安装" if iztro_info else "未知",
                     "version": iztro_info.get('version', '未知'),
                     "astro_available": iztro_info.get('astro') == 'object'
                 },
-                "nodejs": "已安装",
+                "nodejs": "已安装" if shutil.which('node') else "未安装（命盘全部来自命盘库）",
                 "python": sys.version
             },
+            "health_check": monitor.snapshot(),
+            "engine_pool": {
+                "size": pool.size,
+                "max_calls": pool.max_calls,
+                "call_timeout": pool.call_timeout,
+                "stats": dict(pool.stats)
+            },
+            "chart_cache": get_cache().snapshot(),
+            "compute_daemon": monitor.info.get("compute_daemon"),
+            "chart_store": get_store().info() if get_store() is not None else None,
+            "single_flight": get_flights().snapshot(),
+            "admission": get_admission().snapshot(),
             "environment": {
                 "working_directory": os.getcwd(),
                 "python_version": sys.version,
@@ -656,22 +1422,95 @@ def health():
             "service": "紫微斗数API"
         }), 500
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    """就绪检查 - 计算引擎预热、缓存预载完成且最近一次后台检查成功时返回 200，否则 503"""
+    monitor = get_monitor()
+    return jsonify({
+        "ready": monitor.ready,
+        "health_check": monitor.snapshot(),
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }), 200 if monitor.ready else 503
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus 指标：分阶段耗时直方图与缓存/进程池状态（每个进程各自统计）"""
+    pool = get_pool()
+    cache = get_cache().snapshot()
+    flights = get_flights().snapshot()
+    admission = get_admission().snapshot()
+    monitor = get_monitor()
+    last_compute = monitor.last_compute
+    gauges = [
+        ("ziwei_ready", "1 once the engine is warm, the cache preloaded and the last health check passed.", int(monitor.ready)),
+        ("ziwei_health_check_compute_seconds", "Latency of the last successful health-check compute.",
+         last_compute["latency_ms"] / 1000 if last_compute else None),
+        ("ziwei_engine_pool_size", "Node.js engine processes per worker.", pool.size),
+        ("ziwei_chart_cache_memory_entries", "Charts held in the in-process LRU.", cache["memory_entries"]),
+        ("ziwei_chart_cache_memory_capacity", "Capacity of the in-process LRU.", cache["memory_capacity"]),
+        ("ziwei_single_flight_in_flight", "Distinct chart keys currently being computed.", flights["in_flight"]),
+        ("ziwei_admission_active", "Computations holding an admission slot.", admission["active"]),
+        ("ziwei_admission_waiting", "Computations waiting in the admission queue.", admission["waiting"]),
+    ]
+    counters = [
+        ("ziwei_engine_calls_total", "Engine calls.", pool.stats["calls"]),
+        ("ziwei_engine_timeouts_total", "Engine calls that hit their deadline.", pool.stats["timeouts"]),
+        ("ziwei_engine_crashes_total", "Engine processes that exited unexpectedly.", pool.stats["crashes"]),
+        ("ziwei_engine_recycled_total", "Engine processes recycled by call count or RSS.", pool.stats["recycled"]),
+        ("ziwei_chart_cache_memory_hits_total", "Chart cache memory tier hits.", cache["memory_hits"]),
+        ("ziwei_chart_cache_disk_hits_total", "Chart cache disk tier hits.", cache["disk_hits"]),
+        ("ziwei_chart_cache_misses_total", "Chart cache misses.", cache["misses"]),
+        ("ziwei_chart_cache_evictions_total", "Chart cache LRU evictions.", cache["evictions"]),
+        ("ziwei_chart_cache_disk_errors_total", "Chart cache disk tier errors.", cache["disk_errors"]),
+        ("ziwei_single_flight_followers_total", "Requests that waited on an identical in-flight computation.", flights["followers"]),
+        ("ziwei_admission_rejected_total", "Computations rejected because the queue was full.", admission["rejected"]),
+        ("ziwei_admission_expired_total", "Computations whose deadline passed while queued.", admission["expired"]),
+        ("ziwei_health_check_failures_total", "Background health checks that failed.", monitor.stats["failures"]),
+        ("ziwei_log_events_sampled_out_total", "Log events skipped by per-event sampling.", events.stats["sampled_out"]),
+        ("ziwei_log_records_dropped_total", "Log records dropped because the log queue was full.", events.stats["dropped"]),
+    ]
+    return Response(metrics.render(gauges, counters), mimetype='text/plain; version=0.0.4')
+
 # 添加CORS支持
+@app.before_request
+def before_request():
+    metrics.begin_request()
+    events.begin_request(request.headers.get(events.DEBUG_HEADER))
+    get_monitor()
+
 @app.after_request
 def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,If-None-Match,X-Request-Timeout,X-Ziwei-Debug')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
+    response.headers.add('Access-Control-Expose-Headers', 'ETag,Server-Timing,Retry-After')
+    # 分阶段耗时（after_request 逆序执行，此时压缩已完成）
+    server_timing = metrics.server_timing()
+    if server_timing:
+        response.headers['Server-Timing'] = server_timing
+        response.headers['Timing-Allow-Origin'] = '*'
     return response
 
+# 按Accept-Encoding压缩JSON响应
+@app.after_request
+def compress_after_request(response):
+    with metrics.timed('compress'):
+        return compress_response(response, request.accept_encodings)
+
 # 错误处理
+@app.errorhandler(ComputeDeferred)
+def compute_deferred(error):
+    # 交给 asgi.py 异步计算，这个占位响应不会发给客户端
+    request.environ[DEFERRED] = error
+    return Response(status=202)
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({
         "success": False,
         "error": "接口不存在",
         "message": "请检查请求路径是否正确",
-        "available_endpoints": ["/", "/health", "/test", "/ping", "/calculate", "/debug"],
+        "available_endpoints": ["/", "/health", "/ready", "/metrics", "/analytics", "/analytics/aggregate", "/test", "/ping", "/calculate", "/calculate/batch", "/calculate/horoscope", "/calculate/compatibility", "/charts", "/debug"],
         "documentation": "访问根路径 / 查看完整API文档",
         "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     }), 404
@@ -0,0 +1,37 @@
+// 一次性 iztro 计算脚本（ZIWEI_ENGINE=spawn 时使用）
+// 固定文件，不再为每次请求生成 JS 源码；请求来自 argv[2]（JSON 文本）或 stdin（一个请求帧）：
+//   node iztro_calculate.js '{"op": "calculate", "params": {...}}'
+// 响应以一个帧写出（见 wire.js），格式与常驻 worker 相同（含 params.debug 时的 diagnostics）。
+const fs = require('fs');
+
+const { writeFrame, decodeFrame, withDiagnostics } = require('./wire');
+const { handlers } = require('./iztro_chart');
+
+function main() {
+    let request;
+    try {
+        request = JSON.parse(process.argv[2] || decodeFrame(fs.readFileSync(0)));
+    } catch (error) {
+        return { ok: false, error: `请求解析失败: ${error.message}`, error_type: 'ProtocolError' };
+    }
+
+    const handler = handlers[request.op];
+    if (!handler) {
+        return { ok: false, error: `未知操作: ${request.op}`, error_type: 'ProtocolError' };
+    }
+
+    const params = request.params || {};
+    const [result, diagnostics] = withDiagnostics(params.debug, () => {
+        try {
+            return handler(params);
+        } catch (error) {
+            return { success: false, error: error.message, error_type: error.constructor.name, stack: error.stack };
+        }
+    });
+    return { ok: true, result, diagnostics };
+}
+
+const started = process.hrtime.bigint();
+const response = main();
+response.compute_ms = Number(process.hrtime.bigint() - started) / 1e6;
+writeFrame(response);
@@ -0,0 +1,174 @@
+// iztro 加载与命盘格式化，常驻 worker 与一次性脚本共用
+const compileCache = require('./compile_cache');
+
+// ZIWEI_IZTRO_MODULE 可指向替身模块（例如 bench/stub_iztro），用于离线基准测试
+const IZTRO_MODULE = process.env.ZIWEI_IZTRO_MODULE || 'iztro';
+
+let iztro;
+try {
+    iztro = require(IZTRO_MODULE);
+} catch (e1) {
+    try {
+        iztro = require('./node_modules/iztro');
+    } catch (e2) {
+        console.error('❌ 所有加载方式都失败了');
+        console.error('直接加载错误:', e1.message);
+        console.error('相对路径错误:', e2.message);
+        process.exit(1);
+    }
+}
+
+if (!iztro.astro) {
+    console.error('❌ iztro.astro 不存在');
+    console.error('iztro对象属性:', Object.keys(iztro));
+    process.exit(1);
+}
+
+let iztroVersion = '未知';
+try {
+    iztroVersion = require(`${IZTRO_MODULE}/package.json`).version;
+} catch (e) {
+    console.error('无法读取iztro版本:', e.message);
+}
+
+function calculate(params) {
+    const { date, hour, gender, fix_leap: fixLeap, birth_date: birthDate, birth_time: birthTime, raw_gender: rawGender } = params;
+
+    const astrolabe = iztro.astro.bySolar(
+        date,                    // 阳历日期字符串
+        hour,                    // 时辰索引 0-11
+        gender,                  // 性别 "男"/"女"
+        fixLeap,                 // 是否修正闰年
+        'zh-CN'                  // 语言
+    );
+
+    return {
+        success: true,
+        data: {
+            basic_info: {
+                birth_date: birthDate,
+                birth_time: birthTime,
+                gender: rawGender,
+                solar_date: astrolabe.solarDate || '未知',
+                lunar_date: astrolabe.lunarDate || '未知',
+                time_chen: astrolabe.time || '未知',
+                time_range: astrolabe.timeRange || '未知',
+                sign: astrolabe.sign || '未知',
+                zodiac: astrolabe.zodiac || '未知',
+                five_elements_class: astrolabe.fiveElementsClass || '未知',
+                soul: astrolabe.soul || '未知',
+                body: astrolabe.body || '未知'
+            },
+            palaces: astrolabe.palaces ? astrolabe.palaces.map(palace => ({
+                name: palace.name || '未知',
+                earthly_branch: palace.earthlyBranch || '未知',
+                heavenly_stem: palace.heavenlyStem || '未知',
+                major_stars: palace.majorStars ? palace.majorStars.map(star => ({
+                    name: star.name || '未知',
+                    brightness: star.brightness || '',
+                    mutagen: star.mutagen || ''
+                })) : [],
+                minor_stars: palace.minorStars ? palace.minorStars.map(star => ({
+                    name: star.name || '未知',
+                    mutagen: star.mutagen || ''
+                })) : [],
+                adjective_stars_count: palace.adjectiveStars ? palace.adjectiveStars.length : 0
+            })) : [],
+            summary: {
+                description: `${astrolabe.solarDate || date}出生，农历${astrolabe.lunarDate || '未知'}`,
+                time_info: `${astrolabe.time || '未知'} (${astrolabe.timeRange || '未知'})`,
+                soul_palace: astrolabe.earthlyBranchOfSoulPalace || '未知',
+                body_palace: astrolabe.earthlyBranchOfBodyPalace || '未知',
+                calculation_time: new Date().toISOString()
+            }
+        }
+    };
+}
+
+// 批量计算：单个条目失败不影响其他条目
+function calculateMany(params) {
+    return (params.items || []).map((item) => {
+        try {
+            return calculate(item);
+        } catch (error) {
+            return { success: false, error: error.message, error_type: error.constructor.name };
+        }
+    });
+}
+
+// 本命盘缓存：同一命盘的多次运限查询直接复用排好的盘，不必重新排盘
+const ASTROLABE_CACHE_SIZE = 256;
+const astrolabes = new Map();
+
+function natalAstrolabe({ date, hour, gender, fix_leap: fixLeap }) {
+    const key = `${date}|${hour}|${gender}|${fixLeap ? 1 : 0}`;
+    let astrolabe = astrolabes.get(key);
+    if (astrolabe) {
+        astrolabes.delete(key);
+    } else {
+        astrolabe = iztro.astro.bySolar(date, hour, gender, fixLeap, 'zh-CN');
+    }
+    astrolabes.set(key, astrolabe);
+    if (astrolabes.size > ASTROLABE_CACHE_SIZE) {
+        astrolabes.delete(astrolabes.keys().next().value);
+    }
+    return astrolabe;
+}
+
+function formatHoroscopeItem(item) {
+    return {
+        index: item.index,
+        name: item.name || '',
+        heavenly_stem: item.heavenlyStem || '',
+        earthly_branch: item.earthlyBranch || '',
+        palace_names: item.palaceNames || [],
+        mutagen: item.mutagen || [],
+        // 流耀按宫位排列，只保留星名
+        stars: (item.stars || []).map(stars => (stars || []).map(star => star.name))
+    };
+}
+
+function horoscopeAt(astrolabe, period, date, hour, scope, extra) {
+    try {
+        const result = astrolabe.horoscope(date, hour);
+        const item = { period, success: true, solar_date: result.solarDate, lunar_date: result.lunarDate, ...extra };
+        Object.assign(item, formatHoroscopeItem(result[scope]));
+        if (scope === 'yearly' && result.age) {
+            item.nominal_age = result.age.nominalAge;
+        }
+        return item;
+    } catch (error) {
+        return { period, success: false, error: error.message, error_type: error.constructor.name };
+    }
+}
+
+// 运限：一次调用算出多个时段，本命盘只排一次
+//   scope = decadal：按本命盘各宫的大限岁数区间逐个计算，不需要 targets
+//   scope = yearly / monthly：targets = [{period, date}]，date 为该时段内的阳历日期
+function horoscope(params) {
+    const { scope, hour } = params;
+    const astrolabe = natalAstrolabe(params);
+
+    if (scope === 'decadal') {
+        const birthYear = Number(String(astrolabe.solarDate || params.date).split('-')[0]);
+        return (astrolabe.palaces || [])
+            .filter(palace => palace.decadal && palace.decadal.range)
+            .sort((a, b) => a.decadal.range[0] - b.decadal.range[0])
+            .map(palace => {
+                const [start, end] = palace.decadal.range;
+                // 虚岁 start 岁所在年份的年中
+                return horoscopeAt(astrolabe, `${start}-${end}`, `${birthYear + start - 1}-7-1`, hour, scope, { range: [start, end] });
+            });
+    }
+
+    return (params.targets || []).map(({ period, date }) => horoscopeAt(astrolabe, period, date, hour, scope));
+}
+
+const handlers = {
+    calculate,
+    calculate_many: calculateMany,
+    horoscope,
+    version: () => ({ version: iztroVersion, astro: typeof iztro.astro, compile_cache: compileCache.mode })
+};
+
+module.exports = { iztro, iztroVersion, handlers };
@@ -0,0 +1,50 @@
+// 常驻 iztro 计算进程
+// 启动时只加载一次 iztro，之后从 stdin 读取请求帧，把响应帧写到专用 fd（见 wire.js）。
+// 请求: {"id": 1, "op": "calculate", "params": {...}}
+// 响应: {"id": 1, "ok": true, "result": {...}, "rss": 12345678, "compute_ms": 1.23}
+// 协议通道只传帧；params.debug 为真时响应另带 "diagnostics": [该次调用的 console 输出]。
+const { writeFrame, readFrames, withDiagnostics } = require('./wire');
+const { handlers } = require('./iztro_chart');
+
+function reply(message, started) {
+    message.rss = process.memoryUsage().rss;
+    if (started !== undefined) {
+        message.compute_ms = Number(process.hrtime.bigint() - started) / 1e6;
+    }
+    writeFrame(message);
+}
+
+readFrames(process.stdin, (body) => {
+    let request;
+    try {
+        request = JSON.parse(body);
+    } catch (error) {
+        reply({ id: null, ok: false, error: `请求解析失败: ${error.message}`, error_type: 'ProtocolError' });
+        return;
+    }
+
+    const handler = handlers[request.op];
+    if (!handler) {
+        reply({ id: request.id, ok: false, error: `未知操作: ${request.op}`, error_type: 'ProtocolError' });
+        return;
+    }
+
+    const params = request.params || {};
+    const started = process.hrtime.bigint();
+    const [result, diagnostics] = withDiagnostics(params.debug, () => {
+        try {
+            return handler(params);
+        } catch (error) {
+            // 计算错误连同 stack 随结果返回，不写到 stderr
+            return {
+                success: false,
+                error: error.message,
+                error_type: error.constructor.name,
+                stack: error.stack
+            };
+        }
+    });
+    reply({ id: request.id, ok: true, result, diagnostics }, started);
+});
+
+process.stdin.on('end', () => process.exit(0));
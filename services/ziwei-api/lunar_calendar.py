@@ -0,0 +1,123 @@
+"""农历 ↔ 公历换算（1900–2100）
+
+按农历输入的出生日期先换算为公历，再走与公历输入相同的规范键，
+同一出生时间无论以农历还是公历输入都命中同一条缓存，不会各自调用一次计算引擎。
+
+换算索引在模块载入时由 LUNAR_INFO 一次性建好：
+- 农历 → 公历：(年, 月, 是否闰月) -> 该月初一的公历序数与天数，查一次字典
+- 公历 → 农历：自农历 1900 年正月初一起每一天所属农历月的编号（array），下标即日序
+两个方向都是 O(1)。
+"""
+import re
+from array import array
+from datetime import date
+
+# 1900–2100 每年的农历月份信息：
+#   低 4 位        闰几月（0 为无闰月）
+#   第 4–15 位     正月到十二月的大小（第 15 位为正月，1 为大月 30 天，0 为小月 29 天）
+#   第 16 位       闰月的大小
+LUNAR_INFO = (
+    0x04bd8, 0x04ae0, 0x0a570, 0x054d5, 0x0d260, 0x0d950, 0x16554, 0x056a0, 0x09ad0, 0x055d2,  # 1900
+    0x04ae0, 0x0a5b6, 0x0a4d0, 0x0d250, 0x1d255, 0x0b540, 0x0d6a0, 0x0ada2, 0x095b0, 0x14977,  # 1910
+    0x04970, 0x0a4b0, 0x0b4b5, 0x06a50, 0x06d40, 0x1ab54, 0x02b60, 0x09570, 0x052f2, 0x04970,  # 1920
+    0x06566, 0x0d4a0, 0x0ea50, 0x16a95, 0x05ad0, 0x02b60, 0x186e3, 0x092e0, 0x1c8d7, 0x0c950,  # 1930
+    0x0d4a0, 0x1d8a6, 0x0b550, 0x056a0, 0x1a5b4, 0x025d0, 0x092d0, 0x0d2b2, 0x0a950, 0x0b557,  # 1940
+    0x06ca0, 0x0b550, 0x15355, 0x04da0, 0x0a5b0, 0x14573, 0x052b0, 0x0a9a8, 0x0e950, 0x06aa0,  # 1950
+    0x0aea6, 0x0ab50, 0x04b60, 0x0aae4, 0x0a570, 0x05260, 0x0f263, 0x0d950, 0x05b57, 0x056a0,  # 1960
+    0x096d0, 0x04dd5, 0x04ad0, 0x0a4d0, 0x0d4d4, 0x0d250, 0x0d558, 0x0b540, 0x0b6a0, 0x195a6,  # 1970
+    0x095b0, 0x049b0, 0x0a974, 0x0a4b0, 0x0b27a, 0x06a50, 0x06d40, 0x0af46, 0x0ab60, 0x09570,  # 1980
+    0x04af5, 0x04970, 0x064b0, 0x074a3, 0x0ea50, 0x06b58, 0x05ac0, 0x0ab60, 0x096d5, 0x092e0,  # 1990
+    0x0c960, 0x0d954, 0x0d4a0, 0x0da50, 0x07552, 0x056a0, 0x0abb7, 0x025d0, 0x092d0, 0x0cab5,  # 2000
+    0x0a950, 0x0b4a0, 0x0baa4, 0x0ad50, 0x055d9, 0x04ba0, 0x0a5b0, 0x15176, 0x052b0, 0x0a930,  # 2010
+    0x07954, 0x06aa0, 0x0ad50, 0x05b52, 0x04b60, 0x0a6e6, 0x0a4e0, 0x0d260, 0x0ea65, 0x0d530,  # 2020
+    0x05aa0, 0x076a3, 0x096d0, 0x04afb, 0x04ad0, 0x0a4d0, 0x1d0b6, 0x0d250, 0x0d520, 0x0dd45,  # 2030
+    0x0b5a0, 0x056d0, 0x055b2, 0x049b0, 0x0a577, 0x0a4b0, 0x0aa50, 0x1b255, 0x06d20, 0x0ada0,  # 2040
+    0x14b63, 0x09370, 0x049f8, 0x04970, 0x064b0, 0x168a6, 0x0ea50, 0x06b20, 0x1a6c4, 0x0aae0,  # 2050
+    0x0a2e0, 0x0d2e3, 0x0c960, 0x0d557, 0x0d4a0, 0x0da50, 0x05d55, 0x056a0, 0x0a6d0, 0x055d4,  # 2060
+    0x052d0, 0x0a9b8, 0x0a950, 0x0b4a0, 0x0b6a6, 0x0ad50, 0x055a0, 0x0aba4, 0x0a5b0, 0x052b0,  # 2070
+    0x0b273, 0x06930, 0x07337, 0x06aa0, 0x0ad50, 0x14b55, 0x04b60, 0x0a570, 0x054e4, 0x0d160,  # 2080
+    0x0e968, 0x0d520, 0x0daa0, 0x16aa6, 0x056d0, 0x04ae0, 0x0a9d4, 0x0a2d0, 0x0d150, 0x0f252,  # 2090
+    0x0d520,                                                                                    # 2100
+)
+FIRST_YEAR = 1900
+LAST_YEAR = FIRST_YEAR + len(LUNAR_INFO) - 1
+# 农历 1900 年正月初一
+EPOCH = date(1900, 1, 31).toordinal()
+
+
+def _year_months(info):
+    """一年中按顺序排列的 (月, 是否闰月, 天数)"""
+    leap = info & 0xf
+    for month in range(1, 13):
+        yield month, False, 30 if info & (0x10000 >> month) else 29
+        if month == leap:
+            yield month, True, 30 if info & 0x10000 else 29
+
+
+def _build():
+    months = []        # 编号 -> (年, 月, 是否闰月, 初一的公历序数)
+    starts = {}        # (年, 月, 是否闰月) -> (初一的公历序数, 天数)
+    day_month = array('H')
+    ordinal = EPOCH
+    for offset, info in enumerate(LUNAR_INFO):
+        year = FIRST_YEAR + offset
+        for month, is_leap, days in _year_months(info):
+            starts[(year, month, is_leap)] = (ordinal, days)
+            day_month.extend(array('H', [len(months)]) * days)
+            months.append((year, month, is_leap, ordinal))
+            ordinal += days
+    return months, starts, day_month, ordinal
+
+
+_MONTHS, _STARTS, _DAY_MONTH, _END = _build()
+FIRST_DATE = date.fromordinal(EPOCH)
+LAST_DATE = date.fromordinal(_END - 1)
+
+
+def leap_month(year):
+    """该农历年闰几月，没有闰月返回 0"""
+    if not FIRST_YEAR <= year <= LAST_YEAR:
+        raise ValueError(f"农历年份超出范围 {FIRST_YEAR}–{LAST_YEAR}: {year}")
+    return LUNAR_INFO[year - FIRST_YEAR] & 0xf
+
+
+def to_solar(year, month, day, is_leap_month=False):
+    """农历 -> 公历 date；日期不存在时抛出 ValueError"""
+    entry = _STARTS.get((year, month, bool(is_leap_month)))
+    if entry is None:
+        if not FIRST_YEAR <= year <= LAST_YEAR:
+            raise ValueError(f"农历年份超出范围 {FIRST_YEAR}–{LAST_YEAR}: {year}")
+        if not 1 <= month <= 12:
+            raise ValueError(f"农历月份无效: {month}")
+        leap = leap_month(year)
+        raise ValueError(f"农历{year}年没有闰{month}月" + (f"（该年闰{leap}月）" if leap else "（该年无闰月）"))
+    start, days = entry
+    if not 1 <= day <= days:
+        raise ValueError(f"农历{year}年{'闰' if is_leap_month else ''}{month}月只有{days}天")
+    return date.fromordinal(start + day - 1)
+
+
+def to_lunar(solar):
+    """公历 date -> (年, 月, 日, 是否闰月)"""
+    offset = solar.toordinal() - EPOCH
+    if not 0 <= offset < len(_DAY_MONTH):
+        raise ValueError(f"公历日期超出范围 {FIRST_DATE}–{LAST_DATE}: {solar}")
+    year, month, is_leap, start = _MONTHS[_DAY_MONTH[offset]]
+    return year, month, solar.toordinal() - start + 1, is_leap
+
+
+_LUNAR_INPUT = re.compile(r'^(\d{4})[-/.年](\d{1,2})[-/.月](\d{1,2})日?(?:\s+(\d{1,2}):(\d{2}))?$')
+
+
+def parse_lunar(text):
+    """解析农历日期（可带时间）：1990-04-11、1990/4/11 08:30、1990年4月11日；返回 (年, 月, 日, "HH:MM" 或 None)"""
+    match = _LUNAR_INPUT.match(str(text).strip())
+    if not match:
+        raise ValueError(f"无法解析农历日期: {text}")
+    year, month, day, hour, minute = match.groups()
+    birth_time = None
+    if hour is not None:
+        if int(hour) > 23 or int(minute) > 59:
+            raise ValueError(f"时间无效: {hour}:{minute}")
+        birth_time = f"{int(hour):02d}:{minute}"
+    return int(year), int(month), int(day), birth_time
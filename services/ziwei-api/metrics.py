@@ -0,0 +1,126 @@
+"""请求分阶段耗时统计
+
+每个阶段的耗时同时进入两处：
+- 进程内直方图，由 /metrics 以 Prometheus 文本格式输出
+- 当前请求的耗时列表，由 after_request 写成 Server-Timing 响应头
+
+阶段：
+    parse     解析出生时间（parse_input_time）
+    gender    性别标准化
+    cache     查找命盘（内存缓存 → 命盘库 → 磁盘缓存）
+    engine    请求视角下的整次引擎调用（含排队、合并等待）
+    queue     等待空闲计算进程
+    dispatch  发送请求到收到响应帧，扣除 iztro 计算本身（进程启动、IPC 往返）
+    compute   iztro 计算（由 Node 进程自己计时）
+    decode    解码响应帧
+    score     合盘计分（compatibility.py）
+    encode    编码响应正文
+    compress  压缩响应正文
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# 秒
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+STAGES = ('parse', 'gender', 'cache', 'engine', 'queue', 'dispatch', 'compute', 'decode', 'score', 'encode', 'compress')
+
+# 当前请求的 [(阶段, 秒)]；请求之外为 None
+_timings = contextvars.ContextVar('ziwei_timings', default=None)
+
+
+class Histogram:
+    """累积直方图（Prometheus 语义：每个桶计数包含所有更小的观测值）"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative, running = [], 0
+        for bound, n in zip(self.buckets + (float('inf'),), counts):
+            running += n
+            cumulative.append((bound, running))
+        return cumulative, total, count
+
+
+_histograms = {stage: Histogram() for stage in STAGES}
+
+
+def begin_request():
+    """开始收集当前请求的阶段耗时"""
+    _timings.set([])
+
+
+def record(stage, seconds):
+    _histograms[stage].observe(seconds)
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+def server_timing():
+    """当前请求的 Server-Timing 头（同一阶段多次出现时合并），没有记录时返回 None"""
+    timings = _timings.get()
+    if not timings:
+        return None
+    totals = {}
+    for stage, seconds in timings:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ', '.join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in totals.items())
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(gauges=(), counters=()):
+    """
+    输出 Prometheus 文本格式
+    gauges / counters: [(指标名, 说明, 值)]，值为 None 的指标跳过
+    """
+    lines = [
+        '# HELP ziwei_stage_duration_seconds Per-stage request latency.',
+        '# TYPE ziwei_stage_duration_seconds histogram',
+    ]
+    for stage in STAGES:
+        cumulative, total, count = _histograms[stage].snapshot()
+        for bound, n in cumulative:
+            lines.append(f'ziwei_stage_duration_seconds_bucket{{stage="{stage}",le="{_format_value(bound)}"}} {n}')
+        lines.append(f'ziwei_stage_duration_seconds_sum{{stage="{stage}"}} {_format_value(total)}')
+        lines.append(f'ziwei_stage_duration_seconds_count{{stage="{stage}"}} {count}')
+
+    for kind, metrics in (('gauge', gauges), ('counter', counters)):
+        for name, help_text, value in metrics:
+            if value is None:
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
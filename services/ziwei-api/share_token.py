@@ -0,0 +1,377 @@
+"""命盘分享令牌
+
+把算好的命盘（iztro_chart.js 的输出，不含主题评分）连同回显字段编码成一个短令牌，
+打开分享链接时只需解码（GET /charts/<令牌>），不经过缓存与计算引擎。
+
+令牌 = base64url（无填充）：
+    版本   uint8   （VERSION；词表随版本固定，变更词表必须递增版本）
+    标志   uint8   bit0 正文经 raw deflate 压缩（只在更短时使用）
+    正文           按位写出的命盘 + 附注的 UTF-8 字节
+    校验   uint16  版本、标志与正文的 CRC32 低 16 位，用于发现截断或抄错的链接
+
+正文按位编码：
+    词        8 位词表序号（WORDS：宫位、星曜、五行局、生肖、星座、时辰等）；255 之后跟一段文本
+    天干/地支  4 位序号；15 之后跟一个词
+    星曜      词 + 亮度 4 位（15 之后跟一个词）+ 四化 3 位（7 之后跟一个词）
+    文本      8 位长度 + 每字 6 位字表序号（TEXT_CHARS）；63 之后跟 21 位码点
+    数量      固定位数；全 1 之后跟 8 位余数
+描述与时辰说明由其他字段拼成时只记 1 位。
+附注是调用方自带的短字符串（最多 255 字节，例如前端的姓名与地点），原样返回、服务端不解析。
+
+用法：
+    python share_token.py decode <令牌>
+"""
+import argparse
+import base64
+import json
+import sys
+import zlib
+
+from chart_store import BASIC_FIELDS
+
+VERSION = 1
+FLAG_DEFLATE = 0x01
+
+MAX_TOKEN_LENGTH = 2048
+MAX_BODY_SIZE = 8192
+MAX_NOTE_BYTES = 255
+
+STEMS = ('甲', '乙', '丙', '丁', '戊', '己', '庚', '辛', '壬', '癸')
+BRANCHES = ('子', '丑', '寅', '卯', '辰', '巳', '午', '未', '申', '酉', '戌', '亥')
+BRIGHTNESS = ('', '庙', '旺', '得', '利', '平', '不', '陷')
+MUTAGENS = ('', '禄', '权', '科', '忌')
+
+# 版本 1 的词表（顺序即编码，只能在新版本中修改）
+WORDS = (
+    '', '未知', 'male', 'female', '男', '女',
+    '命宫', '兄弟', '夫妻', '子女', '财帛', '疾厄', '迁移', '仆役', '交友', '官禄', '田宅', '福德', '父母',
+    '紫微', '天机', '太阳', '武曲', '天同', '廉贞', '天府', '太阴', '贪狼', '巨门', '天相', '天梁', '七杀', '破军',
+    '左辅', '右弼', '文昌', '文曲', '天魁', '天钺', '禄存', '天马', '擎羊', '陀罗', '火星', '铃星', '地空', '地劫',
+    '水二局', '木三局', '金四局', '土五局', '火六局',
+    '鼠', '牛', '虎', '兔', '龙', '蛇', '马', '羊', '猴', '鸡', '狗', '猪',
+    '白羊座', '金牛座', '双子座', '巨蟹座', '狮子座', '处女座', '天秤座', '天蝎座', '射手座', '摩羯座', '水瓶座', '双鱼座',
+    '早子时', '丑时', '寅时', '卯时', '辰时', '巳时', '午时', '未时', '申时', '酉时', '戌时', '亥时', '晚子时',
+    '00:00~01:00', '01:00~03:00', '03:00~05:00', '05:00~07:00', '07:00~09:00', '09:00~11:00', '11:00~13:00',
+    '13:00~15:00', '15:00~17:00', '17:00~19:00', '19:00~21:00', '21:00~23:00', '23:00~00:00',
+)
+
+# 日期、时间与农历文本常用的字（63 个以内）
+TEXT_CHARS = '0123456789-:~ .TZ年月日时〇一二三四五六七八九十正冬腊闰初廿卅农历出生，()'
+
+WORD_ESCAPE = 255
+ENUM_ESCAPE = 15
+MUTAGEN_ESCAPE = 7
+CHAR_ESCAPE = 63
+
+_WORD_IDS = {word: i for i, word in enumerate(WORDS)}
+_CHAR_IDS = {char: i for i, char in enumerate(TEXT_CHARS)}
+
+assert len(WORDS) <= WORD_ESCAPE and len(TEXT_CHARS) <= CHAR_ESCAPE
+
+
+class ShareTokenError(ValueError):
+    """令牌无法解码（格式、版本或校验错误）"""
+
+
+class BitWriter:
+    def __init__(self):
+        self.value = 0
+        self.bits = 0
+
+    def write(self, value, width):
+        if not 0 <= value < 1 << width:
+            raise ValueError(f"{value} 超出 {width} 位")
+        self.value = (self.value << width) | value
+        self.bits += width
+
+    def getvalue(self):
+        pad = -self.bits % 8
+        return (self.value << pad).to_bytes((self.bits + pad) // 8, 'big')
+
+
+class BitReader:
+    def __init__(self, data):
+        self.value = int.from_bytes(data, 'big')
+        self.bits = len(data) * 8
+        self.pos = 0
+
+    def read(self, width):
+        if self.pos + width > self.bits:
+            raise ShareTokenError("令牌数据不完整")
+        self.pos += width
+        return (self.value >> (self.bits - self.pos)) & ((1 << width) - 1)
+
+    @property
+    def byte_offset(self):
+        return (self.pos + 7) // 8
+
+
+# ---- 字段编码 ----
+
+def _write_text(out, value):
+    value = '' if value is None else str(value)
+    if len(value) > 255:
+        raise ValueError(f"文本过长: {value[:20]}…")
+    out.write(len(value), 8)
+    for char in value:
+        index = _CHAR_IDS.get(char)
+        if index is None:
+            out.write(CHAR_ESCAPE, 6)
+            out.write(ord(char), 21)
+        else:
+            out.write(index, 6)
+
+
+def _read_text(reader):
+    chars = []
+    for _ in range(reader.read(8)):
+        index = reader.read(6)
+        if index == CHAR_ESCAPE:
+            code = reader.read(21)
+            if code > 0x10FFFF or 0xD800 <= code <= 0xDFFF:
+                raise ShareTokenError("令牌中的字符无效")
+            chars.append(chr(code))
+        elif index < len(TEXT_CHARS):
+            chars.append(TEXT_CHARS[index])
+        else:
+            raise ShareTokenError("令牌中的字符无效")
+    return ''.join(chars)
+
+
+def _write_word(out, value):
+    value = '' if value is None else str(value)
+    index = _WORD_IDS.get(value)
+    if index is None:
+        out.write(WORD_ESCAPE, 8)
+        _write_text(out, value)
+    else:
+        out.write(index, 8)
+
+
+def _read_word(reader):
+    index = reader.read(8)
+    if index == WORD_ESCAPE:
+        return _read_text(reader)
+    if index >= len(WORDS):
+        raise ShareTokenError("令牌中的词表序号无效")
+    return WORDS[index]
+
+
+def _write_enum(out, value, table, width, escape):
+    value = value or ''
+    if value in table:
+        out.write(table.index(value), width)
+    else:
+        out.write(escape, width)
+        _write_word(out, value)
+
+
+def _read_enum(reader, table, width, escape):
+    index = reader.read(width)
+    if index == escape:
+        return _read_word(reader)
+    if index >= len(table):
+        raise ShareTokenError("令牌中的序号无效")
+    return table[index]
+
+
+def _write_count(out, n, width):
+    full = (1 << width) - 1
+    if n < full:
+        out.write(n, width)
+    else:
+        out.write(full, width)
+        out.write(n - full, 8)
+
+
+def _read_count(reader, width):
+    n = reader.read(width)
+    return n + reader.read(8) if n == (1 << width) - 1 else n
+
+
+def _write_flagged_text(out, value, derived):
+    """与拼接结果相同时只记 1 位"""
+    if value == derived:
+        out.write(1, 1)
+    else:
+        out.write(0, 1)
+        _write_text(out, value)
+
+
+def _description(basic):
+    return f"{basic['solar_date']}出生，农历{basic['lunar_date']}"
+
+
+def _time_info(basic):
+    return f"{basic['time_chen']} ({basic['time_range']})"
+
+
+# ---- 命盘 ----
+
+def _write_chart(out, core, echo):
+    echo_basic = echo.get("basic_info", {})
+    _write_text(out, echo_basic.get("birth_date"))
+    _write_text(out, echo_basic.get("birth_time"))
+    _write_word(out, echo_basic.get("gender"))
+
+    basic = core.get("basic_info", {})
+    basic_values = {field: '' if basic.get(field) is None else str(basic.get(field)) for field in BASIC_FIELDS}
+    _write_text(out, basic_values['solar_date'])
+    _write_text(out, basic_values['lunar_date'])
+    for field in BASIC_FIELDS[2:]:
+        _write_word(out, basic_values[field])
+
+    palaces = core.get("palaces", [])
+    _write_count(out, len(palaces), 4)
+    for palace in palaces:
+        _write_word(out, palace.get("name"))
+        _write_enum(out, palace.get("earthly_branch"), BRANCHES, 4, ENUM_ESCAPE)
+        _write_enum(out, palace.get("heavenly_stem"), STEMS, 4, ENUM_ESCAPE)
+        major = palace.get("major_stars") or []
+        _write_count(out, len(major), 2)
+        for star in major:
+            _write_word(out, star.get("name"))
+            _write_enum(out, star.get("brightness"), BRIGHTNESS, 4, ENUM_ESCAPE)
+            _write_enum(out, star.get("mutagen"), MUTAGENS, 3, MUTAGEN_ESCAPE)
+        minor = palace.get("minor_stars") or []
+        _write_count(out, len(minor), 3)
+        for star in minor:
+            _write_word(out, star.get("name"))
+            _write_enum(out, star.get("mutagen"), MUTAGENS, 3, MUTAGEN_ESCAPE)
+        _write_count(out, palace.get("adjective_stars_count") or 0, 4)
+
+    summary = core.get("summary", {})
+    _write_flagged_text(out, summary.get("description"), _description(basic_values))
+    _write_flagged_text(out, summary.get("time_info"), _time_info(basic_values))
+    _write_enum(out, summary.get("soul_palace"), BRANCHES, 4, ENUM_ESCAPE)
+    _write_enum(out, summary.get("body_palace"), BRANCHES, 4, ENUM_ESCAPE)
+    _write_text(out, echo.get("summary", {}).get("calculation_time"))
+
+
+def _read_chart(reader):
+    echo_basic = {
+        "birth_date": _read_text(reader),
+        "birth_time": _read_text(reader),
+        "gender": _read_word(reader),
+    }
+
+    basic = {"solar_date": _read_text(reader), "lunar_date": _read_text(reader)}
+    for field in BASIC_FIELDS[2:]:
+        basic[field] = _read_word(reader)
+
+    palaces = []
+    for _ in range(_read_count(reader, 4)):
+        palace = {
+            "name": _read_word(reader),
+            "earthly_branch": _read_enum(reader, BRANCHES, 4, ENUM_ESCAPE),
+            "heavenly_stem": _read_enum(reader, STEMS, 4, ENUM_ESCAPE),
+        }
+        palace["major_stars"] = [
+            {
+                "name": _read_word(reader),
+                "brightness": _read_enum(reader, BRIGHTNESS, 4, ENUM_ESCAPE),
+                "mutagen": _read_enum(reader, MUTAGENS, 3, MUTAGEN_ESCAPE),
+            }
+            for _ in range(_read_count(reader, 2))
+        ]
+        palace["minor_stars"] = [
+            {"name": _read_word(reader), "mutagen": _read_enum(reader, MUTAGENS, 3, MUTAGEN_ESCAPE)}
+            for _ in range(_read_count(reader, 3))
+        ]
+        palace["adjective_stars_count"] = _read_count(reader, 4)
+        palaces.append(palace)
+
+    summary = {}
+    summary["description"] = _description(basic) if reader.read(1) else _read_text(reader)
+    summary["time_info"] = _time_info(basic) if reader.read(1) else _read_text(reader)
+    summary["soul_palace"] = _read_enum(reader, BRANCHES, 4, ENUM_ESCAPE)
+    summary["body_palace"] = _read_enum(reader, BRANCHES, 4, ENUM_ESCAPE)
+    echo = {"basic_info": echo_basic, "summary": {"calculation_time": _read_text(reader)}}
+
+    return {"basic_info": basic, "palaces": palaces, "summary": summary}, echo
+
+
+# ---- 令牌 ----
+
+def _checksum(data):
+    return (zlib.crc32(data) & 0xFFFF).to_bytes(2, 'big')
+
+
+def encode(core, echo, note=''):
+    """
+    把命盘核心数据与回显字段编码为分享令牌
+    core / echo 即 split_chart 的两部分（core 中的主题评分等其他部分不进入令牌）
+    """
+    note_bytes = (note or '').encode('utf-8')
+    if len(note_bytes) > MAX_NOTE_BYTES:
+        raise ValueError(f"附注超过 {MAX_NOTE_BYTES} 字节")
+    out = BitWriter()
+    _write_chart(out, core, echo)
+    out.write(len(note_bytes), 8)
+    body = out.getvalue() + note_bytes
+
+    flags = 0
+    packed = zlib.compress(body, 9, wbits=-15)
+    if len(packed) < len(body):
+        body, flags = packed, flags | FLAG_DEFLATE
+    data = bytes((VERSION, flags)) + body
+    return base64.urlsafe_b64encode(data + _checksum(data)).rstrip(b'=').decode('ascii')
+
+
+def decode(token):
+    """解码分享令牌，返回 (core, echo, note)；令牌无效时抛出 ShareTokenError"""
+    if not token or len(token) > MAX_TOKEN_LENGTH:
+        raise ShareTokenError("令牌为空或过长")
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+    except (ValueError, TypeError):
+        raise ShareTokenError("令牌不是有效的 base64url")
+    if len(raw) < 4:
+        raise ShareTokenError("令牌数据不完整")
+    data, checksum = raw[:-2], raw[-2:]
+    if _checksum(data) != checksum:
+        raise ShareTokenError("令牌校验失败（链接可能不完整）")
+    version, flags, body = data[0], data[1], data[2:]
+    if version != VERSION:
+        raise ShareTokenError(f"不支持的令牌版本: {version}")
+
+    if flags & FLAG_DEFLATE:
+        inflater = zlib.decompressobj(wbits=-15)
+        try:
+            body = inflater.decompress(body, MAX_BODY_SIZE)
+        except zlib.error:
+            raise ShareTokenError("令牌解压失败")
+        if inflater.unconsumed_tail:
+            raise ShareTokenError("令牌正文过大")
+
+    reader = BitReader(body)
+    core, echo = _read_chart(reader)
+    note_length = reader.read(8)
+    note_bytes = body[reader.byte_offset:reader.byte_offset + note_length]
+    if len(note_bytes) != note_length:
+        raise ShareTokenError("令牌数据不完整")
+    try:
+        note = note_bytes.decode('utf-8')
+    except UnicodeDecodeError:
+        raise ShareTokenError("令牌附注不是有效的 UTF-8")
+    return core, echo, note
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="命盘分享令牌")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_decode = sub.add_parser('decode', help="解码令牌并输出命盘 JSON")
+    p_decode.add_argument('token')
+    args = parser.parse_args(argv)
+
+    try:
+        core, echo, note = decode(args.token)
+    except ShareTokenError as e:
+        print(f"令牌无效: {e}", file=sys.stderr)
+        return 1
+    print(json.dumps({"core": core, "echo": echo, "note": note}, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""请求合并（single-flight）
+
+同一规范键的并发请求只触发一次计算，其余调用方等待并共享这次计算的结果：
+- 进程内：同一 gunicorn worker 的多个线程通过 Event 等待同一个 in-flight 计算
+- 跨进程：配置了 SQLite 共享缓存时，用租约表保证同一时刻只有一个进程在计算同一键，
+  其他进程轮询共享缓存直到结果出现
+
+失败不会互相传染：领头者超时或计算进程异常时，跟随者不会拿到这个错误，
+而是在自己的截止时间内重新发起计算；只有确定性的失败（share_error 返回 True）才会共享。
+"""
+import asyncio
+import os
+import threading
+import time
+
+
+class FlightTimeout(TimeoutError):
+    """等待 in-flight 计算超过调用方自己的截止时间"""
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, leases=None, poll_interval=0.02, max_poll_interval=0.2):
+        self.leases = leases
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = {"leaders": 0, "followers": 0, "retries": 0, "shared_waits": 0, "shared_hits": 0}
+
+    def do(self, key, fn, timeout, peek=None, share_error=None):
+        """
+        执行 fn() 或等待同键的 in-flight 计算
+        peek: 跨进程等待时查询共享缓存的函数，返回结果或 None
+        share_error: 判断领头者的异常是否可以直接共享给跟随者
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                else:
+                    call.waiters += 1
+
+            if leader:
+                self.stats["leaders"] += 1
+                try:
+                    call.result = self._lead(key, fn, deadline, peek)
+                    return call.result
+                except BaseException as e:
+                    call.error = e
+                    raise
+                finally:
+                    with self._lock:
+                        self._calls.pop(key, None)
+                    call.event.set()
+
+            self.stats["followers"] += 1
+            if not call.event.wait(max(deadline - time.monotonic(), 0)):
+                raise FlightTimeout("等待相同请求的计算结果超时")
+            if call.error is None:
+                return call.result
+            if share_error is not None and share_error(call.error):
+                raise call.error
+            # 领头者的失败可能只和它自己有关（超时、进程崩溃），在自己的截止时间内重试
+            if time.monotonic() >= deadline:
+                raise FlightTimeout("等待相同请求的计算结果超时")
+            self.stats["retries"] += 1
+
+    def _lead(self, key, fn, deadline, peek):
+        if self.leases is None or peek is None:
+            return fn()
+
+        while True:
+            ttl = max(deadline - time.monotonic(), 0.001)
+            if self.leases.acquire(key, ttl):
+                try:
+                    return fn()
+                finally:
+                    self.leases.release(key)
+
+            # 另一个进程正在计算同一键，等它把结果写进共享缓存
+            self.stats["shared_waits"] += 1
+            interval = self.poll_interval
+            while self.leases.held(key):
+                result = peek()
+                if result is not None:
+                    self.stats["shared_hits"] += 1
+                    return result
+                if time.monotonic() + interval > deadline:
+                    raise FlightTimeout("等待其他进程的计算结果超时")
+                time.sleep(interval)
+                interval = min(interval * 2, self.max_poll_interval)
+
+            # 租约已释放：结果可能已经写入，也可能对方失败了，此时自己接手计算
+            result = peek()
+            if result is not None:
+                self.stats["shared_hits"] += 1
+                return result
+
+    def snapshot(self):
+        info = dict(self.stats)
+        info["in_flight"] = len(self._calls)
+        info["cross_process"] = self.leases is not None
+        return info
+
+
+class _AsyncCall:
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncSingleFlight:
+    """
+    协程版请求合并（asgi.py 与 compute_daemon.py 使用）
+    同键共用一个任务；每个等待者只等到自己的超时，某个等待者放弃不影响其他等待者，
+    所有等待者都离开（超时或断开）后取消任务
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, factory, timeout):
+        """factory() 返回协程；超时抛出 asyncio.TimeoutError"""
+        call = self._calls.get(key)
+        if call is None:
+            call = self._calls[key] = _AsyncCall(asyncio.ensure_future(factory()))
+            call.task.add_done_callback(lambda _: self._calls.get(key) is call and self._calls.pop(key))
+        call.waiters += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(call.task), timeout)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # 任务要到下一轮事件循环才真正结束，先移除，之后到达的调用方重新开始计算而不是等到 CancelledError
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                call.task.cancel()
+
+    def __len__(self):
+        return len(self._calls)
+
+
+def lease_owner():
+    return f"{os.getpid()}:{threading.get_ident()}"
+
+
+_flights = None
+_flights_lock = threading.Lock()
+
+
+def get_flights():
+    """进程内单例；磁盘缓存可用时启用跨进程租约"""
+    global _flights
+    if _flights is None:
+        with _flights_lock:
+            if _flights is None:
+                from chart_cache import get_cache
+                _flights = SingleFlight(leases=get_cache().disk)
+    return _flights
@@ -0,0 +1,179 @@
+"""真太阳时修正
+
+时辰按出生地的真太阳时划分，而用户输入的是所在时区的钟表时间：
+    真太阳时 = 钟表时间 + 4 分钟 ×（经度 − 15 × 时区）+ 均时差
+均时差按年内第几天查预先算好的表（EQUATION_OF_TIME，Spencer 公式，误差在半分钟以内），
+城市经度查进程启动时载入的城市表（CITIES，可用 ZIWEI_CITIES 指定额外的 CSV：名称,经度,时区），
+修正本身只是几次查表与加法，不调用任何地理库。
+
+修正后的日期时间代替原输入参与时辰划分与规范键，落在同一时辰的修正前后请求共用同一条缓存。
+"""
+import csv
+import logging
+import math
+import os
+import re
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEZONE = 8.0
+
+
+def _equation_of_time(day_of_year):
+    """均时差（分钟），Spencer (1971)"""
+    b = 2 * math.pi * (day_of_year - 1) / 365
+    return 229.18 * (0.000075 + 0.001868 * math.cos(b) - 0.032077 * math.sin(b)
+                     - 0.014615 * math.cos(2 * b) - 0.040849 * math.sin(2 * b))
+
+
+# 下标为年内第几天 - 1（闰年第 366 天沿用同一公式）
+EQUATION_OF_TIME = tuple(_equation_of_time(day) for day in range(1, 367))
+
+# 城市 -> (经度, 标准时区)；夏令时期间出生请另外传入 timezone
+CITIES = {
+    # 中国大陆
+    '北京': (116.41, 8), '天津': (117.20, 8), '上海': (121.47, 8), '重庆': (106.55, 8),
+    '石家庄': (114.51, 8), '太原': (112.55, 8), '呼和浩特': (111.75, 8), '沈阳': (123.43, 8),
+    '大连': (121.61, 8), '长春': (125.32, 8), '哈尔滨': (126.53, 8), '南京': (118.80, 8),
+    '苏州': (120.59, 8), '杭州': (120.16, 8), '宁波': (121.55, 8), '合肥': (117.23, 8),
+    '福州': (119.30, 8), '厦门': (118.09, 8), '南昌': (115.86, 8), '济南': (117.12, 8),
+    '青岛': (120.38, 8), '郑州': (113.63, 8), '武汉': (114.31, 8), '长沙': (112.94, 8),
+    '广州': (113.26, 8), '深圳': (114.06, 8), '汕头': (116.68, 8), '南宁': (108.37, 8),
+    '海口': (110.20, 8), '成都': (104.07, 8), '贵阳': (106.63, 8), '昆明': (102.83, 8),
+    '拉萨': (91.13, 8), '西安': (108.94, 8), '兰州': (103.83, 8), '西宁': (101.78, 8),
+    '银川': (106.23, 8), '乌鲁木齐': (87.62, 8), '喀什': (75.99, 8),
+    # 港澳台
+    '香港': (114.17, 8), '澳门': (113.54, 8), '台北': (121.56, 8), '新北': (121.47, 8),
+    '基隆': (121.74, 8), '桃园': (121.30, 8), '新竹': (120.97, 8), '台中': (120.68, 8),
+    '彰化': (120.54, 8), '嘉义': (120.45, 8), '台南': (120.21, 8), '高雄': (120.31, 8),
+    '屏东': (120.49, 8), '宜兰': (121.75, 8), '花莲': (121.60, 8), '台东': (121.14, 8),
+    # 海外华人聚居城市
+    '新加坡': (103.82, 8), '吉隆坡': (101.69, 8), '槟城': (100.33, 8), '曼谷': (100.50, 7),
+    '东京': (139.69, 9), '首尔': (126.98, 9), '悉尼': (151.21, 10), '墨尔本': (144.96, 10),
+    '奥克兰': (174.76, 12), '伦敦': (-0.13, 0), '巴黎': (2.35, 1), '温哥华': (-123.12, -8),
+    '多伦多': (-79.38, -5), '纽约': (-74.01, -5), '旧金山': (-122.42, -8), '洛杉矶': (-118.24, -8),
+}
+
+# 繁体写法与常见别名
+_ALIASES = {
+    '臺北': '台北', '臺中': '台中', '臺南': '台南', '臺東': '台东', '台東': '台东', '桃園': '桃园',
+    '屏東': '屏东', '宜蘭': '宜兰', '花蓮': '花莲', '嘉義': '嘉义', '澳門': '澳门', '廣州': '广州',
+    '廈門': '厦门', '長沙': '长沙', '長春': '长春', '瀋陽': '沈阳', '沈陽': '沈阳', '重慶': '重庆',
+    '蘇州': '苏州', '寧波': '宁波', '鄭州': '郑州', '武漢': '武汉', '南寧': '南宁', '蘭州': '兰州',
+    '西寧': '西宁', '銀川': '银川', '烏魯木齊': '乌鲁木齐', '貴陽': '贵阳', '崑明': '昆明', '東京': '东京',
+    '首爾': '首尔', '漢城': '首尔', '雪梨': '悉尼', '墨爾本': '墨尔本', '倫敦': '伦敦', '溫哥華': '温哥华',
+    '多倫多': '多伦多', '紐約': '纽约', '舊金山': '旧金山', '洛杉磯': '洛杉矶', '檳城': '槟城', '奧克蘭': '奥克兰',
+    '哈爾濱': '哈尔滨', '大連': '大连', '濟南': '济南', '青島': '青岛', '石家莊': '石家庄', '汕頭': '汕头',
+    '拉薩': '拉萨',
+}
+
+
+def _city_key(name):
+    name = str(name).strip()
+    for suffix in ('市', '縣', '县'):
+        if len(name) > 2 and name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return _ALIASES.get(name, name)
+
+
+def _load_extra_cities(path):
+    """载入额外的城市表（CSV：名称,经度[,时区]），返回载入条数"""
+    count = 0
+    with open(path, encoding='utf-8') as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or row[0].startswith('#'):
+                continue
+            try:
+                longitude = float(row[1])
+                timezone = float(row[2]) if len(row) > 2 and row[2].strip() else DEFAULT_TIMEZONE
+            except ValueError:
+                continue
+            CITIES[_city_key(row[0])] = (longitude, timezone)
+            count += 1
+    return count
+
+
+if os.environ.get('ZIWEI_CITIES'):
+    try:
+        logger.info(f"载入城市表 {_load_extra_cities(os.environ['ZIWEI_CITIES'])} 条")
+    except OSError as e:
+        logger.error(f"城市表载入失败: {e}")
+
+
+# 小时部分可带小数（查询参数里的 "5.5"），带小数时不能再带分钟
+_TIMEZONE = re.compile(r'^(?:UTC|GMT)?\s*([+-])?\s*(\d{1,2})(?:(?::?(\d{2}))|(\.\d+))?$', re.IGNORECASE)
+
+
+def parse_timezone(value):
+    """时区偏移（小时）：8、-5、5.5、"5.5"、"+08:00"、"UTC+8"、"UTC+5.5"、"GMT-0530" """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        hours = float(value)
+    else:
+        match = _TIMEZONE.match(str(value).strip())
+        if not match:
+            raise ValueError(f"无法识别的时区: {value!r}")
+        sign, hh, mm, fraction = match.groups()
+        hours = int(hh) + (float(fraction) if fraction else int(mm or 0) / 60)
+        if sign == '-':
+            hours = -hours
+    if not -12 <= hours <= 14:
+        raise ValueError(f"时区超出范围: {value!r}")
+    return hours
+
+
+def resolve_location(longitude=None, timezone=None, location=None):
+    """返回 (经度, 时区, 城市名)；未给经度时按城市表查找，未给时区时用城市的时区或东八区"""
+    city = None
+    if location not in (None, ''):
+        city = CITIES.get(_city_key(location))
+        if city is None:
+            raise ValueError(f"城市表中没有 {location}，请直接提供 longitude")
+    if longitude not in (None, ''):
+        try:
+            longitude = float(longitude)
+        except (TypeError, ValueError):
+            raise ValueError(f"经度必须是数字: {longitude!r}")
+        if not -180 <= longitude <= 180:
+            raise ValueError(f"经度超出范围: {longitude}")
+    elif city is not None:
+        longitude = city[0]
+    else:
+        raise ValueError("修正真太阳时需要提供 longitude 或 location")
+    if timezone not in (None, ''):
+        timezone = parse_timezone(timezone)
+    else:
+        timezone = float(city[1]) if city is not None else DEFAULT_TIMEZONE
+    return longitude, timezone, (location if city is not None else None)
+
+
+def offset_minutes(day_of_year, longitude, timezone):
+    """真太阳时相对钟表时间的偏移（分钟）"""
+    return 4 * (longitude - 15 * timezone) + EQUATION_OF_TIME[day_of_year - 1]
+
+
+def correct(birth_date, birth_time, longitude=None, timezone=None, location=None):
+    """
+    把钟表时间修正为真太阳时，返回修正信息：
+    {"birth_date", "birth_time"（修正后）, "clock_date", "clock_time"（原输入）, "longitude", "timezone", "location", "offset_minutes"}
+    修正可能跨日（例如东八区最西部的凌晨出生）
+    """
+    longitude, timezone, city = resolve_location(longitude, timezone, location)
+    try:
+        year, month, day = map(int, birth_date.split('-'))
+        hour, minute = map(int, birth_time.split(':'))
+        clock = datetime(year, month, day, hour, minute)
+    except ValueError:
+        raise ValueError(f"无法解析出生时间: {birth_date} {birth_time}")
+    offset = offset_minutes(clock.timetuple().tm_yday, longitude, timezone)
+    solar = clock + timedelta(minutes=round(offset))
+    return {
+        "birth_date": solar.strftime("%Y-%m-%d"),
+        "birth_time": solar.strftime("%H:%M"),
+        "clock_date": birth_date,
+        "clock_time": birth_time,
+        "longitude": longitude,
+        "timezone": timezone,
+        "location": city,
+        "offset_minutes": round(offset, 1),
+    }
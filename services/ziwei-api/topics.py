@@ -0,0 +1,249 @@
+"""五大主题评分
+
+与 web/src/lib/ziweiService.ts 的 PALACE_ALIASES、normalizeName、isMaleficStar 保持一致：
+主题按宫位别名找到对应宫位，宫位内的星曜按吉凶、亮度与四化计分，再按宫位权重得到 1–99 的主题分数，
+同时给出与前端 enhancePalace 相同的宫位/星曜重点，客户端不必再各自解析命盘。
+
+所有名字都先经过整数查找表（宫位 → 主题权重行、星曜 → 吉凶、亮度 → 权重、四化 → 权重），
+计分本身是对编码数组的向量化运算，单张命盘、批量结果与分析库（analytics.py）的整列数据共用同一套计算。
+"""
+import re
+import threading
+
+import numpy as np
+
+# 计分规则变化时递增，缓存中旧版本的评分会重新计算
+SCORING_VERSION = 1
+
+# 与 ziweiService.ts 相同的主题与宫位别名
+PALACE_ALIASES = {
+    '事業 / 財運': ['官祿宮', '官禄宫', '事业宫'],
+    '婚姻 / 伴侶': ['夫妻宮', '夫妻宫'],
+    '愛情 / 新關係': ['遷移宮', '迁移宫', '福德宮', '福德宫'],
+    '家庭（父母＋子女）': ['父母宮', '父母宫', '田宅宮', '田宅宫'],
+    '健康 / 身心': ['疾厄宮', '疾厄宫', '命宮', '命宫'],
+}
+TOPICS = tuple(PALACE_ALIASES)
+
+CHAR_REPLACEMENT = {'宫': '宮', '禄': '祿', '禬': '祿', '迁': '遷', '阳': '陽', '阴': '陰', '业': '業'}
+_REPLACE = re.compile('[宫禄迁阳阴业]')
+_MALEFIC = re.compile('忌|煞|劫|空|耗|刑|陷|破|衰|喪|丧')
+
+# 计分表（整数）
+STAR_POLARITY = {True: -2, False: 2}
+BRIGHTNESS_WEIGHT = {'廟': 2, '庙': 2, '旺': 1, '得': 1, '利': 0, '平': 0, '不': -1, '陷': -2}
+MUTAGEN_WEIGHT = {'祿': 3, '權': 2, '权': 2, '科': 2, '忌': -3}
+# 主星的分量是辅星的两倍；主题的第一个宫位权重 2，其余 1
+MAJOR_FACTOR = 2
+BASE_SCORE = 60
+SCORE_SCALE = 3
+
+
+def normalize_name(name):
+    """繁简字形统一（与 normalizeName 相同）"""
+    return _REPLACE.sub(lambda m: CHAR_REPLACEMENT[m.group()], (name or '').strip())
+
+
+def palace_key(name):
+    """宫位名的比较键；iztro 的宫位名多数不带「宫」字（如「官禄」），去掉结尾的「宮」后再比较"""
+    name = normalize_name(name)
+    return name[:-1] if name.endswith('宮') and len(name) > 1 else name
+
+
+def is_malefic_star(name):
+    """与 isMaleficStar 相同的凶星判断"""
+    return bool(name) and _MALEFIC.search(name) is not None
+
+
+def _mutagen_weight(mutagen):
+    mutagen = normalize_name(mutagen)
+    return MUTAGEN_WEIGHT.get(mutagen[-1:] if mutagen else '', 0)
+
+
+# 每个主题对应的宫位（按别名顺序去重）与宫位 → 主题权重矩阵的行
+_TOPIC_PALACES = []
+for _aliases in PALACE_ALIASES.values():
+    _keys = []
+    for _alias in _aliases:
+        if palace_key(_alias) not in _keys:
+            _keys.append(palace_key(_alias))
+    _TOPIC_PALACES.append(_keys)
+_PALACE_ROWS = {key: row for row, key in enumerate(dict.fromkeys(k for keys in _TOPIC_PALACES for k in keys))}
+# 最后一行全零：与任何主题无关的宫位
+TOPIC_WEIGHTS = np.zeros((len(_PALACE_ROWS) + 1, len(TOPICS)), dtype=np.int16)
+for _topic, _keys in enumerate(_TOPIC_PALACES):
+    for _rank, _key in enumerate(_keys):
+        TOPIC_WEIGHTS[_PALACE_ROWS[_key], _topic] = 2 if _rank == 0 else 1
+NO_TOPIC_ROW = len(_PALACE_ROWS)
+
+
+class LookupTable:
+    """名字 -> 整数编码 -> 数值；新名字第一次出现时追加，编码 0 固定为空名字"""
+
+    def __init__(self, value_of):
+        self.value_of = value_of
+        self.codes = {'': 0}
+        self._values = [value_of('')]
+        self._array = None
+        self._lock = threading.Lock()
+
+    def code(self, name):
+        name = name or ''
+        code = self.codes.get(name)
+        if code is None:
+            with self._lock:
+                code = self.codes.get(name)
+                if code is None:
+                    code = len(self._values)
+                    self._values.append(self.value_of(name))
+                    self.codes[name] = code
+                    self._array = None
+        return code
+
+    def values(self):
+        array = self._array
+        if array is None or len(array) != len(self._values):
+            array = self._array = np.array(self._values, dtype=np.int16)
+        return array
+
+    def table_for(self, vocab):
+        """按外部词表（例如分析库的 vocab）的编码索引的数值表"""
+        return np.array([self.value_of(name) for name in vocab], dtype=np.int16)
+
+
+PALACE_TABLE = LookupTable(lambda name: _PALACE_ROWS.get(palace_key(name), NO_TOPIC_ROW))
+STAR_TABLE = LookupTable(lambda name: STAR_POLARITY[is_malefic_star(name)] if name else 0)
+BRIGHTNESS_TABLE = LookupTable(lambda name: BRIGHTNESS_WEIGHT.get(normalize_name(name), 0))
+MUTAGEN_TABLE = LookupTable(_mutagen_weight)
+
+
+def _sum_last(values):
+    """沿最后一维求和；最后一维很短，逐片相加比 ndarray.sum(axis=-1) 快"""
+    total = values[..., 0].astype(np.int32)
+    for i in range(1, values.shape[-1]):
+        total += values[..., i]
+    return total
+
+
+def score_values(palace_rows, major_values, minor_values):
+    """
+    palace_rows: [N, 12] 主题权重行；major_values / minor_values: [N, 12, 星位] 每颗星的分值（空位为 0）
+    返回 [N, 主题数] int8 分数
+    """
+    return topic_scores(palace_rows, MAJOR_FACTOR * _sum_last(major_values) + _sum_last(minor_values))
+
+
+def topic_scores(palace_rows, palace_score):
+    """由每个宫位的得分 [N, 12] 按主题权重得到 [N, 主题数] 分数"""
+    weights = TOPIC_WEIGHTS[palace_rows]
+    raw = np.einsum('np,npt->nt', palace_score, weights)
+    total = _sum_last(np.moveaxis(weights, 1, 2))
+    return to_score(raw / np.maximum(total, 1))
+
+
+def to_score(average):
+    """平均星曜分值 -> 1–99 分"""
+    return np.clip(np.rint(BASE_SCORE + SCORE_SCALE * average), 1, 99).astype(np.int8)
+
+
+def vocab_tables(vocab):
+    """分析库词表对应的 (宫位, 星曜, 亮度, 四化) 数值表"""
+    return tuple(table.table_for(vocab) for table in (PALACE_TABLE, STAR_TABLE, BRIGHTNESS_TABLE, MUTAGEN_TABLE))
+
+
+def score_codes(tables, palace_name, major_star, major_brightness, major_mutagen, minor_star, minor_mutagen):
+    """按分析库的列（词表编码）计分，tables 来自 vocab_tables()，返回 [N, 主题数] 分数"""
+    palaces, stars, brightness, mutagens = tables
+    major = stars[major_star] + brightness[major_brightness] + mutagens[major_mutagen]
+    minor = stars[minor_star] + mutagens[minor_mutagen]
+    return score_values(palaces[palace_name], major, minor)
+
+
+def _encode(cores):
+    """把若干命盘的宫位与星曜编码为定长整数数组"""
+    n = len(cores)
+    max_major = max([len(p.get('major_stars') or []) for c in cores for p in c.get('palaces', [])] + [1])
+    max_minor = max([len(p.get('minor_stars') or []) for c in cores for p in c.get('palaces', [])] + [1])
+    palaces = np.zeros((n, 12), dtype=np.int32)
+    major = np.zeros((n, 12, max_major, 3), dtype=np.int32)
+    minor = np.zeros((n, 12, max_minor, 2), dtype=np.int32)
+    for row, core in enumerate(cores):
+        for i, palace in enumerate(core.get('palaces', [])[:12]):
+            palaces[row, i] = PALACE_TABLE.code(palace.get('name'))
+            for j, star in enumerate(palace.get('major_stars') or []):
+                major[row, i, j] = (STAR_TABLE.code(star.get('name')), BRIGHTNESS_TABLE.code(star.get('brightness')),
+                                    MUTAGEN_TABLE.code(star.get('mutagen')))
+            for j, star in enumerate(palace.get('minor_stars') or []):
+                minor[row, i, j] = (STAR_TABLE.code(star.get('name')), MUTAGEN_TABLE.code(star.get('mutagen')))
+    return palaces, major, minor
+
+
+def _star_tip(star):
+    name = star.get('name')
+    if not name:
+        return '暫無描述'
+    if star.get('mutagen'):
+        return f"{name} · {star['mutagen']}"
+    return f"{name} 需留意波動" if is_malefic_star(name) else f"{name} 可善用優勢"
+
+
+def _highlight(topic, palaces):
+    """与 resolvePalaceForTopic + enhancePalace 相同：按别名找到宫位，列出天干地支、主星与前六颗星"""
+    aliases = {normalize_name(alias) for alias in PALACE_ALIASES[topic]}
+    keys = {palace_key(alias) for alias in PALACE_ALIASES[topic]}
+    palace = next((p for p in palaces if normalize_name(p.get('name')) in aliases or palace_key(p.get('name')) in keys),
+                  None)
+    if palace is None:
+        return None, []
+    majors = palace.get('major_stars') or []
+    minors = palace.get('minor_stars') or []
+    comment = [
+        f"天干 {palace['heavenly_stem']}" if palace.get('heavenly_stem') else None,
+        f"地支 {palace['earthly_branch']}" if palace.get('earthly_branch') else None,
+        f"主星 {'、'.join(s.get('name', '') for s in majors)}" if majors else None,
+    ]
+    info = {
+        "name": palace.get('name'),
+        "main_star": majors[0].get('name') if majors else None,
+        "comment": ' · '.join(c for c in comment if c),
+    }
+    stars = [
+        {"type": '凶' if is_malefic_star(star.get('name')) else '吉',
+         "name": star.get('name') or '未知星曜',
+         "tip": _star_tip(star)}
+        for star in (majors + minors)[:6]
+    ]
+    return info, stars
+
+
+def palace_values(cores):
+    """若干命盘的 (主题权重行 [N, 12], 宫位得分 [N, 12])，宫位顺序与命盘中的 palaces 相同"""
+    palaces, major, minor = _encode(cores)
+    major_values = (STAR_TABLE.values()[major[..., 0]] + BRIGHTNESS_TABLE.values()[major[..., 1]]
+                    + MUTAGEN_TABLE.values()[major[..., 2]])
+    minor_values = STAR_TABLE.values()[minor[..., 0]] + MUTAGEN_TABLE.values()[minor[..., 1]]
+    return PALACE_TABLE.values()[palaces], MAJOR_FACTOR * _sum_last(major_values) + _sum_last(minor_values)
+
+
+def score_charts(cores):
+    """批量计分，返回每张命盘的 {"version", "items": [{topic, score, palace, stars}]}"""
+    if not cores:
+        return []
+    scores = topic_scores(*palace_values(cores))
+
+    results = []
+    for row, core in enumerate(cores):
+        items = []
+        for topic_index, topic in enumerate(TOPICS):
+            palace, stars = _highlight(topic, core.get('palaces', []))
+            items.append({"topic": topic, "score": int(scores[row, topic_index]), "palace": palace, "stars": stars})
+        results.append({"version": SCORING_VERSION, "items": items})
+    return results
+
+
+def with_topics(core):
+    """命盘核心数据附带主题评分（随命盘一起缓存）；已有当前版本的评分时原样返回"""
+    topics = core.get('topics')
+    if isinstance(topics, dict) and topics.get('version') == SCORING_VERSION:
+        return core
+    return {**core, "topics": score_charts([core])[0]}
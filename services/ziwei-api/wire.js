@@ -0,0 +1,66 @@
+// Node 与 Python 之间的帧协议
+// 每一帧 = 4 字节大端长度 + 紧凑 JSON（UTF-8），两端都只解码一次，不做文本扫描。
+// 响应写到 ZIWEI_FRAME_FD 指定的专用 fd（未指定时写 stdout），
+// console.log/info/debug 默认丢弃，console.warn/error 写到 stderr，调试输出不会混进协议通道；
+// 请求带 debug 参数时用 withDiagnostics 收集该次调用的全部 console 输出，随响应帧返回。
+const fs = require('fs');
+const util = require('util');
+
+const FRAME_FD = process.env.ZIWEI_FRAME_FD ? Number(process.env.ZIWEI_FRAME_FD) : 1;
+
+const noop = () => {};
+console.log = noop;
+console.info = noop;
+console.debug = noop;
+
+const CONSOLE_METHODS = ['log', 'info', 'debug', 'warn', 'error'];
+
+// 执行 fn 并返回 [结果, 调试输出行或 undefined]；计算是同步的，替换 console 不会影响其他请求
+function withDiagnostics(enabled, fn) {
+    if (!enabled) return [fn(), undefined];
+    const lines = [];
+    const saved = CONSOLE_METHODS.map((name) => console[name]);
+    for (const name of CONSOLE_METHODS) {
+        console[name] = (...args) => lines.push(util.format(...args));
+    }
+    try {
+        return [fn(), lines];
+    } finally {
+        CONSOLE_METHODS.forEach((name, i) => { console[name] = saved[i]; });
+    }
+}
+
+function writeFrame(message) {
+    const body = Buffer.from(JSON.stringify(message), 'utf8');
+    const frame = Buffer.allocUnsafe(4 + body.length);
+    frame.writeUInt32BE(body.length, 0);
+    body.copy(frame, 4);
+    let offset = 0;
+    while (offset < frame.length) {
+        offset += fs.writeSync(FRAME_FD, frame, offset);
+    }
+}
+
+// 从可读流中按帧读取，每收到一帧调用一次 onFrame(buffer)
+function readFrames(stream, onFrame) {
+    let pending = Buffer.alloc(0);
+    stream.on('data', (chunk) => {
+        pending = pending.length ? Buffer.concat([pending, chunk]) : chunk;
+        while (pending.length >= 4) {
+            const length = pending.readUInt32BE(0);
+            if (pending.length < 4 + length) break;
+            onFrame(pending.subarray(4, 4 + length));
+            pending = pending.subarray(4 + length);
+        }
+    });
+}
+
+// 一次性读取单帧（一次性脚本从 stdin 读请求时使用）
+function decodeFrame(buffer) {
+    if (buffer.length < 4) throw new Error('帧长度不足');
+    const length = buffer.readUInt32BE(0);
+    if (buffer.length < 4 + length) throw new Error('帧数据不完整');
+    return buffer.subarray(4, 4 + length);
+}
+
+module.exports = { writeFrame, readFrames, decodeFrame, withDiagnostics };
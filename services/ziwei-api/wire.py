@@ -0,0 +1,151 @@
+"""Node 与 Python 之间的帧协议，以及 web worker 与计算守护进程之间的帧协议
+
+Node 帧 = 4 字节大端长度 + 紧凑 JSON（UTF-8）。
+读取方先读定长的帧头，再按长度读出正文，整帧只做一次 json.loads，不做任何文本扫描。
+
+守护进程帧（compute_daemon.py）在同一连接上可以有多个请求同时进行，帧头是定长二进制：
+    请求  = 长度(uint32) 请求号(uint32) 操作码(uint8) 超时毫秒(uint32) + 正文（紧凑 JSON 参数）
+    响应  = 长度(uint32) 请求号(uint32) 状态(uint8) + 正文
+状态为 OK 时正文是结果的 JSON 字节（命盘直接使用预编码字节，不重新序列化），
+其余状态的正文是 {"error": ..., "retry_after": ...}。
+"""
+import asyncio
+import json
+import struct
+
+HEADER = struct.Struct('>I')
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+
+class FrameError(Exception):
+    """帧格式错误"""
+
+
+def encode_frame(message):
+    body = json.dumps(message, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return HEADER.pack(len(body)) + body
+
+
+def decode_body(body):
+    return json.loads(body)
+
+
+def read_frame(stream):
+    """从二进制流读取一帧正文；流结束时返回 None"""
+    header = stream.read(HEADER.size)
+    if not header:
+        return None
+    if len(header) < HEADER.size:
+        raise FrameError("帧头不完整")
+    length, = HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise FrameError(f"帧过大: {length}")
+    body = stream.read(length)
+    if len(body) < length:
+        raise FrameError("帧正文不完整")
+    return body
+
+
+def decode_frame(data):
+    """解码一段只包含单帧的字节串（一次性进程的 stdout）"""
+    if len(data) < HEADER.size:
+        raise FrameError("帧头不完整")
+    length, = HEADER.unpack_from(data)
+    if len(data) < HEADER.size + length:
+        raise FrameError("帧正文不完整")
+    return decode_body(data[HEADER.size:HEADER.size + length])
+
+
+async def read_frame_async(reader):
+    """从 asyncio.StreamReader 读取一帧正文；流结束时返回 None"""
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise FrameError("帧头不完整")
+    length, = HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise FrameError(f"帧过大: {length}")
+    try:
+        return await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        raise FrameError("帧正文不完整")
+
+
+DAEMON_REQUEST = struct.Struct('>IIBI')
+DAEMON_RESPONSE = struct.Struct('>IIB')
+
+# 守护进程操作码；cancel 的参数为 {"id": 要取消的请求号}，没有响应；
+# calculate_batch 与 calculate_many 的参数、结果相同，但先查守护进程的命盘缓存，算出的命盘写入缓存
+DAEMON_OPS = {
+    'calculate': 1, 'calculate_many': 2, 'horoscope': 3, 'version': 4, 'health': 5, 'cancel': 6,
+    'calculate_batch': 7,
+}
+DAEMON_OP_NAMES = {code: name for name, code in DAEMON_OPS.items()}
+
+# 守护进程响应状态
+STATUS_OK = 0
+STATUS_ERROR = 1
+STATUS_TIMEOUT = 2
+STATUS_OVERLOADED = 3
+
+
+def encode_request(request_id, op, params, timeout):
+    body = b'' if params is None else json.dumps(params, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return DAEMON_REQUEST.pack(len(body), request_id, DAEMON_OPS[op], int(timeout * 1000)) + body
+
+
+def encode_response(request_id, status, body):
+    return DAEMON_RESPONSE.pack(len(body), request_id, status) + body
+
+
+def _check_length(length):
+    if length > MAX_FRAME_SIZE:
+        raise FrameError(f"帧过大: {length}")
+
+
+def read_response(sock_file):
+    """从阻塞的二进制流读取一个守护进程响应，返回 (请求号, 状态, 正文)；连接关闭时返回 None"""
+    header = sock_file.read(DAEMON_RESPONSE.size)
+    if not header:
+        return None
+    if len(header) < DAEMON_RESPONSE.size:
+        raise FrameError("帧头不完整")
+    length, request_id, status = DAEMON_RESPONSE.unpack(header)
+    _check_length(length)
+    body = sock_file.read(length)
+    if len(body) < length:
+        raise FrameError("帧正文不完整")
+    return request_id, status, body
+
+
+async def _read_exactly(reader, size, what):
+    try:
+        return await reader.readexactly(size)
+    except asyncio.IncompleteReadError as e:
+        if what == "帧头" and not e.partial:
+            return None
+        raise FrameError(f"{what}不完整")
+
+
+async def read_request_async(reader):
+    """守护进程读取一个请求，返回 (请求号, 操作名, 超时秒数, 参数)；连接关闭时返回 None"""
+    header = await _read_exactly(reader, DAEMON_REQUEST.size, "帧头")
+    if header is None:
+        return None
+    length, request_id, opcode, timeout_ms = DAEMON_REQUEST.unpack(header)
+    _check_length(length)
+    body = await _read_exactly(reader, length, "帧正文") if length else b''
+    return request_id, DAEMON_OP_NAMES.get(opcode), timeout_ms / 1000, json.loads(body) if body else None
+
+
+async def read_response_async(reader):
+    """read_response 的 asyncio 版本"""
+    header = await _read_exactly(reader, DAEMON_RESPONSE.size, "帧头")
+    if header is None:
+        return None
+    length, request_id, status = DAEMON_RESPONSE.unpack(header)
+    _check_length(length)
+    body = await _read_exactly(reader, length, "帧正文") if length else b''
+    return request_id, status, body
@@ -17,8 +17,8 @@ import {
   type ZiweiProfile,
 } from '../lib/storage'
 import { ScoreBar } from './ScoreBar'
-import { decodeSharePayload, encodeSharePayload } from '../lib/share'
-import { fetchZiweiReport } from '../lib/ziweiService'
+import { CHART_SHARE_PARAM, decodeSharePayload, encodeSharePayload } from '../lib/share'
+import { createZiweiShareToken, fetchSharedZiweiReport, fetchZiweiReport } from '../lib/ziweiService'
 import {
   ResponsiveContainer,
   RadarChart,
@@ -192,8 +192,24 @@ export function ZiweiSection() {
 
     if (typeof window !== 'undefined') {
       const params = new URLSearchParams(window.location.search)
+      const chartToken = params.get(CHART_SHARE_PARAM)
       const token = params.get('ziwei')
-      if (token) {
+      if (chartToken) {
+        void fetchSharedZiweiReport(chartToken).then((shared) => {
+          if (shared) {
+            applySharedReport(
+              shared.input,
+              shared.report.results,
+              shared.report.summary,
+              shared.report.fiveElements,
+              'api',
+            )
+          } else {
+            setApiError('分享連結無效或 API 暫時無法使用')
+          }
+        })
+        window.history.replaceState({}, '', window.location.pathname)
+      } else if (token) {
         const payload = decodeSharePayload<{
           input: ZiweiInput
           summary: string
@@ -201,34 +217,44 @@ export function ZiweiSection() {
           fiveElements?: FiveElementState[]
         }>(token)
         if (payload) {
-          setFormState(payload.input)
-          setResults(ensureResults(payload.results))
-          setSummary(payload.summary)
-          setFiveElements(ensureFiveElements(payload.fiveElements))
-          setNotes({})
-          setSelectedYearIndex(0)
-          setSelectedQuarterIndex(0)
-          setReportSource('mock')
-          setApiError(null)
-          const profile: ZiweiProfile = {
-            id: createId(),
-            name: payload.input.name || '朋友分享',
-            input: payload.input,
-            results: ensureResults(payload.results),
-            summary: payload.summary,
-            fiveElements: ensureFiveElements(payload.fiveElements),
-            notes: {},
-            updatedAt: Date.now(),
-            source: 'mock',
-          }
-          setSelectedProfileId(profile.id)
-          persistProfile(profile)
+          applySharedReport(payload.input, payload.results, payload.summary, payload.fiveElements, 'mock')
         }
         window.history.replaceState({}, '', window.location.pathname)
       }
     }
   }, [])
 
+  const applySharedReport = (
+    input: ZiweiInput,
+    sharedResults: ZiweiTopicResult[],
+    sharedSummary: string,
+    sharedFiveElements: FiveElementState[] | undefined,
+    source: 'api' | 'mock',
+  ) => {
+    setFormState(input)
+    setResults(ensureResults(sharedResults))
+    setSummary(sharedSummary)
+    setFiveElements(ensureFiveElements(sharedFiveElements))
+    setNotes({})
+    setSelectedYearIndex(0)
+    setSelectedQuarterIndex(0)
+    setReportSource(source)
+    setApiError(null)
+    const profile: ZiweiProfile = {
+      id: createId(),
+      name: input.name || '朋友分享',
+      input,
+      results: ensureResults(sharedResults),
+      summary: sharedSummary,
+      fiveElements: ensureFiveElements(sharedFiveElements),
+      notes: {},
+      updatedAt: Date.now(),
+      source,
+    }
+    setSelectedProfileId(profile.id)
+    persistProfile(profile)
+  }
+
   const handleChange = (event: React.ChangeEvent<HTMLInputElement | HTMLSelectElement>) => {
     const target = event.target
     const { name, value, type } = target
@@ -278,9 +304,14 @@ export function ZiweiSection() {
 
   const handleShare = async () => {
     if (typeof window === 'undefined') return
-    const token = encodeSharePayload({ input: formState, summary, results, fiveElements })
+    // API 排盤的結果分享命盤令牌；範例數據沿用舊格式
+    const chartToken = reportSource === 'api' ? await createZiweiShareToken(formState) : null
     const url = new URL(window.location.href)
-    url.searchParams.set('ziwei', token)
+    if (chartToken) {
+      url.searchParams.set(CHART_SHARE_PARAM, chartToken)
+    } else {
+      url.searchParams.set('ziwei', encodeSharePayload({ input: formState, summary, results, fiveElements }))
+    }
     const shareText = url.toString()
     try {
       if (navigator.share) {
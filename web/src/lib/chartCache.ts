@@ -0,0 +1,118 @@
+const DB_NAME = 'ziwei-chart-cache'
+const DB_VERSION = 1
+const STORE = 'charts'
+const LAST_USED_INDEX = 'lastUsed'
+
+export const CHART_CACHE_LIMIT = 200
+
+export type ChartCacheEntry<T> = {
+  key: string
+  result: T
+  etag?: string
+  storedAt: number
+  lastUsed: number
+}
+
+// 無 IndexedDB（私密模式、SSR）時退回記憶體 LRU，只在本頁有效
+const memory = new Map<string, ChartCacheEntry<unknown>>()
+
+let dbPromise: Promise<IDBDatabase | null> | null = null
+
+const openDb = () => {
+  if (!dbPromise) {
+    dbPromise = new Promise((resolve) => {
+      if (typeof indexedDB === 'undefined') {
+        resolve(null)
+        return
+      }
+      try {
+        const request = indexedDB.open(DB_NAME, DB_VERSION)
+        request.onupgradeneeded = () => {
+          const store = request.result.createObjectStore(STORE, { keyPath: 'key' })
+          store.createIndex(LAST_USED_INDEX, 'lastUsed')
+        }
+        request.onsuccess = () => resolve(request.result)
+        request.onerror = () => resolve(null)
+        request.onblocked = () => resolve(null)
+      } catch {
+        resolve(null)
+      }
+    })
+  }
+  return dbPromise
+}
+
+const touchMemory = <T>(key: string) => {
+  const entry = memory.get(key) as ChartCacheEntry<T> | undefined
+  if (!entry) return undefined
+  memory.delete(key)
+  entry.lastUsed = Date.now()
+  memory.set(key, entry)
+  return entry
+}
+
+const putMemory = <T>(entry: ChartCacheEntry<T>) => {
+  memory.delete(entry.key)
+  memory.set(entry.key, entry)
+  while (memory.size > CHART_CACHE_LIMIT) {
+    const oldest = memory.keys().next().value
+    if (oldest === undefined) break
+    memory.delete(oldest)
+  }
+}
+
+export const readChart = async <T>(key: string): Promise<ChartCacheEntry<T> | undefined> => {
+  const db = await openDb()
+  if (!db) return touchMemory<T>(key)
+  return new Promise((resolve) => {
+    try {
+      const store = db.transaction(STORE, 'readwrite').objectStore(STORE)
+      const request = store.get(key)
+      request.onsuccess = () => {
+        const entry = request.result as ChartCacheEntry<T> | undefined
+        if (entry) {
+          entry.lastUsed = Date.now()
+          store.put(entry)
+        }
+        resolve(entry)
+      }
+      request.onerror = () => resolve(undefined)
+    } catch {
+      resolve(undefined)
+    }
+  })
+}
+
+export const writeChart = async <T>(entry: ChartCacheEntry<T>): Promise<void> => {
+  const db = await openDb()
+  if (!db) {
+    putMemory(entry)
+    return
+  }
+  return new Promise((resolve) => {
+    try {
+      const transaction = db.transaction(STORE, 'readwrite')
+      const store = transaction.objectStore(STORE)
+      store.put(entry)
+      const counting = store.count()
+      counting.onsuccess = () => {
+        let excess = counting.result - CHART_CACHE_LIMIT
+        if (excess <= 0) return
+        // 依最近使用時間由舊到新刪除超出上限的筆數
+        const cursorRequest = store.index(LAST_USED_INDEX).openCursor()
+        cursorRequest.onsuccess = () => {
+          const cursor = cursorRequest.result
+          if (!cursor || excess <= 0) return
+          cursor.delete()
+          excess -= 1
+          cursor.continue()
+        }
+      }
+      transaction.oncomplete = () => resolve()
+      transaction.onerror = () => resolve()
+      transaction.onabort = () => resolve()
+    } catch {
+      resolve()
+    }
+  })
+}
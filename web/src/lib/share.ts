@@ -1,3 +1,5 @@
+import type { ZiweiInput } from './ziweiMock'
+
 const isBrowser = () => typeof window !== 'undefined'
 
 const encodeBase64 = (text: string) => {
@@ -43,3 +45,50 @@ export const decodeSharePayload = <T>(token: string): T | null => {
     return null
   }
 }
+
+// 命盤分享令牌（`?chart=`）由 API 產生並解碼，令牌內含算好的命盤；
+// 表單中 API 用不到的欄位以附注隨令牌帶上（API 上限 255 位元組）
+export const CHART_SHARE_PARAM = 'chart'
+
+const SHARE_NOTE_FIELD_CHARS = 24
+
+type ShareNote = {
+  n?: string
+  c?: string
+  g?: string
+  s?: 0 | 1
+  l?: 0 | 1
+}
+
+const clip = (text: string) => Array.from(text).slice(0, SHARE_NOTE_FIELD_CHARS).join('')
+
+export const encodeShareNote = (input: ZiweiInput): string => {
+  const note: ShareNote = {
+    n: clip(input.name),
+    c: clip(input.city),
+    g: input.gender,
+    s: input.trueSolar ? 1 : 0,
+    l: input.calendar === 'lunar' ? 1 : 0,
+  }
+  return JSON.stringify(note)
+}
+
+export const decodeShareNote = (
+  note: string | undefined,
+  chart: Pick<ZiweiInput, 'date' | 'time' | 'gender'>,
+): ZiweiInput => {
+  let parsed: ShareNote = {}
+  try {
+    parsed = note ? (JSON.parse(note) as ShareNote) : {}
+  } catch {
+    parsed = {}
+  }
+  return {
+    ...chart,
+    name: parsed.n ?? '',
+    city: parsed.c ?? '',
+    gender: parsed.g ?? chart.gender,
+    trueSolar: parsed.s === 1,
+    calendar: parsed.l === 1 ? 'lunar' : 'solar',
+  }
+}
@@ -151,7 +151,8 @@ const elementAdvices: Record<FiveElementState['element'], { advice: string; colo
   水: { advice: '多補水、接觸音樂或寫作幫助內在流動。', color: '#4a6fb3' },
 }
 
-export const mockZiweiReport = async (input: ZiweiInput): Promise<ZiweiReport> => {
+// 同步產生報告模板（不含模擬延遲），API 結果會合併進這份模板
+export const buildZiweiTemplate = (input: ZiweiInput): ZiweiReport => {
   const seed = hashString(`${input.name}-${input.date}-${input.time}-${input.city}`)
   const currentYear = new Date().getFullYear()
   const results = topicTemplates.map((tpl, index) => {
@@ -255,7 +256,11 @@ export const mockZiweiReport = async (input: ZiweiInput): Promise<ZiweiReport> =
   const average = Math.round(results.reduce((acc, cur) => acc + cur.score, 0) / results.length)
   const summary = `平均 ${average} 分 · ${input.trueSolar ? '已校正真太陽時' : '未校正真太陽時'}，適合以 ${input.city} 的生活節奏為主要參考。`
 
-  await new Promise((resolve) => setTimeout(resolve, 400))
-
   return { results, summary, fiveElements }
 }
+
+export const mockZiweiReport = async (input: ZiweiInput): Promise<ZiweiReport> => {
+  const report = buildZiweiTemplate(input)
+  await new Promise((resolve) => setTimeout(resolve, 400))
+  return report
+}
@@ -1,5 +1,7 @@
 import type { FiveElementState, ZiweiInput, ZiweiReport, ZiweiTopicResult } from './ziweiMock'
-import { mockZiweiReport } from './ziweiMock'
+import { buildZiweiTemplate, mockZiweiReport } from './ziweiMock'
+import { readChart, writeChart } from './chartCache'
+import { decodeShareNote, encodeShareNote } from './share'
 
 type ApiStar = {
   name?: string
@@ -21,6 +23,7 @@ type ZiweiApiPayload = {
     basic_info?: {
       birth_date?: string
       birth_time?: string
+      gender?: string
       solar_date?: string
       lunar_date?: string
       time_chen?: string
@@ -39,6 +42,11 @@ type ZiweiApiPayload = {
       body_palace?: string
     }
   }
+  share?: {
+    version?: number
+    note?: string
+  }
+  token?: string
   message?: string
   error?: string
 }
@@ -184,6 +192,94 @@ const getApiBase = () => {
   return raw.endsWith('/') ? raw.slice(0, -1) : raw
 }
 
+// 與 API 的 Cache-Control max-age 一致：期限內直接使用快取，過期後以 ETag 重新驗證
+const CHART_FRESH_MS = 24 * 60 * 60 * 1000
+
+// 時辰索引，與 API 的 get_time_chen_index 相同（23:00–00:59 為子時，日期不變）
+const timeChenIndex = (time: string) => {
+  const [hour, minute] = time.split(':').map(Number)
+  if (!Number.isInteger(hour) || !Number.isInteger(minute)) return null
+  const total = hour * 60 + minute
+  if (total >= 23 * 60 || total < 60) return 0
+  return Math.floor((total - 60) / 120) + 1
+}
+
+// 同一天同一時辰同性別的命盤完全相同：以 (日期, 時辰, 性別) 為快取鍵，
+// 並以該時辰的代表時間請求，同一時辰內改動分鐘也共用同一個網址與 ETag
+const canonicalChart = (input: ZiweiInput) => {
+  const [year, month, day] = input.date.split('-').map(Number)
+  const chen = timeChenIndex(input.time)
+  const gender = normalizeGender(input.gender)
+  if (!year || !month || !day || chen === null) {
+    return { key: `raw|${input.date}|${input.time}|${gender}`, time: input.time, gender }
+  }
+  return {
+    key: `v1|${year}-${month}-${day}|${chen}|${gender}`,
+    time: `${String(chen * 2).padStart(2, '0')}:00`,
+    gender,
+  }
+}
+
+// 把回顯欄位換回使用者實際輸入的日期與時間
+const withEcho = (result: ZiweiApiResult, input: ZiweiInput): ZiweiApiResult => ({
+  ...result,
+  basic_info: { ...result.basic_info, birth_date: input.date, birth_time: input.time },
+})
+
+const requestChart = async (baseUrl: string, input: ZiweiInput): Promise<ZiweiApiResult> => {
+  const { key, time, gender } = canonicalChart(input)
+  const cached = await readChart<ZiweiApiResult>(key)
+  if (cached && Date.now() - cached.storedAt < CHART_FRESH_MS) {
+    return cached.result
+  }
+
+  const query = new URLSearchParams({ birth_datetime: `${input.date} ${time}`, gender })
+  let response: Response
+  try {
+    response = await fetch(`${baseUrl}/calculate?${query}`, {
+      headers: cached?.etag ? { 'If-None-Match': cached.etag } : undefined,
+    })
+  } catch (error) {
+    // 離線時沿用過期的命盤
+    if (cached) return cached.result
+    throw error
+  }
+
+  const now = Date.now()
+  if (response.status === 304 && cached) {
+    void writeChart({ ...cached, storedAt: now, lastUsed: now })
+    return cached.result
+  }
+  if (!response.ok) {
+    throw new Error(`API 回應 ${response.status}`)
+  }
+
+  const payload = (await response.json()) as ZiweiApiPayload
+  if (!payload.success || !payload.result) {
+    throw new Error(payload.error || payload.message || 'API 回傳資料異常')
+  }
+  void writeChart({
+    key,
+    result: payload.result,
+    etag: response.headers.get('ETag') ?? undefined,
+    storedAt: now,
+    lastUsed: now,
+  })
+  return payload.result
+}
+
+// 相同命盤的請求在完成前只發出一次
+const inflight = new Map<string, Promise<ZiweiApiResult>>()
+
+const loadChart = (baseUrl: string, input: ZiweiInput) => {
+  const { key } = canonicalChart(input)
+  const pending = inflight.get(key)
+  if (pending) return pending
+  const request = requestChart(baseUrl, input).finally(() => inflight.delete(key))
+  inflight.set(key, request)
+  return request
+}
+
 export type ZiweiReportResponse = {
   report: ZiweiReport
   source: 'api' | 'mock'
@@ -191,47 +287,75 @@ export type ZiweiReportResponse = {
 }
 
 export const fetchZiweiReport = async (input: ZiweiInput): Promise<ZiweiReportResponse> => {
-  const fallbackPromise = mockZiweiReport(input)
   const baseUrl = getApiBase()
 
   if (!baseUrl) {
     return {
-      report: await fallbackPromise,
+      report: await mockZiweiReport(input),
       source: 'mock',
       error: '尚未設定 VITE_ZIWEI_API_BASE_URL，使用範例數據',
     }
   }
 
   try {
-    const response = await fetch(`${baseUrl}/calculate`, {
+    const result = await loadChart(baseUrl, input)
+    return {
+      report: mergeApiIntoReport(buildZiweiTemplate(input), withEcho(result, input)),
+      source: 'api',
+    }
+  } catch (error) {
+    return {
+      report: buildZiweiTemplate(input),
+      source: 'mock',
+      error: error instanceof Error ? error.message : '無法連線到 Ziwei API',
+    }
+  }
+}
+
+// 產生命盤分享令牌；未設定 API 或失敗時回傳 null，由呼叫端改用舊的分享格式
+export const createZiweiShareToken = async (input: ZiweiInput): Promise<string | null> => {
+  const baseUrl = getApiBase()
+  if (!baseUrl) return null
+  try {
+    const response = await fetch(`${baseUrl}/charts`, {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify({
         birth_datetime: `${input.date} ${input.time}`,
         gender: normalizeGender(input.gender),
+        note: encodeShareNote(input),
       }),
     })
+    if (!response.ok) return null
+    const payload = (await response.json()) as ZiweiApiPayload
+    return payload.success && payload.token ? payload.token : null
+  } catch {
+    return null
+  }
+}
 
-    if (!response.ok) {
-      throw new Error(`API 回應 ${response.status}`)
-    }
+export type SharedZiweiReport = {
+  input: ZiweiInput
+  report: ZiweiReport
+}
 
+// 開啟分享連結：API 只解碼令牌，不重新排盤
+export const fetchSharedZiweiReport = async (token: string): Promise<SharedZiweiReport | null> => {
+  const baseUrl = getApiBase()
+  if (!baseUrl) return null
+  try {
+    const response = await fetch(`${baseUrl}/charts/${encodeURIComponent(token)}`)
+    if (!response.ok) return null
     const payload = (await response.json()) as ZiweiApiPayload
-    if (!payload.success || !payload.result) {
-      throw new Error(payload.error || payload.message || 'API 回傳資料異常')
-    }
-
-    const template = await fallbackPromise
-    return {
-      report: mergeApiIntoReport(template, payload.result),
-      source: 'api',
-    }
-  } catch (error) {
-    const fallback = await fallbackPromise
-    return {
-      report: fallback,
-      source: 'mock',
-      error: error instanceof Error ? error.message : '無法連線到 Ziwei API',
-    }
+    if (!payload.success || !payload.result) return null
+    const basicInfo = payload.result.basic_info
+    const input = decodeShareNote(payload.share?.note, {
+      date: basicInfo?.birth_date ?? '',
+      time: basicInfo?.birth_time ?? '',
+      gender: basicInfo?.gender ?? 'female',
+    })
+    return { input, report: mergeApiIntoReport(buildZiweiTemplate(input), payload.result) }
+  } catch {
+    return null
   }
 }